@@ -249,6 +249,18 @@ def calibrate_confidence_scores():
         loss = -np.mean(labels * np.log(probs + 1e-10))
         return loss
     
+    # Validation images come straight from the compiled, memory-mapped shards
+    # (python compile_dataset.py --size 320 --enhance), no JPEG decoding
+    from sklearn.model_selection import train_test_split
+    from app.utils.shards import ShardedDataset
+    shards = ShardedDataset.open(img_size=320, enhance=True)
+    # Same validation split as train_model.py (VALIDATION_SPLIT=0.2, RANDOM_STATE=42)
+    _, val_indices = train_test_split(
+        np.arange(len(shards)), test_size=0.2, random_state=42, stratify=shards.labels
+    )
+    val_images = shards.images(val_indices).astype('float32') / 255.0
+    val_labels = np.eye(len(shards.classes))[shards.labels[val_indices]]
+    
     # Get predictions on validation set
     val_logits = model(val_images, training=False)  # Raw outputs
     
@@ -357,36 +369,37 @@ def k_fold_cross_validation(k=5):
     Better: Average performance across k different splits
     
     For medical AI: More trustworthy accuracy estimates
+    
+    Folds are grouped by lesion_id: HAM10000 has several photos of most
+    lesions, and a plain KFold puts photos of the same lesion on both sides
+    of a split, which inflates accuracy. Each fold trains only the head on
+    cached backbone features, so folds take seconds and run in parallel.
+    
+    Command line equivalent (sweeps head hyperparameters too):
+        python run_experiments.py --name baseline --random 20 --export
+        python train_model.py --feature-cache --head-config
     """
-    from sklearn.model_selection import KFold
+    from app.utils.experiments import group_folds, run_trial
+    from train_model import SkinDiseaseTrainer
     
-    kf = KFold(n_splits=k, shuffle=True, random_state=42)
-    fold_scores = []
+    # Backbone runs once per image (plus augmented views), then cached on disk
+    trainer = SkinDiseaseTrainer()
+    features, labels, groups = trainer.cached_features(views=4)
     
-    for fold_idx, (train_idx, val_idx) in enumerate(kf.split(images)):
-        print(f"\n{'='*50}")
-        print(f"Training Fold {fold_idx + 1}/{k}")
-        print(f"{'='*50}")
-        
-        # Create fresh model
-        model = build_improved_model()
-        
-        # Training
-        history = model.fit(
-            images[train_idx], labels[train_idx],
-            validation_data=(images[val_idx], labels[val_idx]),
-            epochs=20,
-            callbacks=[EarlyStopping(monitor='val_loss', patience=3)]
-        )
-        
-        # Evaluate
-        val_loss, val_acc = model.evaluate(images[val_idx], labels[val_idx])
-        fold_scores.append(val_acc)
-        
-        print(f"Fold {fold_idx + 1} Accuracy: {val_acc:.3f}")
+    folds = group_folds(labels, groups, k)
+    result = run_trial(
+        {'dense_units': (256, 128), 'dropout': 0.3, 'learning_rate': 1e-3, 'class_weight': None},
+        np.asarray(features, dtype='float32'), labels, folds
+    )
+    
+    fold_scores = [fold['accuracy'] for fold in result['folds']]
+    for fold in result['folds']:
+        print(f"Fold {fold['fold'] + 1} Accuracy: {fold['accuracy']:.3f} "
+              f"(balanced {fold['balanced_accuracy']:.3f})")
     
     print(f"\n{'='*50}")
-    print(f"Average Accuracy: {np.mean(fold_scores):.3f} ± {np.std(fold_scores):.3f}")
+    print(f"Average Accuracy: {result['mean_accuracy']:.3f} ± {result['std_accuracy']:.3f}")
+    print(f"Average Balanced Accuracy: {result['mean_balanced_accuracy']:.3f} ± {result['std_balanced_accuracy']:.3f}")
     print(f"{'='*50}")
     
     return fold_scores
@@ -434,43 +447,63 @@ print("✅ Model saved successfully")
 # EXAMPLE 8: COMPARE OLD VS NEW MODEL
 # ============================================================================
 
-def compare_models():
+def compare_models(models=None, baseline='production', use_shards=False):
     """
-    Test both old and new models on same images
-    Show improvement percentage
+    Test old and new models on the same validation images
+    Show per-class changes and whether the difference is significant
+    
+    Each model is run over the validation split once; its probabilities are
+    cached by model file hash, so re-comparing (or adding a third model)
+    only runs models that are new or retrained.
+    
+    Command line equivalent:
+        python compare_models.py --register candidate=ml_models/best_model.h5
+        python compare_models.py --baseline production
     """
-    old_model = tf.keras.models.load_model('ml_models/resnet_model.h5')
-    new_model = tf.keras.models.load_model('ml_models/best_model.h5')
+    import numpy as np
+    from app.utils.model_comparison import (
+        PredictionCache, compare_predictions, dataset_hash, format_comparison, model_version,
+        prediction_key
+    )
+    from compare_models import ENHANCE_IMAGES, CROP_LESIONS, predict_model, validation_split
     
-    # Test on hold-out set
-    old_preds = old_model.predict(test_images)
-    new_preds = new_model.predict(test_images)
+    models = models or {
+        'production': 'ml_models/resnet_model.h5',
+        'candidate': 'ml_models/best_model.h5',
+    }
     
-    old_acc = np.mean(np.argmax(old_preds, axis=1) == np.argmax(test_labels, axis=1))
-    new_acc = np.mean(np.argmax(new_preds, axis=1) == np.argmax(test_labels, axis=1))
+    image_ids, labels, classes, make_dataset = validation_split(use_shards)
+    labels = np.asarray(labels, dtype=np.int64)
+    set_hash = dataset_hash(image_ids, labels)
+    cache = PredictionCache()
+    
+    probabilities = {}
+    for name, path in models.items():
+        key = prediction_key(model_version(path), f"enh{int(ENHANCE_IMAGES)}_crop{int(CROP_LESIONS)}")
+        probabilities[name] = cache.get_or_predict(
+            set_hash, key, labels, lambda: predict_model(path, make_dataset, labels, len(classes)),
+            metadata={'name': name, 'path': path}
+        )
     
-    improvement = (new_acc - old_acc) * 100
+    report = compare_predictions(probabilities, labels, len(classes), baseline)
     
-    print(f"""
+    old_acc = report['metrics'][baseline]['accuracy']
+    for name, delta in report['deltas'].items():
+        improvement = delta['accuracy'] * 100
+        print(f"""
     {'='*50}
-    MODEL COMPARISON
+    MODEL COMPARISON: {name} vs {baseline}
     {'='*50}
     Old Model Accuracy: {old_acc:.1%}
-    New Model Accuracy: {new_acc:.1%}
+    New Model Accuracy: {report['metrics'][name]['accuracy']:.1%}
     Improvement:        {improvement:+.1f}% {'✅' if improvement > 0 else '❌'}
     {'='*50}
     """)
     
-    # Per-class improvement
-    old_correct = np.argmax(old_preds, axis=1) == np.argmax(test_labels, axis=1)
-    new_correct = np.argmax(new_preds, axis=1) == np.argmax(test_labels, axis=1)
+    # Per-class recall changes, McNemar significance and prediction agreement
+    print(format_comparison(report, classes))
     
-    for i, disease in enumerate(class_names):
-        mask = np.argmax(test_labels, axis=1) == i
-        if mask.sum() > 0:
-            old_class_acc = old_correct[mask].mean()
-            new_class_acc = new_correct[mask].mean()
-            print(f"{disease:20}: {old_class_acc:.1%} → {new_class_acc:.1%} ({(new_class_acc - old_class_acc)*100:+.1f}%)")
+    return report
 
 
 if __name__ == "__main__":
@@ -486,6 +519,7 @@ if __name__ == "__main__":
     4. calibrate_confidence_scores() - Make confidence trustworthy
     5. comprehensive_evaluation() - Full medical evaluation
     6. k_fold_cross_validation() - Robust accuracy testing
+    7. compare_models() - Old vs new model on cached predictions
     
     Remember: Medical AI > Raw Accuracy
     Focus on: Recall for serious conditions, Calibrated confidence
@@ -1,6 +1,7 @@
 """Database models for GlowGuard"""
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 from datetime import datetime
 
 Base = declarative_base()
@@ -31,6 +32,11 @@ class Prediction(Base):
     description = Column(Text)
     causes = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    model_version = Column(String, nullable=True)
+    backbone_version = Column(String, nullable=True, index=True)
+    # Pooled backbone features as float16 bytes (STORE_EMBEDDINGS); deferred so
+    # normal queries and API responses never load them
+    embedding = deferred(Column(LargeBinary, nullable=True))
 
 class Recommendation(Base):
     __tablename__ = "recommendations"
@@ -1,14 +1,21 @@
 """Prediction routes"""
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse
 from sqlalchemy.orm import Session
-from app.schemas import PredictionResponse, SkinAnalysisResult, AnalysisCombinedResponse
+from app.schemas import PredictionResponse, SkinAnalysisResult, AnalysisCombinedResponse, ImageQualityReport, ExplanationStatus
 from app.models import Prediction, User, Recommendation, Product
 from app.utils.database import get_db
 from app.utils.auth import verify_token
-from app.utils.image_processing import save_uploaded_file, validate_image, process_image
+from app.utils.image_processing import save_uploaded_file, validate_image, load_image, prepare_model_input
+from app.utils.image_quality import ImageQualityGate
 from app.utils.ml_model import SkinDiseasePredictor, DiseaseDatabaseHandler
+from app.utils.embeddings import STORE_EMBEDDINGS
+from app.utils.explanations import METHODS, ExplanationWorker, explanation_path, save_model_input
 from app.utils.recommendations import RecommendationEngine
 from typing import Optional
+import os
+import threading
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 router = APIRouter()
@@ -17,6 +24,25 @@ security = HTTPBearer()
 # Initialize predictor
 predictor = SkinDiseasePredictor()
 
+# Rejects blurry / badly exposed / non-skin photos before inference
+quality_gate = ImageQualityGate()
+
+# Grad-CAM heatmaps; the background worker starts on the first explanation request
+explanation_worker = None
+explanation_worker_lock = threading.Lock()
+# Longest an explanation request may block with ?wait=
+MAX_EXPLANATION_WAIT = 30.0
+
+def get_explanation_worker() -> ExplanationWorker:
+    global explanation_worker
+    # Concurrent first requests must not start two workers (two copies of the model)
+    with explanation_worker_lock:
+        if explanation_worker is None:
+            explanation_worker = ExplanationWorker(
+                predictor.model, prepare_model_input, predictor.model_versions()['model_version']
+            )
+    return explanation_worker
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
     """Get current authenticated user"""
     payload = verify_token(credentials.credentials)
@@ -59,13 +85,34 @@ async def analyze_skin(
                 detail="Invalid image file"
             )
         
+        # Decode and resize, then gate on quality before any model or DB work
+        pixels = load_image(file_path, enhance=False)
+        
+        quality = quality_gate.assess(pixels)
+        if not quality["passed"]:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail={
+                    "message": "Image quality is too low for a reliable analysis",
+                    "quality": ImageQualityReport(**quality).model_dump()
+                }
+            )
+        
+        # Kept for explanations, which then skip decoding the upload again
+        save_model_input(file_path, pixels)
+        
         # Process image
-        processed_img = process_image(file_path)
+        processed_img = prepare_model_input(pixels)
         
         # ============================================================================
         # NEW: Get TOP-3 predictions for differential diagnosis
         # ============================================================================
-        top_3_predictions = predictor.predict_top_3(processed_img)
+        # With STORE_EMBEDDINGS the pooled features come out of the same forward pass
+        embedding = None
+        if STORE_EMBEDDINGS:
+            top_3_predictions, embedding = predictor.predict_top_3_with_embedding(processed_img)
+        else:
+            top_3_predictions = predictor.predict_top_3(processed_img)
         
         # Ensure at least one prediction
         if not top_3_predictions:
@@ -93,7 +140,9 @@ async def analyze_skin(
             confidence=float(confidence),
             severity=severity,
             description=disease_info.get("description", ""),
-            causes=", ".join(disease_info.get("causes", []))
+            causes=", ".join(disease_info.get("causes", [])),
+            embedding=embedding,
+            **predictor.model_versions()
         )
         
         db.add(db_prediction)
@@ -153,6 +202,7 @@ async def analyze_skin(
         
         # Add top-3 predictions to response
         response.top_3_predictions = top_3_predictions
+        response.quality = ImageQualityReport(**quality)
         response.medical_disclaimer = (
             "⚠️ MEDICAL DISCLAIMER:\n"
             "This AI tool provides preliminary analysis for educational purposes only. "
@@ -170,6 +220,11 @@ async def analyze_skin(
             detail=f"Error analyzing image: {str(e)}"
         )
 
+@router.get("/quality/metrics")
+async def get_quality_metrics(current_user: User = Depends(get_current_user)):
+    """Image quality gate thresholds and rejection rates by reason"""
+    return quality_gate.get_metrics()
+
 @router.get("/history/{user_id}")
 async def get_prediction_history(
     user_id: int,
@@ -183,6 +238,69 @@ async def get_prediction_history(
     predictions = db.query(Prediction).filter(Prediction.user_id == user_id).all()
     return predictions
 
+@router.get("/{prediction_id}/explanation")
+async def get_prediction_explanation(
+    prediction_id: int,
+    method: str = "gradcam",
+    wait: float = 0,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Grad-CAM heatmap of the image regions that drove a prediction
+    
+    Returns the cached PNG immediately when it exists. Otherwise the heatmap
+    is queued for the background worker and 202 is returned with its
+    status; poll again, or pass wait=<seconds> to block until it is ready.
+    
+    - method: gradcam or gradcam++
+    """
+    if method not in METHODS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"method must be one of {list(METHODS)}")
+    
+    prediction = db.query(Prediction).filter(Prediction.id == prediction_id).first()
+    
+    if not prediction:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Prediction not found")
+    
+    if prediction.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    
+    if not prediction.image_path or not os.path.exists(prediction.image_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image no longer available")
+    
+    # Explain the stored diagnosis; names outside the model's classes fall back to the top class
+    class_idx = {label: idx for idx, label in predictor.class_labels.items()}.get(prediction.disease_name)
+    heatmap = explanation_path(prediction.image_path, method, predictor.model_versions()['model_version'], class_idx)
+    if heatmap.exists():
+        return FileResponse(heatmap, media_type="image/png")
+    
+    worker = get_explanation_worker()
+    state = worker.request(prediction.image_path, method, class_idx)
+    if state == "ready":
+        return FileResponse(heatmap, media_type="image/png")
+    
+    if state == "pending" and wait > 0:
+        await run_in_threadpool(
+            worker.wait, prediction.image_path, method, class_idx, min(wait, MAX_EXPLANATION_WAIT)
+        )
+        if heatmap.exists():
+            return FileResponse(heatmap, media_type="image/png")
+        if worker.error(prediction.image_path, method, class_idx):
+            state = "failed"
+    
+    if state == "failed":
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=worker.error(prediction.image_path, method, class_idx)
+        )
+    
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=ExplanationStatus(prediction_id=prediction_id, method=method, status=state).model_dump(),
+        headers={"Retry-After": "1"}
+    )
+
 @router.get("/{prediction_id}")
 async def get_prediction(
     prediction_id: int,
@@ -84,6 +84,20 @@ class DifferentialDiagnosis(BaseModel):
     confidence: float
     class_idx: int
 
+# Image quality gate
+class ImageQualityReport(BaseModel):
+    passed: bool
+    reasons: List[str]
+    feedback: List[str]
+    metrics: dict
+
+# Explanation heatmaps (while not yet rendered)
+class ExplanationStatus(BaseModel):
+    prediction_id: int
+    method: str
+    status: str  # pending, failed
+    detail: Optional[str] = None
+
 # Analysis Result Schemas
 class SkinAnalysisResult(BaseModel):
     disease_name: str
@@ -102,6 +116,7 @@ class AnalysisCombinedResponse(BaseModel):
     recommendations: List[RecommendationResponse]
     top_3_predictions: Optional[List[DifferentialDiagnosis]] = None
     medical_disclaimer: Optional[str] = None
+    quality: Optional[ImageQualityReport] = None
 
 # Auth Schemas
 class TokenResponse(BaseModel):
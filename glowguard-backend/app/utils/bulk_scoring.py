@@ -0,0 +1,309 @@
+"""
+Offline bulk scoring
+Images are decoded and preprocessed by a pool of processes, in bounded
+chunks so memory stays flat on archives of any size, while the main process
+runs the model on large batches. Results are appended to a CSV file or to a
+directory of Parquet parts after every batch, so an interrupted run resumes
+by skipping the image ids already in the output.
+"""
+
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.utils.data_loader import DatasetCatalog
+from app.utils.evaluation import StreamingEvaluator
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff'}
+# Images per decode task
+DECODE_CHUNK_SIZE = 32
+# Decode tasks in flight per worker; bounds memory when inference is the bottleneck
+CHUNKS_IN_FLIGHT = 2
+
+
+def find_images(image_dir) -> pd.DataFrame:
+    """
+    Every image under image_dir, recursively
+    
+    Returns:
+        DataFrame with image_id (path relative to image_dir, without the
+        extension) and path, sorted by image_id
+    """
+    image_dir = Path(image_dir)
+    paths = sorted(p for p in image_dir.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    return pd.DataFrame({
+        'image_id': [p.relative_to(image_dir).with_suffix('').as_posix() for p in paths],
+        'path': [str(p) for p in paths],
+    })
+
+
+def scoring_inputs(image_dir, ground_truth=None) -> pd.DataFrame:
+    """
+    Images to score, with their ground-truth label when a label CSV is given
+    
+    The CSV may be HAM10000-style metadata or the one-hot ISIC2018 format.
+    Labelled images missing from image_dir are reported and skipped.
+    
+    Returns:
+        DataFrame with image_id, path and (with ground truth) label
+    """
+    images = find_images(image_dir)
+    if ground_truth is None:
+        return images
+    
+    labels = DatasetCatalog._read_labels(Path(ground_truth))[['image_id', 'dx']]
+    frame = labels.merge(images, on='image_id', how='left').rename(columns={'dx': 'label'})
+    missing = int(frame['path'].isna().sum())
+    if missing:
+        print(f"{missing} labelled images not found under {image_dir}; skipped")
+    return frame.dropna(subset=['path'])[['image_id', 'path', 'label']].reset_index(drop=True)
+
+
+def _decode_chunk(paths: List[str], img_size: int) -> Tuple[np.ndarray, List[Tuple[int, str]]]:
+    """
+    Model-ready uint8 pixels for a chunk of files, as served by the API
+    
+    Returns:
+        Tuple of (uint8 array [decoded, size, size, 3], [(position in chunk,
+        error message)] for files that failed)
+    """
+    from app.utils.image_processing import load_image
+    
+    images, errors = [], []
+    for i, path in enumerate(paths):
+        try:
+            images.append(load_image(path, (img_size, img_size)))
+        except Exception as e:
+            errors.append((i, str(e) or type(e).__name__))
+    pixels = np.stack(images) if images else np.zeros((0, img_size, img_size, 3), dtype=np.uint8)
+    return pixels, errors
+
+
+def decode_images(paths: Sequence[str], img_size: int, workers: Optional[int] = None,
+                  chunk_size: int = DECODE_CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray, List[Tuple[int, str]]]]:
+    """
+    Decode paths in a process pool, yielding chunks in input order
+    
+    At most CHUNKS_IN_FLIGHT chunks per worker are pending at once, so
+    decoded pixels never pile up while the consumer is busy.
+    
+    Yields:
+        Tuple of (positions of the decoded images in paths, uint8 pixels,
+        [(position, error message)] for failures)
+    """
+    workers = workers or os.cpu_count() or 1
+    starts = iter(range(0, len(paths), chunk_size))
+    pending = deque()
+    # Spawn, not fork: the scoring process has TensorFlow loaded
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        def submit():
+            start = next(starts, None)
+            if start is not None:
+                pending.append((start, executor.submit(_decode_chunk, list(paths[start:start + chunk_size]), img_size)))
+        
+        for _ in range(workers * CHUNKS_IN_FLIGHT):
+            submit()
+        while pending:
+            start, future = pending.popleft()
+            pixels, errors = future.result()
+            submit()
+            failed = {i for i, _ in errors}
+            count = min(chunk_size, len(paths) - start)
+            positions = np.array([start + i for i in range(count) if i not in failed], dtype=np.int64)
+            yield positions, pixels, [(start + i, message) for i, message in errors]
+
+
+def decoded_batches(paths: Sequence[str], img_size: int, batch_size: int, workers: Optional[int] = None
+                    ) -> Iterator[Tuple[np.ndarray, np.ndarray, List[Tuple[int, str]]]]:
+    """
+    decode_images regrouped into model batches of batch_size images
+    
+    Yields:
+        Tuple of (positions, float32 inputs in [0, 1], failures since the
+        previous batch); the input buffer is reused by the next batch
+    """
+    buffer = np.empty((batch_size, img_size, img_size, 3), dtype=np.float32)
+    positions, errors, filled = [], [], 0
+    
+    for chunk_positions, pixels, chunk_errors in decode_images(paths, img_size, workers):
+        errors.extend(chunk_errors)
+        offset = 0
+        while offset < len(pixels):
+            take = min(batch_size - filled, len(pixels) - offset)
+            np.multiply(pixels[offset:offset + take], np.float32(1 / 255), out=buffer[filled:filled + take])
+            positions.extend(chunk_positions[offset:offset + take])
+            filled += take
+            offset += take
+            if filled == batch_size:
+                yield np.array(positions, dtype=np.int64), buffer, errors
+                positions, errors, filled = [], [], 0
+    
+    if filled or errors:
+        yield np.array(positions, dtype=np.int64), buffer[:filled], errors
+
+
+def score_rows(frame: pd.DataFrame, probabilities: np.ndarray, class_names: Sequence[str],
+               version: str) -> pd.DataFrame:
+    """
+    Output rows for scored images
+    
+    Args:
+        frame: Input rows (image_id, path, optional label) of the images
+        probabilities: [N, K] class probabilities
+        class_names: Name of every model output
+        version: Model version written on every row
+    
+    Returns:
+        DataFrame with the input columns, predicted class and confidence,
+        the top 3 as 'name:probability|...', one prob_<class> column per
+        class, model_version and error (empty)
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    predicted = probabilities.argmax(axis=1)
+    top_3 = np.argsort(-probabilities, axis=1)[:, :3]
+    
+    rows = frame.reset_index(drop=True).copy()
+    rows['predicted'] = [class_names[i] for i in predicted]
+    rows['confidence'] = probabilities[np.arange(len(predicted)), predicted]
+    rows['top_3'] = ["|".join(f"{class_names[i]}:{p[i]:.4f}" for i in order)
+                     for order, p in zip(top_3, probabilities)]
+    for c, name in enumerate(class_names):
+        rows[f"prob_{name}"] = probabilities[:, c]
+    rows['model_version'] = version
+    rows['error'] = ""
+    return rows
+
+
+def error_rows(frame: pd.DataFrame, messages: Sequence[str], version: str) -> pd.DataFrame:
+    """Output rows for images that could not be decoded; they are not retried on restart"""
+    rows = frame.reset_index(drop=True).copy()
+    rows['model_version'] = version
+    rows['error'] = list(messages)
+    return rows
+
+
+def output_columns(class_names: Sequence[str], labelled: bool) -> List[str]:
+    """Column order of the scoring output (see score_rows)"""
+    return (['image_id', 'path'] + (['label'] if labelled else [])
+            + ['predicted', 'confidence', 'top_3'] + [f"prob_{name}" for name in class_names]
+            + ['model_version', 'error'])
+
+
+class ScoreWriter:
+    """
+    Append-only scoring output with a fixed set of columns
+    
+    A .csv path is appended to after every batch; an interrupted write
+    leaves at most a partial last line, which is cut off on reopening. Any
+    other path (e.g. scores.parquet) is a directory of Parquet part files,
+    each written under a temporary name and renamed, which
+    pandas.read_parquet reads as one table.
+    """
+    
+    def __init__(self, path, columns: Sequence[str]):
+        self.path = Path(path)
+        self.columns = list(columns)
+        self.parquet = self.path.suffix.lower() != '.csv'
+        if self.parquet:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError("Parquet output needs pyarrow (pip install pyarrow); "
+                                  "or write a .csv file instead")
+        else:
+            self._truncate_partial_line()
+        
+        existing = self.existing_columns()
+        if existing is not None and existing != self.columns:
+            raise ValueError(f"{self.path} has columns {existing}, this run writes {self.columns}")
+    
+    def _truncate_partial_line(self):
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+    
+    def exists(self) -> bool:
+        if self.parquet:
+            return self.path.is_dir() and any(self.path.glob("part-*.parquet"))
+        return self.path.exists() and self.path.stat().st_size > 0
+    
+    def existing_columns(self) -> Optional[List[str]]:
+        """Columns of the output already on disk, or None before the first batch"""
+        if not self.exists():
+            return None
+        if self.parquet:
+            import pyarrow.parquet as pq
+            return list(pq.read_schema(next(iter(sorted(self.path.glob("part-*.parquet"))))).names)
+        return list(pd.read_csv(self.path, nrows=0).columns)
+    
+    def read(self) -> pd.DataFrame:
+        """Every row written so far (no rows before the first batch)"""
+        if not self.exists():
+            return pd.DataFrame(columns=self.columns)
+        if self.parquet:
+            return pd.read_parquet(self.path)
+        # Only empty cells are missing: image ids and labels such as 'NA' stay strings
+        return pd.read_csv(self.path, dtype={'image_id': str, 'label': str, 'model_version': str},
+                           keep_default_na=False, na_values=[""])
+    
+    def _conform(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """Fixed columns and dtypes, so error-only batches match the others (Parquet parts must)"""
+        rows = rows.reindex(columns=self.columns)
+        for column in self.columns:
+            numeric = column == 'confidence' or column.startswith('prob_')
+            rows[column] = rows[column].astype(np.float32 if numeric else 'string')
+        return rows
+    
+    def append(self, rows: pd.DataFrame) -> None:
+        if rows.empty:
+            return
+        rows = self._conform(rows)
+        if self.parquet:
+            self.path.mkdir(parents=True, exist_ok=True)
+            part = self.path / f"part-{len(list(self.path.glob('part-*.parquet'))):06d}.parquet"
+            tmp_path = part.with_name(f"{part.stem}.tmp")
+            rows.to_parquet(tmp_path, index=False)
+            tmp_path.replace(part)
+            return
+        header = not self.exists()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', newline='') as f:
+            rows.to_csv(f, header=header, index=False)
+            f.flush()
+
+
+def scored_metrics(scores: pd.DataFrame, class_names: Sequence[str]) -> Optional[dict]:
+    """
+    Accuracy and per-class metrics over the labelled, successfully scored rows
+    
+    Labels are matched to class names case-insensitively; rows whose label
+    is not one of the model's classes are counted but left out.
+    
+    Returns:
+        StreamingEvaluator.result() plus 'unmatched_labels', or None when
+        no row has a usable label
+    """
+    if 'label' not in scores.columns:
+        return None
+    index = {name.lower(): c for c, name in enumerate(class_names)}
+    scored = scores[scores['error'].fillna("") == ""]
+    labels = scored['label'].astype(str).str.lower().map(index)
+    matched = labels.notna()
+    if not matched.any():
+        return None
+    
+    probabilities = scored.loc[matched, [f"prob_{name}" for name in class_names]].to_numpy(dtype=np.float32)
+    evaluator = StreamingEvaluator.from_predictions(labels[matched].to_numpy(dtype=np.int64), probabilities,
+                                                    len(class_names))
+    result = evaluator.result()
+    result['unmatched_labels'] = int((~matched).sum())
+    return result
@@ -4,8 +4,12 @@ Handles loading and preprocessing of HAM10000 and ISIC2018 datasets
 """
 
 import os
+import json
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
 # Define base paths
 BASE_DIR = Path(__file__).parent.parent.parent  # glowguard-backend/
 DATA_DIR = BASE_DIR / "ml_models" / "training_data"
@@ -20,6 +24,14 @@ ISIC2018_DIR = DATA_DIR / "ISIC2018"
 ISIC2018_TEST_IMAGES = ISIC2018_DIR / "ISIC2018_Task3_Test_Images"
 ISIC2018_GROUND_TRUTH = ISIC2018_DIR / "ISIC2018_Task3_Test_GroundTruth.csv"
 
+# Cached catalog index
+CATALOG_CACHE = DATA_DIR / "catalog_cache.pkl"
+# Per-file integrity results written by scan_dataset.py (app.utils.integrity)
+INTEGRITY_MANIFEST = DATA_DIR / "integrity_manifest.csv"
+
+# Low-cardinality columns stored as pandas categoricals
+CATEGORICAL_COLUMNS = ['lesion_id', 'dx', 'dx_type', 'sex', 'localization', 'dataset', 'source']
+
 
 def verify_dataset_structure():
     """Verify that all required dataset files exist"""
@@ -64,6 +76,175 @@ def get_isic2018_image_paths():
     return []
 
 
+class DatasetCatalog:
+    """
+    Vectorised index of every training image: image_id -> path, label, lesion_id, metadata
+    
+    Built from one directory scan per image folder and a merge with the
+    metadata CSVs, then cached to disk. The cache is keyed on the size and
+    mtime of the CSVs and image folders, so it rebuilds only when they change.
+    
+    When an integrity manifest exists (scan_dataset.py), images it found
+    corrupt, truncated or too small are left out, and their checksum and
+    dimensions are added as columns.
+    """
+    
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+    
+    def __len__(self):
+        return len(self.frame)
+    
+    @property
+    def classes(self):
+        """Sorted diagnosis codes; label index i corresponds to classes[i]"""
+        return list(self.frame['dx'].cat.categories)
+    
+    @property
+    def paths(self) -> np.ndarray:
+        return self.frame['path'].to_numpy()
+    
+    @property
+    def labels(self) -> np.ndarray:
+        """Integer class labels (codes into `classes`)"""
+        return self.frame['dx'].cat.codes.to_numpy()
+    
+    @property
+    def groups(self) -> np.ndarray:
+        """lesion_id per image, for grouped splits"""
+        return self.frame['lesion_id'].astype(str).to_numpy()
+    
+    def subset(self, source: str) -> 'DatasetCatalog':
+        """Images from one dataset ('HAM10000' or 'ISIC2018')"""
+        return DatasetCatalog(self.frame[self.frame['source'] == source])
+    
+    @staticmethod
+    def _scan_images(directories) -> dict:
+        """Map image_id -> path with a single os.scandir pass per directory"""
+        index = {}
+        for directory in directories:
+            if not directory.exists():
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.lower().endswith('.jpg') and entry.is_file():
+                        index[name[:-4]] = entry.path
+        return index
+    
+    @staticmethod
+    def _read_labels(csv_path: Path) -> pd.DataFrame:
+        """Read a HAM10000-style metadata CSV (one-hot ISIC ground truth is converted)"""
+        frame = pd.read_csv(csv_path)
+        
+        if 'dx' not in frame.columns:
+            # Official ISIC2018 Task 3 format: image,MEL,NV,BCC,AKIEC,BKL,DF,VASC
+            frame = frame.rename(columns={'image': 'image_id'})
+            class_columns = [c for c in frame.columns if c != 'image_id']
+            frame['dx'] = frame[class_columns].idxmax(axis=1).str.lower()
+            frame = frame[['image_id', 'dx']]
+        
+        if 'lesion_id' not in frame.columns:
+            # Without lesion ids every image is its own group
+            frame['lesion_id'] = frame['image_id']
+        
+        return frame
+    
+    @staticmethod
+    def _fingerprint() -> dict:
+        """Size/mtime of every input the catalog depends on"""
+        fingerprint = {}
+        for path in [HAM10000_METADATA, HAM10000_IMAGES_PART1, HAM10000_IMAGES_PART2,
+                     ISIC2018_GROUND_TRUTH, ISIC2018_TEST_IMAGES, INTEGRITY_MANIFEST]:
+            if path.exists():
+                stat = path.stat()
+                fingerprint[str(path)] = [stat.st_size, stat.st_mtime_ns]
+        return fingerprint
+    
+    @staticmethod
+    def _apply_manifest(frame: pd.DataFrame) -> pd.DataFrame:
+        """Drop images the integrity manifest rejected and attach checksum/width/height"""
+        if not INTEGRITY_MANIFEST.exists():
+            return frame
+        
+        manifest = pd.read_csv(INTEGRITY_MANIFEST, usecols=['path', 'checksum', 'width', 'height', 'status'],
+                               dtype={'path': str, 'checksum': str})
+        manifest = manifest.dropna(subset=['path']).drop_duplicates('path').set_index('path')
+        
+        # Images scanned after the manifest was written are kept until the next scan
+        status = frame['path'].map(manifest['status'])
+        bad = status.notna() & (status != 'ok')
+        if bad.any():
+            print(f"Integrity manifest: excluding {int(bad.sum())} unusable images")
+        
+        frame = frame[~bad].copy()
+        for column in ['checksum', 'width', 'height']:
+            frame[column] = frame['path'].map(manifest[column])
+        return frame
+    
+    @classmethod
+    def build(cls, use_cache: bool = True, cache_path: Path = CATALOG_CACHE) -> 'DatasetCatalog':
+        """
+        Build the catalog for HAM10000 and ISIC2018, loading the disk cache when fresh
+        
+        Args:
+            use_cache: Read and write the on-disk cache
+            cache_path: Cache file location
+        
+        Returns:
+            DatasetCatalog with one row per image found on disk
+        """
+        fingerprint = cls._fingerprint()
+        
+        if use_cache and cache_path.exists():
+            try:
+                cached = pd.read_pickle(cache_path)
+                if cached.get('fingerprint') == fingerprint:
+                    return cls(cached['frame'])
+            except Exception as e:
+                print(f"Ignoring unreadable catalog cache: {e}")
+        
+        frames = []
+        sources = [
+            ('HAM10000', HAM10000_METADATA, [HAM10000_IMAGES_PART1, HAM10000_IMAGES_PART2]),
+            ('ISIC2018', ISIC2018_GROUND_TRUTH, [ISIC2018_TEST_IMAGES]),
+        ]
+        for source, csv_path, directories in sources:
+            if not csv_path.exists():
+                continue
+            frame = cls._read_labels(csv_path)
+            frame['path'] = frame['image_id'].map(cls._scan_images(directories))
+            frame = frame.dropna(subset=['path'])
+            frame = cls._apply_manifest(frame)
+            frame['source'] = source
+            frames.append(frame)
+        
+        if frames:
+            frame = pd.concat(frames, ignore_index=True)
+            frame = frame.drop_duplicates(subset='image_id', keep='first')
+        else:
+            frame = pd.DataFrame(columns=['image_id', 'lesion_id', 'dx', 'path', 'source'])
+        
+        for column in CATEGORICAL_COLUMNS:
+            if column in frame.columns:
+                frame[column] = frame[column].astype('category')
+        frame = frame.set_index('image_id')
+        
+        if use_cache:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle({'fingerprint': fingerprint, 'frame': frame}, cache_path)
+        
+        return cls(frame)
+    
+    def summary(self) -> dict:
+        """Image counts per source and per diagnosis"""
+        return {
+            'images': len(self.frame),
+            'by_source': {str(k): int(v) for k, v in self.frame['source'].value_counts().items()},
+            'by_label': {str(k): int(v) for k, v in self.frame['dx'].value_counts().items()},
+        }
+
+
 if __name__ == "__main__":
     # Test the data loader
     print("Dataset Structure Verification")
@@ -75,3 +256,7 @@ if __name__ == "__main__":
     
     print(f"\nHAM10000 Images: {len(get_ham10000_image_paths())} files")
     print(f"ISIC2018 Images: {len(get_isic2018_image_paths())} files")
+    
+    catalog = DatasetCatalog.build()
+    print(f"\nDataset catalog:")
+    print(json.dumps(catalog.summary(), indent=2))
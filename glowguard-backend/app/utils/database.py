@@ -1,5 +1,5 @@
 """Database utilities and initialization"""
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 import os
@@ -37,3 +37,31 @@ def get_db():
 def init_db():
     """Initialize database with all tables"""
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+def add_missing_columns():
+    """
+    Add nullable columns declared on the models but missing from existing tables
+    
+    create_all only creates tables, so a database created before a column
+    was added (e.g. Prediction.embedding) would otherwise fail every query.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            added = set()
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.add(column.name)
+                print(f"Added column {table.name}.{column.name}")
+            
+            # Indexes declared on the new columns (e.g. index=True)
+            for index in table.indexes:
+                if any(column.name in added for column in index.columns):
+                    index.create(bind=connection, checkfirst=True)
@@ -0,0 +1,312 @@
+"""
+Near-duplicate detection and lesion-grouped splits
+Every image gets a 64-bit DCT perceptual hash (computed with a process pool
+and cached by file checksum, so unchanged images are never re-hashed). Images
+within a small Hamming distance are merged into near-duplicate clusters with
+a union-find, across lesions and datasets. The result is a manifest that
+keeps one image per cluster for training, and a validation split grouped by
+lesion and cluster so no lesion or duplicate sits on both sides.
+"""
+
+import io
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedGroupKFold
+
+from app.utils.data_loader import BASE_DIR, DATA_DIR, DatasetCatalog
+
+DEDUP_MANIFEST = DATA_DIR / "dedup_manifest.csv"
+DEDUP_REPORT = BASE_DIR / "ml_models" / "dedup_report.json"
+# Content checksum -> perceptual hash, shared by every run
+HASH_CACHE = DATA_DIR / "perceptual_hashes.csv"
+
+# Bits (of 64) two hashes may differ by and still count as near-duplicates
+DEFAULT_THRESHOLD = 6
+# Files per worker task
+HASH_CHUNK_SIZE = 128
+# Rows compared against all hashes at once in near_duplicate_pairs
+PAIR_BLOCK_SIZE = 1024
+# Set bits of every byte value (np.bitwise_count needs NumPy 2)
+BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def perceptual_hash(path: str) -> Tuple[str, int]:
+    """
+    (sha1 checksum, 64-bit DCT hash) of one image file
+    
+    The hash thresholds the 8x8 lowest DCT frequencies of a 32x32 grayscale
+    thumbnail at their median, so it survives re-encoding, rescaling and small
+    colour or exposure changes.
+    """
+    from PIL import Image
+    
+    with open(path, 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        # Reduced DCT decode, as in the integrity scan
+        img.draft('L', (64, 64))
+        thumb = np.asarray(img.convert('L').resize((32, 32), Image.BOX), dtype=np.float32)
+    
+    low = cv2.dct(thumb)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return hashlib.sha1(data).hexdigest(), int(np.packbits(bits).view('>u8')[0])
+
+
+def _hash_chunk(paths: List[str]) -> List[Tuple[str, int]]:
+    return [perceptual_hash(path) for path in paths]
+
+
+def load_hash_cache(cache_path: Path = HASH_CACHE) -> dict:
+    if not Path(cache_path).exists():
+        return {}
+    cache = pd.read_csv(cache_path, dtype=str)
+    return {checksum: int(value, 16) for checksum, value in zip(cache['checksum'], cache['phash'])}
+
+
+def compute_hashes(catalog: DatasetCatalog, workers: Optional[int] = None,
+                   cache_path: Path = HASH_CACHE) -> np.ndarray:
+    """
+    Perceptual hash of every catalog image, in catalog order
+    
+    Images whose checksum (from the integrity manifest) is already in the
+    cache are not read; the rest are hashed in parallel and added to it.
+    
+    Returns:
+        uint64 array [N]
+    """
+    cache = load_hash_cache(cache_path)
+    checksums = catalog.frame['checksum'] if 'checksum' in catalog.frame.columns else pd.Series(
+        [None] * len(catalog), index=catalog.frame.index)
+    hashes = np.zeros(len(catalog), dtype=np.uint64)
+    
+    pending = []
+    for i, checksum in enumerate(checksums):
+        if isinstance(checksum, str) and checksum in cache:
+            hashes[i] = cache[checksum]
+        else:
+            pending.append(i)
+    print(f"Hashing {len(catalog)} images: {len(catalog) - len(pending)} cached, {len(pending)} to hash")
+    
+    if pending:
+        paths = [catalog.paths[i] for i in pending]
+        chunks = [paths[i:i + HASH_CHUNK_SIZE] for i in range(0, len(paths), HASH_CHUNK_SIZE)]
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for done, chunk in enumerate(executor.map(_hash_chunk, chunks), 1):
+                results.extend(chunk)
+                if done % 10 == 0 or done == len(chunks):
+                    print(f"  {min(done * HASH_CHUNK_SIZE, len(paths))}/{len(paths)} hashed")
+        for i, (checksum, value) in zip(pending, results):
+            hashes[i] = value
+            cache[checksum] = value
+        
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(f"{cache_path}.tmp")
+        pd.DataFrame({'checksum': list(cache.keys()),
+                      'phash': [f"{value:016x}" for value in cache.values()]}).to_csv(tmp_path, index=False)
+        tmp_path.replace(cache_path)
+    
+    return hashes
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Set bits of each uint64, as uint8, one byte lookup at a time"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    octets = values.view(np.uint8).reshape(values.shape + (8,))
+    counts = BYTE_POPCOUNT[octets[..., 0]]
+    for i in range(1, 8):
+        counts += BYTE_POPCOUNT[octets[..., i]]
+    return counts
+
+
+def near_duplicate_pairs(hashes: np.ndarray, threshold: int = DEFAULT_THRESHOLD) -> np.ndarray:
+    """
+    Every pair (i < j) of hashes at most `threshold` bits apart
+    
+    Exhaustive XOR + popcount, one block of rows at a time, so memory stays
+    proportional to PAIR_BLOCK_SIZE x N.
+    
+    Returns:
+        int64 array [pairs, 2]
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    pairs = []
+    for start in range(0, len(hashes), PAIR_BLOCK_SIZE):
+        block = hashes[start:start + PAIR_BLOCK_SIZE]
+        distance = popcount64(block[:, None] ^ hashes[None, :])
+        rows, cols = np.nonzero(distance <= threshold)
+        rows += start
+        upper = cols > rows
+        pairs.append(np.stack([rows[upper], cols[upper]], axis=1))
+    return np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+
+
+class DisjointSet:
+    """Union-find over 0..n-1 with path halving and union by size"""
+    
+    def __init__(self, n: int):
+        self.parent = np.arange(n)
+        self.size = np.ones(n, dtype=np.int64)
+    
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    def union(self, i: int, j: int) -> None:
+        a, b = self.find(i), self.find(j)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+    
+    def labels(self) -> np.ndarray:
+        """Component id per element, numbered from 0 in order of first appearance"""
+        roots = np.array([self.find(i) for i in range(len(self.parent))])
+        return pd.factorize(roots)[0]
+
+
+def cluster_duplicates(pairs: np.ndarray, n: int) -> np.ndarray:
+    """Near-duplicate cluster id per image (connected components of the pairs)"""
+    components = DisjointSet(n)
+    for i, j in pairs:
+        components.union(int(i), int(j))
+    return components.labels()
+
+
+def split_groups(clusters: np.ndarray, lesions: np.ndarray) -> np.ndarray:
+    """
+    Group id per image joining images of the same lesion or the same duplicate cluster
+    
+    A lesion whose duplicate turns up under another lesion_id (or in the
+    other dataset) ends up in one group with it.
+    """
+    components = DisjointSet(len(clusters))
+    for ids in (clusters, pd.factorize(lesions)[0]):
+        first = {}
+        for i, group in enumerate(ids):
+            components.union(first.setdefault(group, i), i)
+    return components.labels()
+
+
+def choose_representatives(frame: pd.DataFrame, clusters: np.ndarray) -> np.ndarray:
+    """One image per cluster: the highest resolution, then the lowest image_id"""
+    pixels = (frame['width'].fillna(0) * frame['height'].fillna(0)).to_numpy() \
+        if {'width', 'height'} <= set(frame.columns) else np.zeros(len(frame))
+    order = np.lexsort((frame.index.to_numpy(dtype=str), -pixels, clusters))
+    keep = np.zeros(len(frame), dtype=bool)
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = clusters[order][1:] != clusters[order][:-1]
+    keep[order[first]] = True
+    return keep
+
+
+def grouped_split(labels: np.ndarray, groups: np.ndarray, validation_split: float = 0.2,
+                  seed: int = 42) -> np.ndarray:
+    """
+    Stratified validation split with whole groups on one side
+    
+    Returns:
+        Boolean mask [N], True for validation images
+    """
+    folds = StratifiedGroupKFold(n_splits=max(2, round(1 / validation_split)), shuffle=True, random_state=seed)
+    _, val_idx = next(folds.split(np.zeros(len(labels)), labels, groups))
+    mask = np.zeros(len(labels), dtype=bool)
+    mask[val_idx] = True
+    return mask
+
+
+def build_dedup_manifest(catalog: DatasetCatalog, threshold: int = DEFAULT_THRESHOLD,
+                         validation_split: float = 0.2, seed: int = 42,
+                         workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Hash, cluster and split the catalog
+    
+    Returns:
+        DataFrame indexed by image_id, in catalog order, with source, dx,
+        lesion_id, phash, cluster, group, keep (cluster representative) and
+        split ('train' or 'val')
+    """
+    frame = catalog.frame
+    hashes = compute_hashes(catalog, workers)
+    pairs = near_duplicate_pairs(hashes, threshold)
+    clusters = cluster_duplicates(pairs, len(frame))
+    groups = split_groups(clusters, catalog.groups)
+    val = grouped_split(catalog.labels, groups, validation_split, seed)
+    
+    return pd.DataFrame({
+        'source': frame['source'].astype(str).to_numpy(),
+        'dx': frame['dx'].astype(str).to_numpy(),
+        'lesion_id': catalog.groups,
+        'phash': [f"{value:016x}" for value in hashes],
+        'cluster': clusters,
+        'group': groups,
+        'keep': choose_representatives(frame, clusters),
+        'split': np.where(val, 'val', 'train'),
+    }, index=frame.index)
+
+
+def save_manifest(manifest: pd.DataFrame, path: Path = DEDUP_MANIFEST) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(f"{path}.tmp")
+    manifest.to_csv(tmp_path, index_label='image_id')
+    tmp_path.replace(path)
+
+
+def load_manifest(path: Path = DEDUP_MANIFEST) -> pd.DataFrame:
+    if not Path(path).exists():
+        raise FileNotFoundError(f"No deduplication manifest at {path}. Run dedup_dataset.py")
+    return pd.read_csv(path, dtype={'image_id': str, 'lesion_id': str, 'phash': str}).set_index('image_id')
+
+
+def manifest_split(manifest: pd.DataFrame, image_ids) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Training and validation positions of image_ids under the manifest
+    
+    Training keeps one image per duplicate cluster; validation keeps every
+    image of its groups. Images missing from the manifest (added after it
+    was built) are left out of both.
+    
+    Returns:
+        Tuple of (train positions, val positions) into image_ids
+    """
+    rows = manifest.reindex(pd.Index(image_ids).astype(str))
+    train = (rows['split'] == 'train') & rows['keep'].fillna(False).astype(bool)
+    val = rows['split'] == 'val'
+    missing = int(rows['split'].isna().sum())
+    if missing:
+        print(f"Deduplication manifest: {missing} images not in the manifest are left out; re-run dedup_dataset.py")
+    return np.flatnonzero(train.to_numpy()), np.flatnonzero(val.to_numpy())
+
+
+def summarize_duplicates(manifest: pd.DataFrame) -> dict:
+    """Cluster and split counts for the report"""
+    clusters = manifest.groupby('cluster')
+    sizes = clusters.size()
+    duplicated = sizes[sizes > 1].index
+    multi = manifest[manifest['cluster'].isin(duplicated)].groupby('cluster')
+    train = manifest['split'] == 'train'
+    return {
+        'images': int(len(manifest)),
+        'clusters': int(len(sizes)),
+        'duplicate_clusters': int(len(duplicated)),
+        'images_removed': int((~manifest['keep']).sum()),
+        'largest_cluster': int(sizes.max()) if len(sizes) else 0,
+        'cross_lesion_clusters': int((multi['lesion_id'].nunique() > 1).sum()),
+        'cross_source_clusters': int((multi['source'].nunique() > 1).sum()),
+        'conflicting_label_clusters': int((multi['dx'].nunique() > 1).sum()),
+        'train_images': int(train.sum()),
+        'train_images_kept': int((train & manifest['keep']).sum()),
+        'val_images': int((~train).sum()),
+        'groups': int(manifest['group'].nunique()),
+    }
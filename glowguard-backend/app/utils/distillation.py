@@ -0,0 +1,205 @@
+"""
+Knowledge distillation into a small CPU student
+The teacher runs once per image to cache its log-probabilities; distillation
+epochs then train the student on (image, label + teacher targets) pairs from
+the usual tf.data pipelines, so the teacher is never evaluated during
+training. The student takes the same [0, 1] 224 px input as every GlowGuard
+model, so the trained artifact is served by SkinDiseasePredictor unchanged.
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from app.utils.data_loader import BASE_DIR
+from app.utils.feature_cache import build_head, load_or_extract_features
+
+TEACHER_LOGITS_DIR = BASE_DIR / "ml_models" / "teacher_logits"
+
+# Student backbones: constructor and the rescaling from [0, 1] to the input range it expects
+STUDENT_BACKBONES = {
+    'mobilenet_v2': (tf.keras.applications.MobileNetV2, 2.0, -1.0),
+    'mobilenet_v3_small': (tf.keras.applications.MobileNetV3Small, 255.0, 0.0),
+    'mobilenet_v3_large': (tf.keras.applications.MobileNetV3Large, 255.0, 0.0),
+    'efficientnet_b0': (tf.keras.applications.EfficientNetB0, 255.0, 0.0),
+}
+
+# Same clipping as Keras crossentropy
+EPSILON = 1e-7
+
+
+def teacher_log_probabilities(teacher: tf.keras.Model, make_dataset, config: dict,
+                              root: Path = TEACHER_LOGITS_DIR) -> np.ndarray:
+    """
+    Teacher log-probabilities for every image, computed once and cached
+    
+    log p differs from the teacher's logits only by a per-image constant, so
+    it gives the same temperature-softened targets.
+    
+    Args:
+        teacher: Model with softmax output
+        make_dataset: view index -> unshuffled batched dataset over all images
+            at the teacher's input size (only view 0 is used)
+        config: Everything that determines the outputs (teacher version, size, preprocessing, data)
+        root: Cache root directory
+    
+    Returns:
+        float32 array [N, num_classes]
+    """
+    log_softmax = tf.keras.layers.Lambda(lambda p: tf.math.log(tf.clip_by_value(p, EPSILON, 1.0)))
+    inputs = tf.keras.layers.Input(shape=teacher.input_shape[1:])
+    extractor = tf.keras.Model(inputs=inputs, outputs=log_softmax(teacher(inputs, training=False)))
+    return np.asarray(load_or_extract_features(extractor, make_dataset, 0, config, root)[0], dtype=np.float32)
+
+
+def pack_targets(labels: np.ndarray, teacher_logits: np.ndarray) -> np.ndarray:
+    """[N, 1 + K] float32 targets: the integer label followed by the teacher's logits"""
+    return np.concatenate([np.asarray(labels, dtype=np.float32)[:, None],
+                           np.asarray(teacher_logits, dtype=np.float32)], axis=1)
+
+
+def distillation_loss(temperature: float = 4.0, alpha: float = 0.3):
+    """
+    Hinton distillation loss on packed targets (see pack_targets)
+    
+    alpha * CE(label, student) + (1 - alpha) * T^2 * KL(teacher_T || student_T),
+    where _T is the softmax at temperature T. The T^2 factor keeps the soft
+    term's gradient scale independent of T.
+    """
+    def loss(y_true, y_pred):
+        labels = tf.cast(y_true[:, 0], tf.int32)
+        teacher = y_true[:, 1:] / temperature
+        student_log = tf.math.log(tf.clip_by_value(tf.cast(y_pred, tf.float32), EPSILON, 1.0))
+        
+        hard = tf.keras.losses.sparse_categorical_crossentropy(labels, y_pred)
+        soft = tf.reduce_sum(
+            tf.nn.softmax(teacher) * (tf.nn.log_softmax(teacher) - tf.nn.log_softmax(student_log / temperature)),
+            axis=-1
+        )
+        return alpha * hard + (1 - alpha) * temperature ** 2 * soft
+    
+    return loss
+
+
+def label_accuracy(y_true, y_pred):
+    """Top-1 accuracy against the label column of packed targets"""
+    labels = tf.cast(y_true[:, 0], tf.int64)
+    return tf.cast(tf.equal(tf.argmax(y_pred, axis=-1), labels), tf.float32)
+
+
+def teacher_agreement(y_true, y_pred):
+    """Share of images where student and teacher predict the same class"""
+    return tf.cast(tf.equal(tf.argmax(y_pred, axis=-1), tf.argmax(y_true[:, 1:], axis=-1)), tf.float32)
+
+
+def build_student(backbone: str, num_classes: int, img_size: int = 224,
+                  head_config: Optional[dict] = None, weights: Optional[str] = 'imagenet') -> tf.keras.Model:
+    """
+    Student classifier on [0, 1] input
+    
+    The whole backbone is trained; its BatchNormalization layers stay in
+    inference mode, as usual when fine-tuning a pre-trained network.
+    """
+    if backbone not in STUDENT_BACKBONES:
+        raise ValueError(f"Unknown student backbone {backbone!r}; choose from {sorted(STUDENT_BACKBONES)}")
+    constructor, scale, offset = STUDENT_BACKBONES[backbone]
+    head_config = head_config or {}
+    
+    base_model = constructor(input_shape=(img_size, img_size, 3), include_top=False, weights=weights)
+    base_model.trainable = True
+    
+    inputs = tf.keras.layers.Input(shape=(img_size, img_size, 3))
+    x = tf.keras.layers.Rescaling(scale, offset=offset)(inputs)
+    x = base_model(x, training=False)
+    pooled = tf.keras.layers.GlobalAveragePooling2D()(x)
+    head = build_head(pooled.shape[-1], num_classes,
+                      dense_units=head_config.get('dense_units', (256,)),
+                      dropout=head_config.get('dropout', 0.2))
+    return tf.keras.Model(inputs=inputs, outputs=head(pooled), name=f"student_{backbone}")
+
+
+def measure_latency(model: tf.keras.Model, batch_size: int = 32, repeats: int = 20) -> dict:
+    """
+    CPU inference latency on random input of the model's size
+    
+    Single-image latency is what one /analyze request pays; batch throughput
+    is what bulk scoring gets.
+    """
+    size = model.input_shape[1:]
+    single = tf.random.uniform((1,) + tuple(size))
+    batch = tf.random.uniform((batch_size,) + tuple(size))
+    
+    model(single, training=False)
+    model(batch, training=False)
+    
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        np.asarray(model(single, training=False))
+        times.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    for _ in range(max(repeats // 4, 1)):
+        np.asarray(model(batch, training=False))
+    batch_seconds = (time.perf_counter() - start) / max(repeats // 4, 1)
+    
+    times = np.asarray(times) * 1000
+    return {
+        'latency_ms_p50': float(np.median(times)),
+        'latency_ms_p95': float(np.percentile(times, 95)),
+        'batch_images_per_sec': batch_size / batch_seconds,
+    }
+
+
+def model_summary(model: tf.keras.Model, metrics: dict, path=None) -> dict:
+    """Size and quality numbers for one side of the report"""
+    summary = {
+        'name': model.name,
+        'input_size': int(model.input_shape[1]),
+        'parameters': int(model.count_params()),
+        'accuracy': metrics['accuracy'],
+        'balanced_accuracy': metrics['balanced_accuracy'],
+        'macro_auc': metrics['macro_auc'],
+        'recall': metrics['recall'],
+    }
+    if path is not None and os.path.exists(path):
+        summary['file_mb'] = os.path.getsize(path) / 2 ** 20
+    return summary
+
+
+def build_distillation_report(teacher: dict, student: dict, agreement: float, config: Dict) -> dict:
+    """Teacher vs student quality and latency, with the student's speed-up and accuracy cost"""
+    return {
+        'config': config,
+        'teacher': teacher,
+        'student': student,
+        'agreement': agreement,
+        'speedup': teacher['latency_ms_p50'] / student['latency_ms_p50'],
+        'accuracy_delta': student['accuracy'] - teacher['accuracy'],
+        'balanced_accuracy_delta': student['balanced_accuracy'] - teacher['balanced_accuracy'],
+    }
+
+
+def format_distillation_report(report: dict) -> str:
+    rows = [
+        ('Input size', 'input_size', '{:d}'),
+        ('Parameters', 'parameters', '{:,}'),
+        ('Accuracy', 'accuracy', '{:.4f}'),
+        ('Balanced accuracy', 'balanced_accuracy', '{:.4f}'),
+        ('Macro AUC', 'macro_auc', '{:.4f}'),
+        ('Latency p50 (ms)', 'latency_ms_p50', '{:.1f}'),
+        ('Latency p95 (ms)', 'latency_ms_p95', '{:.1f}'),
+        ('Batch images/s', 'batch_images_per_sec', '{:.1f}'),
+    ]
+    teacher, student = report['teacher'], report['student']
+    lines = [f"{'':<20} {'Teacher':>14} {'Student':>14}"]
+    for title, key, fmt in rows:
+        lines.append(f"{title:<20} {fmt.format(teacher[key]):>14} {fmt.format(student[key]):>14}")
+    lines.append(f"\nStudent is {report['speedup']:.2f}x faster per image; accuracy "
+                 f"{report['accuracy_delta']:+.4f}, balanced accuracy {report['balanced_accuracy_delta']:+.4f}; "
+                 f"agrees with the teacher on {report['agreement']:.1%} of validation images")
+    return "\n".join(lines)
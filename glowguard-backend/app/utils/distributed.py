@@ -0,0 +1,268 @@
+"""
+Multi-process data-parallel training on one host
+Launches N copies of a training script as tf.distribute MultiWorkerMirroredStrategy
+workers over localhost, each pinned to its own block of cores with matching
+TensorFlow thread pools. Every worker reads a disjoint shard of the data;
+gradients are all-reduced each step, so all workers hold identical weights.
+Training runs in a custom loop (strategy.run), which also works across hosts
+when TF_CONFIG is set by a cluster scheduler instead of the launcher.
+"""
+
+import os
+import sys
+import json
+import socket
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+from app.utils.evaluation import StreamingEvaluator
+
+# Inter-op threads per worker; intra-op threads follow the worker's core count
+INTER_OP_THREADS = 2
+
+
+def free_ports(count: int) -> List[int]:
+    """Unused localhost TCP ports for the worker gRPC servers"""
+    sockets = []
+    try:
+        for _ in range(count):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(('localhost', 0))
+            sockets.append(s)
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_sets(workers: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """
+    Contiguous, equal blocks of cores per worker
+    
+    Neighbouring core ids usually share caches and a NUMA node. With more
+    workers than cores, workers share cores round-robin.
+    """
+    cores = list(cores) if cores is not None else available_cores()
+    if workers > len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+    per_worker = len(cores) // workers
+    return [cores[i * per_worker:(i + 1) * per_worker] for i in range(workers)]
+
+
+def tf_config(ports: Sequence[int], index: int) -> str:
+    return json.dumps({
+        'cluster': {'worker': [f"localhost:{port}" for port in ports]},
+        'task': {'type': 'worker', 'index': index},
+    })
+
+
+def worker_info() -> Tuple[int, int]:
+    """(worker index, worker count) from TF_CONFIG; (0, 1) outside a cluster"""
+    config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    if not config:
+        return 0, 1
+    return int(config['task']['index']), len(config['cluster']['worker'])
+
+
+def is_chief() -> bool:
+    return worker_info()[0] == 0
+
+
+def launch_workers(argv: Sequence[str], workers: int, log_dir, cores: Optional[Sequence[int]] = None) -> List[int]:
+    """
+    Run `python argv...` as `workers` local MultiWorkerMirroredStrategy workers
+    
+    Worker 0 (the chief) writes to this console, the others to
+    log_dir/worker_<i>.log. If any worker fails the rest are stopped, since
+    the survivors would block in the next all-reduce.
+    
+    Returns:
+        Exit code of every worker
+    """
+    log_dir = Path(log_dir)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    ports = free_ports(workers)
+    assignments = core_sets(workers, cores)
+    
+    processes = []
+    logs = []
+    for index, worker_cores in enumerate(assignments):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = tf_config(ports, index)
+        for var in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+            env[var] = str(len(worker_cores))
+        env['TF_NUM_INTEROP_THREADS'] = str(INTER_OP_THREADS)
+        
+        def pin(worker_cores=worker_cores):
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, worker_cores)
+        
+        if index == 0:
+            output = None
+        else:
+            output = open(log_dir / f"worker_{index}.log", 'w')
+            logs.append(output)
+        print(f"Worker {index}: cores {worker_cores[0]}-{worker_cores[-1]}"
+              + (f", log {log_dir / f'worker_{index}.log'}" if index else ""))
+        processes.append(subprocess.Popen([sys.executable] + list(argv), env=env, preexec_fn=pin,
+                                          stdout=output, stderr=subprocess.STDOUT if output else None))
+    
+    codes = [None] * workers
+    try:
+        while any(code is None for code in codes):
+            for index, process in enumerate(processes):
+                if codes[index] is None:
+                    codes[index] = process.poll()
+            if any(code not in (None, 0) for code in codes):
+                for process in processes:
+                    if process.poll() is None:
+                        process.terminate()
+                codes = [process.wait() for process in processes]
+                break
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for log in logs:
+            log.close()
+    
+    return codes
+
+
+def create_strategy() -> tf.distribute.MultiWorkerMirroredStrategy:
+    """
+    Strategy for this worker, with thread pools sized to its pinned cores
+    
+    Must run before any other TensorFlow op: both the thread settings and the
+    collective runtime are fixed once TensorFlow initialises.
+    """
+    cores = len(available_cores())
+    tf.config.threading.set_intra_op_parallelism_threads(cores)
+    tf.config.threading.set_inter_op_parallelism_threads(INTER_OP_THREADS)
+    return tf.distribute.MultiWorkerMirroredStrategy()
+
+
+def distributed_train_step(strategy, model: tf.keras.Model, global_batch_size: int):
+    """
+    tf.function running one synchronous step on every worker
+    
+    Each replica averages its loss over the global batch, so the all-reduced
+    (summed) gradients equal those of one large batch.
+    
+    Returns:
+        step(iterator) -> (loss sum, correct predictions) over the global batch
+    """
+    loss_fn = tf.keras.losses.SparseCategoricalCrossentropy(reduction='none')
+    optimizer = model.optimizer
+    # Keras 3 optimizers scale the loss (identity unless a LossScaleOptimizer, i.e.
+    # mixed_float16) and unscale in apply_gradients; in Keras 2 a LossScaleOptimizer
+    # scales and unscales explicitly
+    keras_scales_loss = hasattr(optimizer, 'scale_loss')
+    legacy_loss_scale = not keras_scales_loss and isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer)
+    
+    def replica_step(images, labels):
+        with tf.GradientTape() as tape:
+            probabilities = model(images, training=True)
+            per_example = loss_fn(labels, probabilities)
+            loss = tf.nn.compute_average_loss(per_example, global_batch_size=global_batch_size)
+            if model.losses:
+                loss += tf.nn.scale_regularization_loss(tf.add_n(model.losses))
+            if keras_scales_loss:
+                scaled = optimizer.scale_loss(loss)
+            elif legacy_loss_scale:
+                scaled = optimizer.get_scaled_loss(loss)
+            else:
+                scaled = loss
+        gradients = tape.gradient(scaled, model.trainable_variables)
+        if legacy_loss_scale:
+            gradients = optimizer.get_unscaled_gradients(gradients)
+        optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        
+        correct = tf.equal(tf.argmax(probabilities, axis=-1, output_type=tf.int32), tf.cast(labels, tf.int32))
+        return tf.reduce_sum(per_example), tf.reduce_sum(tf.cast(correct, tf.float32))
+    
+    @tf.function
+    def step(iterator):
+        images, labels = next(iterator)
+        loss_sum, correct = strategy.run(replica_step, args=(images, labels))
+        return (strategy.reduce(tf.distribute.ReduceOp.SUM, loss_sum, axis=None),
+                strategy.reduce(tf.distribute.ReduceOp.SUM, correct, axis=None))
+    
+    return step
+
+
+def all_reduce_sum(strategy, values: Sequence[float]) -> np.ndarray:
+    """Sum a small vector over all workers"""
+    local = tf.constant(values, dtype=tf.float64)
+    
+    # Eager collectives are slow; one small graph per call is not
+    @tf.function
+    def reduce():
+        per_replica = strategy.run(lambda: tf.identity(local))
+        return strategy.reduce(tf.distribute.ReduceOp.SUM, per_replica, axis=None)
+    
+    return reduce().numpy()
+
+
+def distributed_evaluate(strategy, model: tf.keras.Model, dataset: tf.data.Dataset,
+                         num_classes: int) -> Tuple[float, float]:
+    """
+    Validation loss and accuracy over every worker's shard
+    
+    Each worker scores its own shard locally (shards may have different
+    batch counts), then only the totals are all-reduced.
+    """
+    evaluator = StreamingEvaluator(num_classes, keep_predictions=False)
+    for images, labels in dataset:
+        evaluator.update(np.asarray(labels), model(images, training=False))
+    correct = float(np.trace(evaluator.confusion))
+    loss_sum, correct, count = all_reduce_sum(strategy, [evaluator.log_loss_sum, correct, evaluator.count])
+    return loss_sum / max(count, 1), correct / max(count, 1)
+
+
+def scaling_report(results: Dict[int, dict]) -> dict:
+    """
+    Speed-up and efficiency per worker count against the 1-worker run
+    
+    Args:
+        results: worker count -> {'images_per_sec': ..., ...}
+    
+    Returns:
+        Dict of rows sorted by worker count, each with speedup and efficiency
+        (speedup / workers)
+    """
+    counts = sorted(results)
+    baseline = results[1]['images_per_sec'] if 1 in results else None
+    rows = []
+    for workers in counts:
+        row = {'workers': workers, **results[workers]}
+        if baseline:
+            row['speedup'] = row['images_per_sec'] / baseline
+            row['efficiency'] = row['speedup'] / workers
+        rows.append(row)
+    return {'cores': len(available_cores()), 'rows': rows}
+
+
+def format_scaling_report(report: dict) -> str:
+    lines = [f"{'Workers':>7} {'Cores/worker':>12} {'Step ms':>9} {'images/s':>10} {'Speedup':>8} {'Efficiency':>10}"]
+    for row in report['rows']:
+        speedup = f"{row['speedup']:>7.2f}x" if 'speedup' in row else f"{'-':>8}"
+        efficiency = f"{row['efficiency']:>10.1%}" if 'efficiency' in row else f"{'-':>10}"
+        lines.append(f"{row['workers']:>7} {row['cores_per_worker']:>12} {row['step_ms']:>9.1f} "
+                     f"{row['images_per_sec']:>10.1f} {speedup} {efficiency}")
+    lines.append(f"\n{report['cores']} cores available; each worker keeps the per-worker batch size, "
+                 f"so the global batch grows with the worker count")
+    return "\n".join(lines)
@@ -0,0 +1,163 @@
+"""
+Stored backbone embeddings and head-only re-scoring
+The serving model is backbone -> global average pooling -> classifier head.
+With STORE_EMBEDDINGS on, the pooled embedding of every prediction is kept
+(float16, 2 bytes per feature) together with the model and backbone
+versions. A retrained head, or a new class_labels.json, can then re-score
+history from the stored vectors with a NumPy forward pass of the head,
+without decoding any image or running the backbone again.
+"""
+
+import os
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+STORE_EMBEDDINGS = os.getenv("STORE_EMBEDDINGS", "false").lower() in ("1", "true", "yes")
+EMBEDDING_DTYPE = np.float16
+
+# Head layers NumPyHead can run; anything else refuses rather than mis-scores
+HEAD_ACTIVATIONS = ('linear', 'relu', 'sigmoid', 'softmax')
+
+
+def model_version(path) -> str:
+    """Content hash of a model file, so a retrained file gets a new version"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def pooling_layer_index(model: tf.keras.Model) -> Optional[int]:
+    """Index in model.layers of the last global average pooling layer (the embedding), if any"""
+    for i in range(len(model.layers) - 1, -1, -1):
+        if isinstance(model.layers[i], tf.keras.layers.GlobalAveragePooling2D):
+            return i
+    return None
+
+
+def embedding_model(model: tf.keras.Model) -> Optional[tf.keras.Model]:
+    """
+    The model with the pooled embedding as an extra output
+    
+    Returns:
+        Model mapping images to [embedding, class probabilities] in one
+        forward pass, or None if the model has no pooling layer
+    """
+    index = pooling_layer_index(model)
+    if index is None:
+        return None
+    return tf.keras.Model(inputs=model.input, outputs=[model.layers[index].output, model.output])
+
+
+def backbone_version(model: tf.keras.Model) -> Optional[str]:
+    """
+    Hash of every weight up to the embedding
+    
+    Two models share a backbone version exactly when their stored
+    embeddings are interchangeable, e.g. after retraining only the head.
+    """
+    index = pooling_layer_index(model)
+    if index is None:
+        return None
+    digest = hashlib.sha1()
+    for layer in model.layers[:index + 1]:
+        for weight in layer.get_weights():
+            digest.update(np.ascontiguousarray(weight).tobytes())
+    return digest.hexdigest()[:12]
+
+
+def encode_embedding(embedding: np.ndarray) -> bytes:
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).ravel().tobytes()
+
+
+def decode_embeddings(blobs: Sequence[bytes]) -> np.ndarray:
+    """Stored embeddings as a float32 matrix [N, dim]"""
+    if not blobs:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.frombuffer(b"".join(blobs), dtype=EMBEDDING_DTYPE).reshape(len(blobs), -1)
+    return matrix.astype(np.float32)
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    x = x - x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+class NumpyHead:
+    """
+    Inference-only copy of a model's classifier head in NumPy
+    
+    Built from the layers after the pooling layer (a nested head model is
+    unrolled): Dense, BatchNormalization and Activation layers are folded
+    into matrix products, Dropout is the identity at inference.
+    
+    Usage:
+        head = NumpyHead.from_model(tf.keras.models.load_model(path))
+        probabilities = head(decode_embeddings(blobs))
+    """
+    
+    def __init__(self, steps: List[Tuple[str, tuple]]):
+        self.steps = steps
+    
+    @staticmethod
+    def _head_layers(model: tf.keras.Model) -> list:
+        index = pooling_layer_index(model)
+        if index is None:
+            raise ValueError("Model has no global average pooling layer to split at")
+        layers = []
+        for layer in model.layers[index + 1:]:
+            if isinstance(layer, tf.keras.Model):
+                layers.extend(layer.layers)
+            else:
+                layers.append(layer)
+        return layers
+    
+    @classmethod
+    def from_model(cls, model: tf.keras.Model) -> 'NumpyHead':
+        steps = []
+        for layer in cls._head_layers(model):
+            if isinstance(layer, (tf.keras.layers.InputLayer, tf.keras.layers.Dropout)):
+                continue
+            if isinstance(layer, tf.keras.layers.Dense):
+                kernel, bias = (w.astype(np.float32) for w in layer.get_weights())
+                steps.append(('dense', (kernel, bias)))
+                steps.append(('activation', (layer.activation.__name__,)))
+            elif isinstance(layer, tf.keras.layers.BatchNormalization):
+                gamma, beta, mean, variance = (w.astype(np.float32) for w in layer.get_weights())
+                scale = gamma / np.sqrt(variance + layer.epsilon)
+                steps.append(('affine', (scale, beta - mean * scale)))
+            elif isinstance(layer, tf.keras.layers.Activation):
+                steps.append(('activation', (layer.activation.__name__,)))
+            else:
+                raise ValueError(f"Head layer {layer.name} ({type(layer).__name__}) is not supported")
+        
+        for kind, params in steps:
+            if kind == 'activation' and params[0] not in HEAD_ACTIVATIONS:
+                raise ValueError(f"Head activation {params[0]!r} is not supported")
+        return cls(steps)
+    
+    @property
+    def input_dim(self) -> int:
+        return self.steps[0][1][0].shape[0]
+    
+    def __call__(self, features: np.ndarray) -> np.ndarray:
+        """Class probabilities [N, num_classes] for embeddings [N, dim]"""
+        x = np.asarray(features, dtype=np.float32)
+        for kind, params in self.steps:
+            if kind == 'dense':
+                x = x @ params[0] + params[1]
+            elif kind == 'affine':
+                x = x * params[0] + params[1]
+            elif params[0] == 'relu':
+                np.maximum(x, 0, out=x)
+            elif params[0] == 'sigmoid':
+                x = 1 / (1 + np.exp(-x))
+            elif params[0] == 'softmax':
+                x = _softmax(x)
+        return x
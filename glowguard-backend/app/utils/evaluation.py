@@ -0,0 +1,239 @@
+"""
+Streaming model evaluation
+Accumulates the confusion matrix, log loss and binned one-vs-rest ROC
+statistics batch by batch, so evaluation runs over file or shard pipelines of
+any size. The predictions are kept (N x classes, small next to the images) so
+bootstrap confidence intervals are computed from them without re-running the
+model.
+"""
+
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+# Score histogram resolution for AUC; ties only within a 1/AUC_BINS bin
+AUC_BINS = 1000
+BOOTSTRAP_SAMPLES = 2000
+# Bootstrap replicates evaluated per vectorised chunk (bounds memory to chunk x N indices)
+BOOTSTRAP_CHUNK = 250
+
+
+def metrics_from_confusion(cm: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Per-class precision, recall and F1 from confusion matrices
+    
+    Args:
+        cm: [..., K, K] counts, rows = true class, columns = predicted class
+    
+    Returns:
+        Dict of [..., K] arrays (0 where undefined), plus [...] accuracy and balanced_accuracy
+    """
+    cm = cm.astype(np.float64)
+    tp = np.diagonal(cm, axis1=-2, axis2=-1)
+    predicted = cm.sum(axis=-2)
+    actual = cm.sum(axis=-1)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(actual > 0, tp / actual, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        present = actual > 0
+        balanced = (recall * present).sum(axis=-1) / np.maximum(present.sum(axis=-1), 1)
+    
+    return {
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'accuracy': tp.sum(axis=-1) / np.maximum(cm.sum(axis=(-2, -1)), 1),
+        'balanced_accuracy': balanced,
+    }
+
+
+class StreamingEvaluator:
+    """
+    Incremental classification metrics over batches
+    
+    Usage:
+        evaluator = StreamingEvaluator(num_classes)
+        for images, labels in dataset:
+            evaluator.update(labels, model.predict_on_batch(images))
+        metrics = evaluator.result()
+        intervals = evaluator.bootstrap()
+    """
+    
+    def __init__(self, num_classes: int, auc_bins: int = AUC_BINS, keep_predictions: bool = True):
+        self.num_classes = num_classes
+        self.auc_bins = auc_bins
+        self.keep_predictions = keep_predictions
+        
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        # Per class: score histograms of samples of that class and of all others
+        self.positive_hist = np.zeros((num_classes, auc_bins), dtype=np.int64)
+        self.total_hist = np.zeros((num_classes, auc_bins), dtype=np.int64)
+        self.log_loss_sum = 0.0
+        self.count = 0
+        
+        self._labels = []
+        self._probabilities = []
+    
+    def update(self, y_true, probabilities):
+        """Add one batch: integer (or one-hot) labels and [B, K] class probabilities"""
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        y_true = np.asarray(y_true)
+        if y_true.ndim == 2:
+            y_true = y_true.argmax(axis=1)
+        y_true = y_true.astype(np.int64)
+        y_pred = probabilities.argmax(axis=1)
+        k = self.num_classes
+        
+        self.confusion += np.bincount(y_true * k + y_pred, minlength=k * k).reshape(k, k)
+        
+        bins = np.minimum((probabilities * self.auc_bins).astype(np.int64), self.auc_bins - 1)
+        flat = bins + (np.arange(k) * self.auc_bins)[None, :]
+        positive = y_true[:, None] == np.arange(k)[None, :]
+        self.total_hist += np.bincount(flat.ravel(), minlength=k * self.auc_bins).reshape(k, -1)
+        self.positive_hist += np.bincount(flat[positive], minlength=k * self.auc_bins).reshape(k, -1)
+        
+        # Clipped like Keras sparse_categorical_crossentropy
+        true_probability = np.clip(probabilities[np.arange(len(y_true)), y_true], 1e-7, 1.0)
+        self.log_loss_sum += float(-np.log(true_probability).sum())
+        self.count += len(y_true)
+        
+        if self.keep_predictions:
+            self._labels.append(y_true)
+            self._probabilities.append(probabilities)
+    
+    @property
+    def labels(self) -> np.ndarray:
+        return np.concatenate(self._labels) if self._labels else np.zeros(0, dtype=np.int64)
+    
+    @property
+    def probabilities(self) -> np.ndarray:
+        if not self._probabilities:
+            return np.zeros((0, self.num_classes), dtype=np.float32)
+        return np.concatenate(self._probabilities)
+    
+    def auc(self) -> np.ndarray:
+        """One-vs-rest ROC AUC per class from the score histograms (NaN without both outcomes)"""
+        positive = self.positive_hist.astype(np.float64)
+        negative = (self.total_hist - self.positive_hist).astype(np.float64)
+        
+        # Mann-Whitney: each negative scores 1 per positive above it, 1/2 per positive in its bin
+        positives_above = np.cumsum(positive[:, ::-1], axis=1)[:, ::-1] - positive
+        pairs = positive.sum(axis=1) * negative.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(pairs > 0, (negative * (positives_above + positive / 2)).sum(axis=1) / pairs, np.nan)
+    
+    def result(self) -> dict:
+        """Loss, accuracy, per-class metrics, AUC and confusion matrix so far"""
+        metrics = metrics_from_confusion(self.confusion)
+        auc = self.auc()
+        return {
+            'samples': self.count,
+            'loss': self.log_loss_sum / max(self.count, 1),
+            'accuracy': float(metrics['accuracy']),
+            'balanced_accuracy': float(metrics['balanced_accuracy']),
+            'precision': metrics['precision'].tolist(),
+            'recall': metrics['recall'].tolist(),
+            'f1': metrics['f1'].tolist(),
+            'support': self.confusion.sum(axis=1).tolist(),
+            'auc': auc.tolist(),
+            'macro_auc': float(np.nanmean(auc)) if np.isfinite(auc).any() else float('nan'),
+            'confusion_matrix': self.confusion.tolist(),
+        }
+    
+    def bootstrap(self, samples: int = BOOTSTRAP_SAMPLES, confidence: float = 0.95, seed: int = 42) -> dict:
+        """Bootstrap intervals for per-class precision, recall and F1 (see bootstrap_intervals)"""
+        return bootstrap_intervals(self.labels, self.probabilities.argmax(axis=1), self.num_classes,
+                                   samples=samples, confidence=confidence, seed=seed)
+    
+    def save(self, path):
+        """Store labels and probabilities, so intervals can be recomputed without the model"""
+        np.savez(path, labels=self.labels, probabilities=self.probabilities)
+    
+    @classmethod
+    def from_predictions(cls, labels, probabilities, num_classes: Optional[int] = None,
+                         auc_bins: int = AUC_BINS) -> 'StreamingEvaluator':
+        """Evaluator over stored predictions (e.g. from save())"""
+        probabilities = np.asarray(probabilities)
+        evaluator = cls(num_classes or probabilities.shape[1], auc_bins)
+        evaluator.update(labels, probabilities)
+        return evaluator
+    
+    @classmethod
+    def load(cls, path) -> 'StreamingEvaluator':
+        with np.load(path) as data:
+            return cls.from_predictions(data['labels'], data['probabilities'])
+
+
+def bootstrap_intervals(y_true: np.ndarray, y_pred: np.ndarray, num_classes: int,
+                        samples: int = BOOTSTRAP_SAMPLES, confidence: float = 0.95,
+                        seed: int = 42, chunk: int = BOOTSTRAP_CHUNK) -> dict:
+    """
+    Percentile bootstrap intervals from predictions, vectorised over replicates
+    
+    Each chunk of replicates resamples (true, predicted) pairs with
+    replacement and builds all of its confusion matrices with one bincount.
+    
+    Returns:
+        Dict metric -> {'value': [K], 'low': [K], 'high': [K]} for precision,
+        recall and f1 (per class), plus scalar accuracy and balanced_accuracy
+    """
+    y_true = np.asarray(y_true, dtype=np.int64)
+    y_pred = np.asarray(y_pred, dtype=np.int64)
+    k = num_classes
+    n = len(y_true)
+    codes = y_true * k + y_pred
+    rng = np.random.default_rng(seed)
+    
+    replicates = []
+    for start in range(0, samples, chunk):
+        size = min(chunk, samples - start)
+        resampled = codes[rng.integers(0, n, size=(size, n))]
+        resampled += (np.arange(size) * k * k)[:, None]
+        cm = np.bincount(resampled.ravel(), minlength=size * k * k).reshape(size, k, k)
+        replicates.append(metrics_from_confusion(cm))
+    
+    point = metrics_from_confusion(np.bincount(codes, minlength=k * k).reshape(k, k))
+    alpha = (1 - confidence) / 2
+    intervals = {}
+    for metric, value in point.items():
+        values = np.concatenate([r[metric] for r in replicates])
+        low, high = np.quantile(values, [alpha, 1 - alpha], axis=0)
+        intervals[metric] = {'value': np.asarray(value).tolist(), 'low': low.tolist(), 'high': high.tolist()}
+    intervals['confidence'] = confidence
+    intervals['samples'] = samples
+    return intervals
+
+
+def evaluate_dataset(model, dataset, num_classes: int, keep_predictions: bool = True) -> StreamingEvaluator:
+    """Run a model over a batched (images, labels) dataset, accumulating metrics"""
+    evaluator = StreamingEvaluator(num_classes, keep_predictions=keep_predictions)
+    for images, labels in dataset:
+        evaluator.update(np.asarray(labels), model.predict_on_batch(images))
+    return evaluator
+
+
+def format_metrics(metrics: dict, intervals: Optional[dict] = None,
+                  class_names: Optional[Sequence[str]] = None) -> str:
+    """Per-class table with optional bootstrap intervals"""
+    num_classes = len(metrics['recall'])
+    names = list(class_names) if class_names is not None else [str(c) for c in range(num_classes)]
+    
+    def cell(metric, c):
+        value = metrics[metric][c]
+        if intervals is None:
+            return f"{value:>6.3f}"
+        return f"{value:.3f} [{intervals[metric]['low'][c]:.2f}-{intervals[metric]['high'][c]:.2f}]"
+    
+    width = 20 if intervals is not None else 9
+    lines = [f"{'Class':<12} {'Support':>7} {'Precision':>{width}} {'Recall':>{width}} {'F1':>{width}} {'AUC':>6}"]
+    for c in range(num_classes):
+        lines.append(f"{names[c]:<12} {metrics['support'][c]:>7} {cell('precision', c):>{width}} "
+                     f"{cell('recall', c):>{width}} {cell('f1', c):>{width}} {metrics['auc'][c]:>6.3f}")
+    lines.append(f"\nLoss {metrics['loss']:.4f} | Accuracy {metrics['accuracy']:.4f} | "
+                 f"Balanced accuracy {metrics['balanced_accuracy']:.4f} | Macro AUC {metrics['macro_auc']:.4f}")
+    if intervals is not None:
+        lines.append(f"Intervals: {intervals['confidence']:.0%} percentile bootstrap, "
+                     f"{intervals['samples']} resamples of the cached predictions")
+    return "\n".join(lines)
@@ -0,0 +1,347 @@
+"""
+Head hyperparameter experiments on cached backbone features
+Each trial is a grouped k-fold cross-validation of one head configuration,
+trained on features from app.utils.feature_cache. Trials run in parallel
+worker processes and results are stored in a local SQLite table, together
+with their setup (feature cache, views, folds): scores from different
+setups are not comparable, so resuming and ranking stay within one setup.
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sklearn.model_selection import GroupKFold
+
+from app.utils.data_loader import BASE_DIR
+
+RESULTS_DB = BASE_DIR / "ml_models" / "experiments.db"
+BEST_CONFIG_PATH = BASE_DIR / "ml_models" / "best_head_config.json"
+
+# Head hyperparameters swept by default
+SEARCH_SPACE = {
+    'dense_units': [(256, 128), (512, 256), (256,), (512, 128)],
+    'dropout': [0.2, 0.3, 0.5],
+    'learning_rate': [1e-3, 3e-4, 1e-4],
+    'class_weight': [None, 'balanced', 'sqrt'],
+}
+
+TRIAL_EPOCHS = 30
+TRIAL_BATCH_SIZE = 64
+TRIAL_PATIENCE = 5
+
+
+def grid_configs(space: Dict[str, list] = SEARCH_SPACE) -> List[dict]:
+    """Every combination in the search space"""
+    keys = sorted(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_configs(n: int, space: Dict[str, list] = SEARCH_SPACE, seed: int = 42) -> List[dict]:
+    """n distinct configurations sampled uniformly from the grid"""
+    grid = grid_configs(space)
+    return random.Random(seed).sample(grid, min(n, len(grid)))
+
+
+def config_key(config: dict) -> str:
+    """Canonical JSON form of a configuration, used to skip trials already run"""
+    return json.dumps(config, sort_keys=True)
+
+
+def trial_setup(feature_dir: Path, views: int, k: int) -> dict:
+    """
+    What makes trial scores comparable besides the configuration
+    
+    Args:
+        feature_dir: Feature cache directory; its name carries the hash of the
+            backbone, preprocessing and data config (feature_cache_dir)
+        views: Augmented views trained on
+        k: Folds
+    """
+    return {'features': Path(feature_dir).name, 'views': int(views), 'folds': int(k)}
+
+
+def group_folds(labels: np.ndarray, groups: np.ndarray, k: int = 5) -> List[tuple]:
+    """
+    k folds split by lesion_id, so no lesion has images on both sides
+    
+    Returns:
+        List of (train_indices, val_indices)
+    """
+    return list(GroupKFold(n_splits=k).split(np.zeros(len(labels)), labels, groups))
+
+
+def class_weights(labels: np.ndarray, num_classes: int, mode: Optional[str]) -> Optional[dict]:
+    """None, 'balanced' (inverse frequency) or 'sqrt' (square root of inverse frequency)"""
+    if mode is None:
+        return None
+    counts = np.bincount(labels, minlength=num_classes).astype(np.float64)
+    weights = len(labels) / (num_classes * np.maximum(counts, 1))
+    if mode == 'sqrt':
+        weights = np.sqrt(weights)
+    elif mode != 'balanced':
+        raise ValueError(f"Unknown class_weight mode: {mode}")
+    return {i: float(w) for i, w in enumerate(weights)}
+
+
+class ResultsStore:
+    """SQLite table of trial results, one row per (experiment, setup, configuration)"""
+    
+    def __init__(self, path: Path = RESULTS_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(trials)")}
+            if columns and 'features' not in columns:
+                # Trials stored before their setup was recorded cannot be resumed or ranked safely
+                conn.execute("ALTER TABLE trials RENAME TO trials_without_setup")
+                print("Moved trials without a recorded setup to table trials_without_setup")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trials (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    experiment TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    features TEXT NOT NULL,
+                    views INTEGER NOT NULL,
+                    folds INTEGER NOT NULL,
+                    mean_accuracy REAL,
+                    std_accuracy REAL,
+                    mean_balanced_accuracy REAL,
+                    std_balanced_accuracy REAL,
+                    fold_results TEXT,
+                    seconds REAL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (experiment, features, views, folds, config)
+                )
+            """)
+    
+    def _connect(self):
+        return sqlite3.connect(self.path)
+    
+    def completed(self, experiment: str, setup: dict) -> set:
+        """Config keys already stored for an experiment with this setup (see trial_setup)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT config FROM trials WHERE experiment = ? AND features = ? AND views = ? AND folds = ?",
+                (experiment, setup['features'], setup['views'], setup['folds'])
+            )
+            return {row[0] for row in rows}
+    
+    def setups(self, experiment: str) -> List[dict]:
+        """Setups an experiment has trials for, most recently run first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT features, views, folds FROM trials WHERE experiment = ?
+                   GROUP BY features, views, folds ORDER BY MAX(id) DESC""",
+                (experiment,)
+            ).fetchall()
+        return [{'features': features, 'views': views, 'folds': folds} for features, views, folds in rows]
+    
+    def add(self, experiment: str, result: dict, setup: dict):
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO trials
+                   (experiment, config, features, views, folds, mean_accuracy, std_accuracy,
+                    mean_balanced_accuracy, std_balanced_accuracy, fold_results, seconds)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (experiment, config_key(result['config']), setup['features'], setup['views'], setup['folds'],
+                 result['mean_accuracy'], result['std_accuracy'],
+                 result['mean_balanced_accuracy'], result['std_balanced_accuracy'],
+                 json.dumps(result['folds']), result['seconds'])
+            )
+    
+    def leaderboard(self, experiment: str, metric: str = 'mean_balanced_accuracy', limit: int = 10,
+                    setup: Optional[dict] = None) -> List[dict]:
+        """Best trials of an experiment within one setup (default: the most recent), highest metric first"""
+        if metric not in ('mean_accuracy', 'mean_balanced_accuracy'):
+            raise ValueError(f"Unknown metric: {metric}")
+        if setup is None:
+            setups = self.setups(experiment)
+            if not setups:
+                return []
+            setup = setups[0]
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"""SELECT * FROM trials WHERE experiment = ? AND features = ? AND views = ? AND folds = ?
+                    ORDER BY {metric} DESC LIMIT ?""",
+                (experiment, setup['features'], setup['views'], setup['folds'], limit)
+            ).fetchall()
+        return [{**dict(row), 'config': json.loads(row['config'])} for row in rows]
+    
+    def export_best(self, experiment: str, path: Path = BEST_CONFIG_PATH,
+                    metric: str = 'mean_balanced_accuracy', setup: Optional[dict] = None) -> Optional[dict]:
+        """Write the best configuration of one setup (default: the most recent) and its scores to JSON"""
+        best = self.leaderboard(experiment, metric, limit=1, setup=setup)
+        if not best:
+            return None
+        best = best[0]
+        payload = {
+            'experiment': experiment,
+            'metric': metric,
+            'setup': {key: best[key] for key in ('features', 'views', 'folds')},
+            'config': best['config'],
+            'mean_accuracy': best['mean_accuracy'],
+            'mean_balanced_accuracy': best['mean_balanced_accuracy'],
+            'folds': best['folds'],
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(payload, f, indent=2)
+        return payload
+
+
+# Per-process state, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(feature_dir: str, views: Optional[int], labels: np.ndarray, folds: list, threads: int):
+    # Cap TensorFlow threads so parallel trials do not oversubscribe the cores
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    
+    from app.utils.feature_cache import load_features
+    _worker['features'] = np.asarray(load_features(feature_dir, views), dtype=np.float32)
+    _worker['labels'] = labels
+    _worker['folds'] = folds
+
+
+def run_trial(config: dict, features: np.ndarray, labels: np.ndarray, folds: list,
+              seed: int = 42) -> dict:
+    """
+    Cross-validate one head configuration
+    
+    Training folds use every cached view; validation folds use only the
+    unaugmented view.
+    
+    Args:
+        config: dense_units, dropout, learning_rate, class_weight
+        features: [views + 1, N, D] cached features
+        labels: [N] labels
+        folds: (train_indices, val_indices) pairs from group_folds
+        seed: Weight initialisation seed
+    
+    Returns:
+        Dict with config, per-fold results and mean/std accuracy and balanced accuracy
+    """
+    import tensorflow as tf
+    from sklearn.metrics import balanced_accuracy_score
+    from app.utils.feature_cache import build_head, stack_views
+    
+    start = time.perf_counter()
+    num_classes = int(labels.max()) + 1
+    fold_results = []
+    
+    for fold, (train_idx, val_idx) in enumerate(folds):
+        tf.keras.backend.clear_session()
+        tf.keras.utils.set_random_seed(seed + fold)
+        
+        X_train, y_train = stack_views(features, labels, train_idx)
+        X_val, y_val = stack_views(features, labels, val_idx, include_augmented=False)
+        
+        head = build_head(features.shape[-1], num_classes, config['dense_units'], config['dropout'])
+        head.compile(
+            optimizer=tf.keras.optimizers.Adam(learning_rate=config['learning_rate']),
+            loss='sparse_categorical_crossentropy',
+            metrics=['accuracy']
+        )
+        history = head.fit(
+            X_train, y_train,
+            validation_data=(X_val, y_val),
+            batch_size=TRIAL_BATCH_SIZE,
+            epochs=TRIAL_EPOCHS,
+            class_weight=class_weights(y_train, num_classes, config['class_weight']),
+            callbacks=[tf.keras.callbacks.EarlyStopping(
+                monitor='val_loss', patience=TRIAL_PATIENCE, restore_best_weights=True
+            )],
+            verbose=0
+        )
+        
+        y_pred = np.argmax(head.predict(X_val, batch_size=1024, verbose=0), axis=1)
+        fold_results.append({
+            'fold': fold,
+            'accuracy': float(np.mean(y_pred == y_val)),
+            'balanced_accuracy': float(balanced_accuracy_score(y_val, y_pred)),
+            'epochs': len(history.history['loss']),
+        })
+    
+    accuracy = [r['accuracy'] for r in fold_results]
+    balanced = [r['balanced_accuracy'] for r in fold_results]
+    return {
+        'config': config,
+        'folds': fold_results,
+        'mean_accuracy': float(np.mean(accuracy)),
+        'std_accuracy': float(np.std(accuracy)),
+        'mean_balanced_accuracy': float(np.mean(balanced)),
+        'std_balanced_accuracy': float(np.std(balanced)),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _run_worker_trial(config: dict) -> dict:
+    return run_trial(config, _worker['features'], _worker['labels'], _worker['folds'])
+
+
+def run_experiment(experiment: str, feature_dir: Path, labels: np.ndarray, groups: np.ndarray,
+                   configs: Iterable[dict], k: int = 5, views: Optional[int] = None,
+                   workers: Optional[int] = None, store: Optional[ResultsStore] = None) -> List[dict]:
+    """
+    Run every configuration not already stored for this experiment and setup
+    
+    Args:
+        experiment: Experiment name (results are grouped and resumed by name and
+            setup: feature cache, views and k)
+        feature_dir: Feature cache directory (see SkinDiseaseTrainer.cached_features)
+        labels: [N] labels
+        groups: [N] lesion_id per image
+        configs: Head configurations to try
+        k: Folds
+        views: Augmented views to train on (defaults to all cached views)
+        workers: Parallel trial processes (defaults to all cores)
+        store: Results table (defaults to ml_models/experiments.db)
+    
+    Returns:
+        Results of the trials run in this call
+    """
+    from app.utils.feature_cache import cached_views
+    
+    store = store or ResultsStore()
+    views = cached_views(feature_dir) if views is None else views
+    setup = trial_setup(feature_dir, views, k)
+    done = store.completed(experiment, setup)
+    pending = [config for config in configs if config_key(config) not in done]
+    if not pending:
+        print(f"All configurations of '{experiment}' already run with {setup}")
+        return []
+    
+    folds = group_folds(labels, groups, k)
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Running {len(pending)} trials ({len(done)} already stored) "
+          f"on {workers} workers x {threads} threads, {k} grouped folds")
+    
+    results = []
+    # Spawn, not fork: TensorFlow's runtime does not survive forking
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(str(feature_dir), views, labels, folds, threads)) as executor:
+        futures = {executor.submit(_run_worker_trial, config): config for config in pending}
+        for n, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            store.add(experiment, result, setup)
+            results.append(result)
+            print(f"  [{n}/{len(pending)}] {config_key(result['config'])}: "
+                  f"acc {result['mean_accuracy']:.3f} ± {result['std_accuracy']:.3f}, "
+                  f"balanced {result['mean_balanced_accuracy']:.3f} "
+                  f"({result['seconds']:.0f}s)")
+    
+    return results
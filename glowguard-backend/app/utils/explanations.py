@@ -0,0 +1,283 @@
+"""
+Grad-CAM explanation heatmaps, computed lazily and cached
+Heatmaps are never computed during /analyze. A request for a prediction's
+explanation returns the cached PNG next to the upload when it exists (named
+by method, model version and explained class, so a new model or diagnosis
+never serves a stale heatmap);
+otherwise it is queued for a background worker thread, which runs at low
+OS priority and batches every queued request into one forward/backward
+pass. The worker starts from the model input /analyze stored with the
+upload, so the image is not decoded again.
+"""
+
+import os
+import time
+import queue
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from app.utils.embeddings import pooling_layer_index
+
+METHODS = ('gradcam', 'gradcam++')
+# Explanations computed in one pass, and how long the worker waits to fill a batch
+EXPLANATION_BATCH_SIZE = 8
+BATCH_WAIT_SECONDS = 0.05
+# Heatmap opacity over the image
+OVERLAY_ALPHA = 0.4
+# Niceness of the worker thread (Linux applies it per thread)
+WORKER_NICENESS = 10
+# A failed explanation is reported for this long, then retried on the next request
+ERROR_RETRY_SECONDS = 60.0
+
+
+def model_input_path(image_path: str) -> Path:
+    """Where /analyze keeps the resized uint8 model input of an upload"""
+    return Path(f"{image_path}.input.npy")
+
+
+def explanation_path(image_path: str, method: str, model_version: Optional[str] = None,
+                     class_idx: Optional[int] = None) -> Path:
+    """Cached heatmap of an upload for one method, model version and class (None: the top class)"""
+    suffix = 'gradcampp' if method == 'gradcam++' else 'gradcam'
+    version = model_version or 'unversioned'
+    target = 'top' if class_idx is None else int(class_idx)
+    return Path(f"{os.path.splitext(image_path)[0]}.{suffix}.{version}.{target}.png")
+
+
+def remove_explanations(image_path: str) -> int:
+    """Delete every cached heatmap of an upload, e.g. after its diagnosis changed; returns how many"""
+    stem = Path(os.path.splitext(image_path)[0])
+    removed = 0
+    for path in stem.parent.glob(f"{stem.name}.gradcam*.png"):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+
+def save_model_input(image_path: str, pixels: np.ndarray) -> None:
+    np.save(model_input_path(image_path), np.asarray(pixels, dtype=np.uint8))
+
+
+def load_model_input(image_path: str, target_size=(224, 224)) -> np.ndarray:
+    """Stored uint8 model input, decoding the upload again only when none was stored"""
+    from app.utils.image_processing import load_image
+    
+    path = model_input_path(image_path)
+    if path.exists():
+        pixels = np.load(path)
+        if pixels.shape[:2] == tuple(target_size):
+            return pixels
+    return load_image(image_path, target_size, enhance=False)
+
+
+def gradcam_model(model: tf.keras.Model) -> tf.keras.Model:
+    """Model mapping images to [last feature map before pooling, class probabilities]"""
+    index = pooling_layer_index(model)
+    if index is None:
+        raise ValueError("Model has no global average pooling layer; Grad-CAM needs its feature map")
+    return tf.keras.Model(inputs=model.input, outputs=[model.layers[index].input, model.output])
+
+
+def compute_cams(cam_model: tf.keras.Model, images: np.ndarray, class_indices: Sequence[Optional[int]],
+                 method: str = 'gradcam') -> np.ndarray:
+    """
+    Class activation maps for a batch, one backward pass for all images
+    
+    Args:
+        cam_model: Model from gradcam_model
+        images: Float32 model inputs [N, H, W, 3]
+        class_indices: Class to explain per image (None explains the top class)
+        method: 'gradcam' (mean gradient weights) or 'gradcam++' (weights
+            from higher-order gradient terms, better for several lesions)
+    
+    Returns:
+        Maps in [0, 1] at feature-map resolution [N, h, w]
+    """
+    images = tf.convert_to_tensor(images, dtype=tf.float32)
+    with tf.GradientTape() as tape:
+        features, probabilities = cam_model(images, training=False)
+        predicted = tf.argmax(probabilities, axis=-1, output_type=tf.int32).numpy()
+        targets = np.array([predicted[i] if c is None else c for i, c in enumerate(class_indices)], dtype=np.int32)
+        scores = tf.gather(tf.cast(probabilities, tf.float32), targets, axis=1, batch_dims=1)
+    # Differentiate with respect to the feature map the model computed (float16 or
+    # bfloat16 under a mixed-precision policy); a cast copy is not on the graph
+    gradients = tf.cast(tape.gradient(scores, features), tf.float32)
+    features = tf.cast(features, tf.float32)
+    
+    if method == 'gradcam++':
+        squared = gradients ** 2
+        denominator = 2 * squared + tf.reduce_sum(features, axis=(1, 2), keepdims=True) * gradients ** 3
+        alpha = squared / tf.where(denominator != 0, denominator, tf.ones_like(denominator))
+        weights = tf.reduce_sum(alpha * tf.nn.relu(gradients), axis=(1, 2))
+    else:
+        weights = tf.reduce_mean(gradients, axis=(1, 2))
+    
+    cams = tf.nn.relu(tf.einsum('bhwc,bc->bhw', features, weights)).numpy()
+    peak = cams.max(axis=(1, 2), keepdims=True)
+    return np.divide(cams, peak, out=np.zeros_like(cams), where=peak > 0)
+
+
+def render_overlay(pixels: np.ndarray, cam: np.ndarray, alpha: float = OVERLAY_ALPHA) -> bytes:
+    """PNG of the RGB image with the map upsampled and blended in as a JET heatmap"""
+    height, width = pixels.shape[:2]
+    heat = cv2.resize(cam.astype(np.float32), (width, height), interpolation=cv2.INTER_CUBIC)
+    heat = cv2.applyColorMap(np.uint8(np.clip(heat, 0, 1) * 255), cv2.COLORMAP_JET)
+    overlay = cv2.addWeighted(cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR), 1 - alpha, heat, alpha, 0)
+    ok, encoded = cv2.imencode('.png', overlay)
+    if not ok:
+        raise ValueError("Could not encode the heatmap")
+    return encoded.tobytes()
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    tmp_path.replace(path)
+
+
+class ExplanationWorker:
+    """
+    Background thread producing heatmap PNGs in batches
+    
+    Requests for the same image, method and class are merged while pending,
+    so a client polling the endpoint never queues duplicate work. A failure
+    is reported for ERROR_RETRY_SECONDS, then the next request tries again.
+    
+    Usage:
+        worker = ExplanationWorker(model, prepare_fn, model_version)
+        status = worker.request(image_path, 'gradcam', class_idx)
+        worker.wait(image_path, 'gradcam', class_idx, timeout=10)
+        worker.path(image_path, 'gradcam', class_idx)
+    """
+    
+    def __init__(self, model: tf.keras.Model, prepare_fn, model_version: Optional[str] = None,
+                 batch_size: int = EXPLANATION_BATCH_SIZE):
+        """
+        Args:
+            model: Serving model
+            prepare_fn: uint8 pixels -> float32 model input (the serving preprocessing)
+            model_version: Version of the model file, part of every heatmap's name
+            batch_size: Most explanations per pass
+        """
+        self.cam_model = gradcam_model(model)
+        self.input_size = tuple(model.input_shape[1:3]) if model.input_shape[1] else (224, 224)
+        self.prepare_fn = prepare_fn
+        self.model_version = model_version
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # (image_path, method, class_idx) -> Event set when the PNG is written or failed
+        self.pending: Dict[tuple, threading.Event] = {}
+        # (image_path, method, class_idx) -> (error message, time of failure)
+        self.errors: Dict[tuple, tuple] = {}
+        self.thread = threading.Thread(target=self._run, name="explanations", daemon=True)
+        self.thread.start()
+    
+    def request(self, image_path: str, method: str, class_idx: Optional[int] = None) -> str:
+        """
+        Queue an explanation unless it is cached or already pending
+        
+        Returns:
+            'ready', 'pending' or 'failed'
+        """
+        key = (image_path, method, class_idx)
+        if self.path(*key).exists():
+            return 'ready'
+        with self.lock:
+            if self._current_error(key) is not None:
+                return 'failed'
+            self.errors.pop(key, None)
+            if key not in self.pending:
+                self.pending[key] = threading.Event()
+                self.queue.put((image_path, method, class_idx))
+        return 'pending'
+    
+    def wait(self, image_path: str, method: str, class_idx: Optional[int] = None,
+             timeout: Optional[float] = None) -> bool:
+        """Block until a queued explanation is done; True when its PNG exists"""
+        with self.lock:
+            event = self.pending.get((image_path, method, class_idx))
+        if event is not None:
+            event.wait(timeout)
+        return self.path(image_path, method, class_idx).exists()
+    
+    def error(self, image_path: str, method: str, class_idx: Optional[int] = None) -> Optional[str]:
+        with self.lock:
+            return self._current_error((image_path, method, class_idx))
+    
+    def path(self, image_path: str, method: str, class_idx: Optional[int] = None) -> Path:
+        """Where this worker's model writes the heatmap"""
+        return explanation_path(image_path, method, self.model_version, class_idx)
+    
+    def _current_error(self, key: tuple) -> Optional[str]:
+        """Error message of a recent failure; expired failures count as none"""
+        failure = self.errors.get(key)
+        if failure is None or time.monotonic() - failure[1] > ERROR_RETRY_SECONDS:
+            return None
+        return failure[0]
+    
+    def _lower_priority(self):
+        if hasattr(os, 'setpriority') and hasattr(threading, 'get_native_id'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICENESS)
+            except OSError:
+                pass
+    
+    def _next_batch(self) -> List[tuple]:
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=BATCH_WAIT_SECONDS))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        self._lower_priority()
+        while True:
+            batch = self._next_batch()
+            for method in METHODS:
+                jobs = [job for job in batch if job[1] == method]
+                if jobs:
+                    self._explain(jobs, method)
+    
+    def _explain(self, jobs: List[tuple], method: str):
+        loaded = []
+        for image_path, _, class_idx in jobs:
+            try:
+                loaded.append((image_path, class_idx, load_model_input(image_path, self.input_size)))
+            except Exception as e:
+                self._finish(image_path, method, class_idx, f"Could not load the image: {e}")
+        if not loaded:
+            return
+        
+        try:
+            images = np.stack([self.prepare_fn(pixels) for _, _, pixels in loaded])
+            cams = compute_cams(self.cam_model, images, [c for _, c, _ in loaded], method)
+        except Exception as e:
+            for image_path, class_idx, _ in loaded:
+                self._finish(image_path, method, class_idx, f"Explanation failed: {e}")
+            return
+        
+        for (image_path, class_idx, pixels), cam in zip(loaded, cams):
+            try:
+                write_atomic(self.path(image_path, method, class_idx), render_overlay(pixels, cam))
+                self._finish(image_path, method, class_idx)
+            except Exception as e:
+                self._finish(image_path, method, class_idx, f"Could not write the heatmap: {e}")
+    
+    def _finish(self, image_path: str, method: str, class_idx: Optional[int], error: Optional[str] = None):
+        key = (image_path, method, class_idx)
+        with self.lock:
+            if error is not None:
+                print(f"Explanation error for {image_path}: {error}")
+                self.errors[key] = (error, time.monotonic())
+            event = self.pending.pop(key, None)
+        if event is not None:
+            event.set()
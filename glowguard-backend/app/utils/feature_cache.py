@@ -0,0 +1,150 @@
+"""
+Frozen-backbone feature cache
+With the EfficientNet base frozen, its pooled output never changes during
+head training. Running it once per (image, augmented view) and caching the
+result lets the head train on small float16 vectors in seconds per epoch.
+"""
+
+import json
+import hashlib
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Union
+
+import numpy as np
+import tensorflow as tf
+
+from app.utils.data_loader import BASE_DIR
+
+FEATURE_CACHE_DIR = BASE_DIR / "ml_models" / "feature_cache"
+
+
+def feature_cache_dir(config: dict, root: Path = FEATURE_CACHE_DIR) -> Path:
+    """Directory for one backbone / preprocessing / dataset combination"""
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return Path(root) / f"{config.get('backbone', 'backbone')}_{digest}"
+
+
+def pooled_feature_extractor(base_model: tf.keras.Model) -> tf.keras.Model:
+    """Backbone followed by global average pooling, as used in front of every head"""
+    pooled = tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+    return tf.keras.Model(inputs=base_model.input, outputs=pooled)
+
+
+def extract_features(extractor: tf.keras.Model, dataset: tf.data.Dataset) -> np.ndarray:
+    """Run the frozen backbone over a batched (images, labels) dataset"""
+    features = extractor.predict(dataset.map(lambda x, y: x), verbose=1)
+    return features.astype(np.float16)
+
+
+def load_or_extract_features(extractor: tf.keras.Model, make_view_dataset: Callable[[int], tf.data.Dataset],
+                             views: int, config: dict, root: Path = FEATURE_CACHE_DIR) -> np.ndarray:
+    """
+    Cached pooled features for view 0 (unaugmented) plus `views` augmented views
+    
+    Each view is written as soon as it is computed, so an interrupted
+    extraction resumes at the next missing view.
+    
+    Args:
+        extractor: Model mapping images to pooled backbone features
+        make_view_dataset: view index -> unshuffled batched dataset over all images
+            (view 0 must be unaugmented)
+        views: Number of augmented views
+        config: Everything that determines the features (backbone, size, preprocessing, data)
+        root: Cache root directory
+    
+    Returns:
+        float16 array of shape [views + 1, N, feature_dim]
+    """
+    directory = feature_cache_dir(config, root)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "config.json", 'w') as f:
+        json.dump(config, f, indent=2)
+    
+    for view in range(views + 1):
+        path = directory / f"view_{view:02d}.npy"
+        if path.exists():
+            print(f"Feature view {view}: cached")
+            continue
+        print(f"Feature view {view}: extracting")
+        features = extract_features(extractor, make_view_dataset(view))
+        tmp_path = directory / f"view_{view:02d}.tmp.npy"
+        np.save(tmp_path, features)
+        tmp_path.replace(path)
+    
+    return load_features(directory, views)
+
+
+def _view_paths(directory: Path) -> List[Path]:
+    return sorted(Path(directory).glob("view_[0-9][0-9].npy"))
+
+
+def cached_views(directory: Path) -> int:
+    """Augmented views stored in a feature_cache_dir (view 0 not counted)"""
+    return len(_view_paths(directory)) - 1
+
+
+def load_features(directory: Path, views: Optional[int] = None) -> np.ndarray:
+    """
+    Read cached features from a feature_cache_dir
+    
+    Args:
+        directory: Cache directory
+        views: Augmented views to load (defaults to all cached views)
+    
+    Returns:
+        float16 array of shape [views + 1, N, feature_dim]
+    """
+    paths = _view_paths(directory)
+    if views is not None:
+        paths = paths[:views + 1]
+    return np.stack([np.load(path, mmap_mode='r') for path in paths])
+
+
+def stack_views(features: np.ndarray, labels: np.ndarray, indices: np.ndarray,
+                include_augmented: bool = True):
+    """
+    Flatten selected images across views into a head training set
+    
+    Args:
+        features: [views + 1, N, D] cached features
+        labels: [N] labels
+        indices: Image indices to take
+        include_augmented: Use every view (training) or only the unaugmented one (validation)
+    
+    Returns:
+        Tuple of (features [M, D] float32, labels [M])
+    """
+    selected = features[:, indices] if include_augmented else features[:1, indices]
+    x = np.asarray(selected, dtype=np.float32).reshape(-1, features.shape[-1])
+    y = np.tile(labels[indices], selected.shape[0])
+    return x, y
+
+
+def build_head(feature_dim: int, num_classes: int, dense_units: Sequence[int] = (256, 128),
+               dropout: Union[float, Sequence[float]] = (0.3, 0.2)) -> tf.keras.Model:
+    """
+    Classifier head on pooled backbone features
+    
+    Args:
+        feature_dim: Pooled feature size of the backbone
+        num_classes: Output classes
+        dense_units: Width of each hidden Dense layer
+        dropout: Dropout after each hidden layer (one rate for all, or one per layer)
+    """
+    if isinstance(dropout, (int, float)):
+        dropout = [dropout] * len(dense_units)
+    
+    layers = [tf.keras.layers.Input(shape=(feature_dim,))]
+    for units, rate in zip(dense_units, dropout):
+        layers.append(tf.keras.layers.Dense(units, activation='relu'))
+        layers.append(tf.keras.layers.Dropout(rate))
+    # Softmax stays float32 under a mixed-precision policy
+    layers.append(tf.keras.layers.Dense(num_classes, activation='softmax', dtype='float32'))
+    return tf.keras.Sequential(layers, name='head')
+
+
+def assemble_model(base_model: tf.keras.Model, head: tf.keras.Model,
+                   name: Optional[str] = None) -> tf.keras.Model:
+    """Reattach a head trained on cached features to its backbone for serving"""
+    pooled = tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+    return tf.keras.Model(inputs=base_model.input, outputs=head(pooled), name=name)
@@ -0,0 +1,142 @@
+"""Image quality gate run on the downscaled image before inference"""
+import cv2
+import numpy as np
+import os
+import threading
+from typing import Dict, Optional
+
+# Feedback shown to the user for each rejection reason
+QUALITY_FEEDBACK = {
+    "blurry": "The photo is out of focus. Hold the camera steady and tap the lesion to focus.",
+    "overexposed": "The photo is too bright. Avoid direct flash or strong sunlight on the skin.",
+    "underexposed": "The photo is too dark. Take the picture in good, even lighting.",
+    "no_skin": "No skin was detected. Take a close-up photo of the affected skin area.",
+}
+
+class ImageQualityGate:
+    """
+    Cheap checks that reject unusable photos before the model runs
+    
+    - Sharpness: variance of the Laplacian on the grayscale image
+    - Exposure: fraction of clipped bright / dark pixels from the histogram
+    - Skin coverage: fraction of pixels inside a YCrCb skin-colour range
+    
+    All checks run on the resized model input (a few hundred pixels per side),
+    which keeps the gate at roughly a millisecond per image. Thresholds come
+    from the environment unless passed explicitly.
+    """
+    
+    # YCrCb skin-colour range (Chai & Ngan)
+    SKIN_LOWER = np.array([0, 133, 77], dtype=np.uint8)
+    SKIN_UPPER = np.array([255, 173, 127], dtype=np.uint8)
+    
+    def __init__(self,
+                 min_sharpness: Optional[float] = None,
+                 max_overexposed: Optional[float] = None,
+                 max_underexposed: Optional[float] = None,
+                 min_skin_coverage: Optional[float] = None,
+                 enabled: Optional[bool] = None):
+        self.min_sharpness = min_sharpness if min_sharpness is not None else \
+            float(os.getenv("QUALITY_MIN_SHARPNESS", 15.0))
+        self.max_overexposed = max_overexposed if max_overexposed is not None else \
+            float(os.getenv("QUALITY_MAX_OVEREXPOSED", 0.3))
+        self.max_underexposed = max_underexposed if max_underexposed is not None else \
+            float(os.getenv("QUALITY_MAX_UNDEREXPOSED", 0.3))
+        self.min_skin_coverage = min_skin_coverage if min_skin_coverage is not None else \
+            float(os.getenv("QUALITY_MIN_SKIN_COVERAGE", 0.2))
+        self.enabled = enabled if enabled is not None else \
+            os.getenv("QUALITY_GATE_ENABLED", "true").lower() in ("1", "true", "yes")
+        
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._rejected = 0
+        self._rejections_by_reason = {reason: 0 for reason in QUALITY_FEEDBACK}
+    
+    def measure(self, img: np.ndarray) -> Dict[str, float]:
+        """
+        Compute quality metrics for an RGB uint8 image
+        
+        Returns:
+            Dict with sharpness, overexposed, underexposed and skin_coverage
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        pixel_count = float(gray.size)
+        
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+        overexposed = float(hist[250:].sum() / pixel_count)
+        underexposed = float(hist[:6].sum() / pixel_count)
+        
+        ycrcb = cv2.cvtColor(img, cv2.COLOR_RGB2YCrCb)
+        skin_mask = cv2.inRange(ycrcb, self.SKIN_LOWER, self.SKIN_UPPER)
+        skin_coverage = float(cv2.countNonZero(skin_mask) / pixel_count)
+        
+        return {
+            "sharpness": sharpness,
+            "overexposed": overexposed,
+            "underexposed": underexposed,
+            "skin_coverage": skin_coverage,
+        }
+    
+    def assess(self, img: np.ndarray) -> dict:
+        """
+        Check an RGB uint8 image against the configured thresholds
+        
+        Args:
+            img: Resized RGB uint8 image (before any contrast enhancement)
+        
+        Returns:
+            Dict with passed, reasons, feedback and metrics
+        """
+        metrics = self.measure(img)
+        
+        reasons = []
+        if self.enabled:
+            if metrics["sharpness"] < self.min_sharpness:
+                reasons.append("blurry")
+            if metrics["overexposed"] > self.max_overexposed:
+                reasons.append("overexposed")
+            if metrics["underexposed"] > self.max_underexposed:
+                reasons.append("underexposed")
+            if metrics["skin_coverage"] < self.min_skin_coverage:
+                reasons.append("no_skin")
+        
+        with self._lock:
+            self._checked += 1
+            if reasons:
+                self._rejected += 1
+                for reason in reasons:
+                    self._rejections_by_reason[reason] += 1
+        
+        return {
+            "passed": not reasons,
+            "reasons": reasons,
+            "feedback": [QUALITY_FEEDBACK[reason] for reason in reasons],
+            "metrics": metrics,
+        }
+    
+    def get_metrics(self) -> dict:
+        """Counters and rejection rates by reason since startup"""
+        with self._lock:
+            checked = self._checked
+            rejected = self._rejected
+            by_reason = dict(self._rejections_by_reason)
+        
+        return {
+            "enabled": self.enabled,
+            "thresholds": {
+                "min_sharpness": self.min_sharpness,
+                "max_overexposed": self.max_overexposed,
+                "max_underexposed": self.max_underexposed,
+                "min_skin_coverage": self.min_skin_coverage,
+            },
+            "checked": checked,
+            "rejected": rejected,
+            "rejection_rate": rejected / checked if checked else 0.0,
+            "rejections_by_reason": by_reason,
+            "rejection_rate_by_reason": {
+                reason: count / checked if checked else 0.0
+                for reason, count in by_reason.items()
+            },
+        }
@@ -0,0 +1,337 @@
+"""
+Streaming tf.data input pipelines for training and evaluation
+Images are decoded on the fly from the dataset catalog instead of being
+materialised as one float32 array in RAM
+"""
+
+import time
+from typing import Callable, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from app.utils.image_processing import load_image
+from app.utils.sampling import ClassBalancedSampler
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Decoded uint8 images held for shuffling; bounds memory independent of dataset size
+DEFAULT_SHUFFLE_BUFFER = 1024
+
+
+def decode_fn(img_size: int, enhance: Optional[bool] = None,
+              crop_lesion: Optional[bool] = None, skip_unreadable: bool = False) -> Callable:
+    """
+    tf.data map function: file path -> RGB uint8 image
+    
+    Uses the serving decoder (app.utils.image_processing.load_image) so training
+    sees exactly the pixels the API will. OpenCV releases the GIL, so parallel
+    map calls decode on all cores.
+    
+    With skip_unreadable the function returns (image, label, ok) instead of
+    raising on a file that cannot be decoded, so the element can be filtered
+    out (see skip_unreadable_images) rather than aborting the whole epoch.
+    """
+    target_size = (img_size, img_size)
+    
+    def _load(path):
+        return load_image(path.decode('utf-8'), target_size, enhance=enhance, crop_lesion=crop_lesion)
+    
+    def _try_load(path):
+        try:
+            return _load(path), True
+        except Exception as e:
+            print(f"Skipping unreadable image {path.decode('utf-8')}: {e}")
+            return np.zeros((img_size, img_size, 3), dtype=np.uint8), False
+    
+    def _decode(path, label):
+        img = tf.numpy_function(_load, [path], tf.uint8)
+        img.set_shape((img_size, img_size, 3))
+        return img, label
+    
+    def _decode_or_flag(path, label):
+        img, ok = tf.numpy_function(_try_load, [path], (tf.uint8, tf.bool))
+        img.set_shape((img_size, img_size, 3))
+        ok.set_shape(())
+        return img, label, ok
+    
+    return _decode_or_flag if skip_unreadable else _decode
+
+
+def skip_unreadable_images(dataset: tf.data.Dataset) -> tf.data.Dataset:
+    """Drop the elements decode_fn(skip_unreadable=True) flagged, leaving (image, label)"""
+    return dataset.filter(lambda img, label, ok: ok).map(lambda img, label, ok: (img, label))
+
+
+def to_model_input(images, labels):
+    """uint8 [0, 255] -> float32 [0, 1], applied per batch"""
+    return tf.cast(images, tf.float32) / 255.0, labels
+
+
+def build_dataset(paths: Sequence[str], labels: Sequence[int], img_size: int = 224,
+                  batch_size: int = 32, training: bool = False,
+                  augment_fn: Optional[Callable] = None, cache: Optional[str] = None,
+                  shuffle_buffer: int = DEFAULT_SHUFFLE_BUFFER, seed: int = 42,
+                  enhance: Optional[bool] = None, crop_lesion: Optional[bool] = None,
+                  batch_augment: Optional[Callable] = None,
+                  sampler: Optional[ClassBalancedSampler] = None,
+                  skip_unreadable: bool = True) -> tf.data.Dataset:
+    """
+    Build a streaming dataset of (float32 image batch, label batch)
+    
+    Pipeline: paths -> parallel decode -> cache decoded uint8 -> shuffle ->
+    parallel augment -> batch -> batch augment -> normalize -> prefetch
+    
+    Args:
+        paths: Image file paths
+        labels: Integer class labels
+        img_size: Square model input size
+        batch_size: Batch size
+        training: Shuffle and drop the last partial batch
+        augment_fn: Per-image (uint8 image, label) -> (image, label) map function, applied when given
+        cache: None (no cache), 'memory', or a file path prefix for an on-disk cache
+        shuffle_buffer: Number of decoded images kept for shuffling
+        seed: Shuffle seed
+        enhance: Apply CLAHE + bilateral filtering (defaults to MEDICAL_PREPROCESSING)
+        crop_lesion: Crop to the lesion ROI (defaults to LESION_CROP)
+        batch_augment: Batched (images, labels) -> (images, labels) map function,
+            e.g. app.utils.augmentation.BatchAugmenter
+        sampler: ClassBalancedSampler over these paths; replaces shuffling and
+            draws a class-balanced set of indices every epoch (no cache)
+        skip_unreadable: Drop images that fail to decode (logged) instead of
+            failing the epoch; pass False where outputs must line up one to one
+            with `paths` (feature extraction, cached predictions)
+    
+    Returns:
+        tf.data.Dataset
+    """
+    if sampler is not None:
+        if cache:
+            raise ValueError("A sampler redraws images every epoch and cannot be combined with a cache")
+        path_table = tf.constant(np.asarray(paths, dtype=str))
+        dataset = sampler.dataset().map(lambda i, label: (tf.gather(path_table, i), label))
+        dataset = _decode_paths(dataset, img_size, enhance, crop_lesion, skip_unreadable)
+        return _finish(dataset, batch_size, training, augment_fn, batch_augment)
+    
+    dataset = tf.data.Dataset.from_tensor_slices(
+        (np.asarray(paths, dtype=str), np.asarray(labels, dtype=np.int32))
+    )
+    
+    if training:
+        # Shuffling file names first spreads classes across the cache file
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=False)
+    
+    dataset = _decode_paths(dataset, img_size, enhance, crop_lesion, skip_unreadable)
+    
+    if cache == 'memory':
+        dataset = dataset.cache()
+    elif cache:
+        dataset = dataset.cache(cache)
+    
+    if training:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    
+    return _finish(dataset, batch_size, training, augment_fn, batch_augment)
+
+
+def _decode_paths(dataset: tf.data.Dataset, img_size: int, enhance: Optional[bool],
+                  crop_lesion: Optional[bool], skip_unreadable: bool) -> tf.data.Dataset:
+    """(path, label) -> (uint8 image, label), without the unreadable images when skipping"""
+    dataset = dataset.map(decode_fn(img_size, enhance, crop_lesion, skip_unreadable), num_parallel_calls=AUTOTUNE)
+    return skip_unreadable_images(dataset) if skip_unreadable else dataset
+
+
+def _finish(dataset: tf.data.Dataset, batch_size: int, training: bool,
+            augment_fn: Optional[Callable], batch_augment: Optional[Callable]) -> tf.data.Dataset:
+    """Shared tail of the pipelines: augment -> batch -> batch augment -> normalize -> prefetch"""
+    if augment_fn is not None:
+        dataset = dataset.map(augment_fn, num_parallel_calls=AUTOTUNE)
+    
+    dataset = dataset.batch(batch_size, drop_remainder=training)
+    if batch_augment is not None:
+        dataset = dataset.map(batch_augment, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.map(to_model_input, num_parallel_calls=AUTOTUNE)
+    
+    return dataset.prefetch(AUTOTUNE)
+
+
+def build_shard_dataset(shards, indices: Sequence[int], batch_size: int = 32,
+                        training: bool = False, augment_fn: Optional[Callable] = None,
+                        seed: int = 42, batch_augment: Optional[Callable] = None,
+                        sampler: Optional[ClassBalancedSampler] = None,
+                        labels: Optional[np.ndarray] = None,
+                        img_size: Optional[int] = None) -> tf.data.Dataset:
+    """
+    Build a streaming dataset from memory-mapped compiled shards (app.utils.shards)
+    
+    Only row indices are shuffled, so the whole epoch order is randomised with
+    no image data held in the shuffle buffer.
+    
+    Args:
+        shards: ShardedDataset
+        indices: Rows of the compiled index to use
+        batch_size: Batch size
+        training: Shuffle and drop the last partial batch
+        augment_fn: Per-image (uint8 image, label) -> (image, label) map function, applied when given
+        seed: Shuffle seed
+        batch_augment: Batched (images, labels) -> (images, labels) map function
+        sampler: ClassBalancedSampler over positions in `indices`; replaces
+            shuffling and draws a class-balanced set of rows every epoch
+        labels: Targets per position in `indices` to use instead of the
+            compiled labels (e.g. app.utils.distillation.pack_targets)
+        img_size: Resize to this size on the fly (default: the compiled size),
+            with the same INTER_AREA filter as load_image
+    
+    Returns:
+        tf.data.Dataset of (float32 image batch, label batch)
+    """
+    img_size = img_size or shards.img_size
+    indices = np.asarray(indices, dtype=np.int64)
+    if labels is None:
+        labels = shards.labels[indices].astype(np.int32)
+    
+    def _read(i):
+        img = np.asarray(shards.image(int(i)))
+        if img_size != shards.img_size:
+            img = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_AREA)
+        return img
+    
+    def _load(i, label):
+        img = tf.numpy_function(_read, [i], tf.uint8)
+        img.set_shape((img_size, img_size, 3))
+        return img, label
+    
+    if sampler is not None:
+        row_table = tf.constant(indices)
+        dataset = sampler.dataset().map(lambda i, label: (tf.gather(row_table, i), label))
+    else:
+        dataset = tf.data.Dataset.from_tensor_slices((indices, labels))
+        if training:
+            dataset = dataset.shuffle(len(indices), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(_load, num_parallel_calls=AUTOTUNE)
+    
+    return _finish(dataset, batch_size, training, augment_fn, batch_augment)
+
+
+def epoch_order(n: int, seed: int, epoch: int) -> np.ndarray:
+    """Sample order for an epoch; a pure function of (seed, epoch) so it can be replayed"""
+    return np.random.default_rng([seed, epoch]).permutation(n)
+
+
+def build_epoch_dataset(read_fn: Callable[[int], np.ndarray], labels: Sequence[int], img_size: int,
+                        epoch: int, batch_size: int = 32, seed: int = 42, start_step: int = 0,
+                        augmenter=None, sampler: Optional[ClassBalancedSampler] = None) -> tf.data.Dataset:
+    """
+    One training epoch whose order and augmentation depend only on (seed, epoch)
+    
+    Used for resumable training: the sample order comes from epoch_order and
+    every batch gets a stateless augmentation seed from (seed, epoch, step), so
+    starting at start_step replays exactly the batches an interrupted run would
+    have seen.
+    
+    Args:
+        read_fn: Sample index -> RGB uint8 image
+        labels: Integer class labels
+        img_size: Square image size
+        epoch: Epoch number
+        batch_size: Batch size (the last partial batch is dropped)
+        seed: Run seed
+        start_step: Batches of this epoch already trained on
+        augmenter: BatchAugmenter holding the augmentation policy
+        sampler: ClassBalancedSampler whose epoch_indices replace epoch_order
+    
+    Returns:
+        tf.data.Dataset of (float32 image batch, label batch)
+    """
+    labels = np.asarray(labels, dtype=np.int32)
+    order = sampler.epoch_indices(epoch) if sampler is not None else epoch_order(len(labels), seed, epoch)
+    steps = len(order) // batch_size
+    order = order[start_step * batch_size:steps * batch_size]
+    
+    def _read(i):
+        return np.asarray(read_fn(int(i)))
+    
+    def _load(i, label):
+        img = tf.numpy_function(_read, [i], tf.uint8)
+        img.set_shape((img_size, img_size, 3))
+        return img, label
+    
+    def _augment(step, batch):
+        images, labels = batch
+        return augmenter(images, labels, seed=tf.stack([tf.constant(seed, tf.int64), epoch * 1_000_000 + step]))
+    
+    # tf.data keeps element order under parallel map unless told otherwise
+    dataset = tf.data.Dataset.from_tensor_slices((order.astype(np.int64), labels[order]))
+    dataset = dataset.map(_load, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.batch(batch_size, drop_remainder=True)
+    if augmenter is not None:
+        dataset = dataset.enumerate(start=start_step).map(_augment, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.map(to_model_input, num_parallel_calls=AUTOTUNE)
+    
+    return dataset.prefetch(AUTOTUNE)
+
+
+def image_data_generator_augment_fn(datagen, img_size: int, seed: Optional[int] = None) -> Callable:
+    """
+    Wrap a Keras ImageDataGenerator policy as a parallel per-image tf.data map function
+    
+    Args:
+        datagen: ImageDataGenerator holding the augmentation policy
+        img_size: Square image size
+        seed: Optional base seed
+    
+    Returns:
+        (uint8 image, label) -> (uint8 image, label) map function
+    """
+    rng = np.random.default_rng(seed)
+    
+    def _augment(img):
+        transformed = datagen.random_transform(img.astype(np.float32), seed=int(rng.integers(2**31)))
+        return np.clip(transformed, 0, 255).astype(np.uint8)
+    
+    def _map(img, label):
+        out = tf.numpy_function(_augment, [img], tf.uint8)
+        out.set_shape((img_size, img_size, 3))
+        return out, label
+    
+    return _map
+
+
+def measure_throughput(dataset: tf.data.Dataset, steps: int = 50) -> Tuple[float, int]:
+    """
+    Iterate a batched dataset and report input-pipeline throughput
+    
+    Returns:
+        Tuple of (images per second, images seen)
+    """
+    images = 0
+    start = time.perf_counter()
+    for batch, _ in dataset.take(steps):
+        images += int(batch.shape[0])
+    elapsed = time.perf_counter() - start
+    return (images / elapsed if elapsed > 0 else 0.0), images
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Log training images/sec for each epoch"""
+    
+    def __init__(self, batch_size: int):
+        super().__init__()
+        self.batch_size = batch_size
+        self.epoch_images_per_sec = []
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+        self._batches = 0
+    
+    def on_train_batch_end(self, batch, logs=None):
+        self._batches += 1
+    
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._start
+        images_per_sec = self._batches * self.batch_size / elapsed if elapsed > 0 else 0.0
+        self.epoch_images_per_sec.append(images_per_sec)
+        if logs is not None:
+            logs['images_per_sec'] = images_per_sec
+        print(f" - {images_per_sec:.1f} images/sec")
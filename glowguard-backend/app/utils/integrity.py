@@ -0,0 +1,200 @@
+"""
+Dataset integrity scanning
+Validates every training image (decodes fully, checks dimensions, matches it
+to its metadata row) with a process pool, and records size, mtime and
+checksum per file in a manifest. Re-scans only decode files whose size or
+mtime changed. DatasetCatalog.build drops images the manifest marks as bad.
+"""
+
+import os
+import io
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.utils.data_loader import (
+    DatasetCatalog, HAM10000_IMAGES_PART1, HAM10000_IMAGES_PART2, HAM10000_METADATA,
+    INTEGRITY_MANIFEST, ISIC2018_GROUND_TRUTH, ISIC2018_TEST_IMAGES
+)
+
+# Shortest side below which an image is rejected (HAM10000 images are 600x450)
+MIN_IMAGE_SIDE = 64
+# Files per worker task
+SCAN_CHUNK_SIZE = 128
+
+STATUS_OK = 'ok'
+# Statuses of files that exist and have a metadata row but cannot be used
+BAD_STATUSES = ('unreadable', 'corrupt', 'truncated', 'too_small')
+
+MANIFEST_COLUMNS = ['image_id', 'source', 'dx', 'path', 'size', 'mtime_ns', 'checksum',
+                    'width', 'height', 'status', 'error']
+# Columns that depend only on file content, reused while size and mtime match
+CHECK_COLUMNS = ['checksum', 'width', 'height', 'status', 'error']
+
+
+def check_image(path: str) -> dict:
+    """
+    Checksum and fully decode one image file
+    
+    Returns:
+        Dict with checksum, width, height, status and error
+    """
+    from PIL import Image, UnidentifiedImageError
+    
+    result = {'checksum': None, 'width': 0, 'height': 0, 'status': STATUS_OK, 'error': ''}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        return {**result, 'status': 'unreadable', 'error': str(e)}
+    
+    result['checksum'] = hashlib.sha1(data).hexdigest()
+    
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            result['width'], result['height'] = img.size
+            # DCT-scaled decode still reads the whole entropy stream, so truncation is caught
+            img.draft('RGB', (img.size[0] // 8, img.size[1] // 8))
+            img.load()
+    except UnidentifiedImageError:
+        return {**result, 'status': 'corrupt', 'error': 'not a recognised image format'}
+    except OSError as e:
+        status = 'truncated' if 'truncated' in str(e) else 'corrupt'
+        return {**result, 'status': status, 'error': str(e)}
+    except Exception as e:
+        return {**result, 'status': 'corrupt', 'error': str(e)}
+    
+    if min(result['width'], result['height']) < MIN_IMAGE_SIDE:
+        result.update(status='too_small', error=f"{result['width']}x{result['height']}")
+    
+    return result
+
+
+def _check_chunk(paths: List[str]) -> List[dict]:
+    return [check_image(path) for path in paths]
+
+
+def _collect_files() -> pd.DataFrame:
+    """Every image file and every metadata row, matched by image_id"""
+    frames = []
+    sources = [
+        ('HAM10000', HAM10000_METADATA, [HAM10000_IMAGES_PART1, HAM10000_IMAGES_PART2]),
+        ('ISIC2018', ISIC2018_GROUND_TRUTH, [ISIC2018_TEST_IMAGES]),
+    ]
+    for source, csv_path, directories in sources:
+        files = DatasetCatalog._scan_images(directories)
+        # Explicit dtype: an empty list would make a float64 key the merge refuses
+        files = pd.DataFrame({'image_id': list(files.keys()), 'path': list(files.values())}, dtype=object)
+        if csv_path.exists():
+            labels = DatasetCatalog._read_labels(csv_path)[['image_id', 'dx']].drop_duplicates('image_id')
+        else:
+            labels = pd.DataFrame(columns=['image_id', 'dx'], dtype=object)
+        if files.empty and labels.empty:
+            continue
+        
+        frame = labels.astype({'image_id': object}).merge(files, on='image_id', how='outer')
+        frame['source'] = source
+        frames.append(frame)
+    
+    if not frames:
+        return pd.DataFrame(columns=['image_id', 'dx', 'path', 'source'], dtype=object)
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_manifest(manifest_path: Path = INTEGRITY_MANIFEST) -> Optional[pd.DataFrame]:
+    if not Path(manifest_path).exists():
+        return None
+    manifest = pd.read_csv(manifest_path, dtype={'dx': str, 'path': str, 'checksum': str, 'error': str})
+    manifest['error'] = manifest['error'].fillna('')
+    return manifest
+
+
+def scan_dataset(manifest_path: Path = INTEGRITY_MANIFEST, workers: Optional[int] = None,
+                 full: bool = False) -> pd.DataFrame:
+    """
+    Validate every HAM10000 and ISIC2018 image and update the manifest
+    
+    Files whose size and mtime match the previous manifest keep their
+    recorded result; only new or changed files are read and decoded.
+    
+    Args:
+        manifest_path: Manifest CSV location
+        workers: Worker processes (defaults to all cores)
+        full: Re-check every file regardless of the manifest
+    
+    Returns:
+        Manifest DataFrame with one row per image file or metadata row. Status is
+        'ok', one of BAD_STATUSES, 'missing' (metadata row without a file) or
+        'unlabeled' (readable file without a metadata row; an unusable one
+        keeps its bad status).
+    """
+    frame = _collect_files()
+    
+    has_file = frame['path'].notna()
+    sizes = np.zeros(len(frame), dtype=np.int64)
+    mtimes = np.zeros(len(frame), dtype=np.int64)
+    for i in np.flatnonzero(has_file):
+        stat = os.stat(frame['path'].iat[i])
+        sizes[i], mtimes[i] = stat.st_size, stat.st_mtime_ns
+    frame['size'] = np.where(has_file, sizes, 0)
+    frame['mtime_ns'] = np.where(has_file, mtimes, 0)
+    
+    for column in CHECK_COLUMNS:
+        frame[column] = None
+    
+    previous = None if full else load_manifest(manifest_path)
+    if previous is not None and len(previous):
+        # 'unlabeled' is only given to readable files, so it stands for 'ok' here;
+        # the label match below is redone either way
+        previous['status'] = previous['status'].replace('unlabeled', STATUS_OK)
+        previous = previous[previous['status'].isin((STATUS_OK,) + BAD_STATUSES)]
+        previous = previous.drop_duplicates('path').set_index('path')
+        known = frame['path'].map(previous['size']).eq(frame['size']) & \
+            frame['path'].map(previous['mtime_ns']).eq(frame['mtime_ns'])
+        for column in CHECK_COLUMNS:
+            frame.loc[known, column] = frame.loc[known, 'path'].map(previous[column])
+    else:
+        known = pd.Series(False, index=frame.index)
+    
+    pending = frame.index[has_file & ~known]
+    print(f"Scanning {int(has_file.sum())} files: {int((has_file & known).sum())} unchanged, "
+          f"{len(pending)} to check")
+    
+    if len(pending):
+        paths = frame.loc[pending, 'path'].tolist()
+        chunks = [paths[i:i + SCAN_CHUNK_SIZE] for i in range(0, len(paths), SCAN_CHUNK_SIZE)]
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for done, chunk in enumerate(executor.map(_check_chunk, chunks), 1):
+                results.extend(chunk)
+                if done % 10 == 0 or done == len(chunks):
+                    print(f"  {min(done * SCAN_CHUNK_SIZE, len(paths))}/{len(paths)} checked")
+        checked = pd.DataFrame(results, index=pending)
+        for column in CHECK_COLUMNS:
+            frame.loc[pending, column] = checked[column]
+    
+    # Matching against the metadata, redone every scan since the CSVs may change
+    frame.loc[~has_file, 'status'] = 'missing'
+    frame.loc[has_file & frame['dx'].isna() & (frame['status'] == STATUS_OK), 'status'] = 'unlabeled'
+    frame['error'] = frame['error'].fillna('')
+    
+    frame = frame[MANIFEST_COLUMNS]
+    Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(f"{manifest_path}.tmp")
+    frame.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, manifest_path)
+    
+    return frame
+
+
+def summarize(manifest: pd.DataFrame) -> dict:
+    """Counts per source and status"""
+    counts = manifest.groupby(['source', 'status']).size()
+    summary = {}
+    for (source, status), count in counts.items():
+        summary.setdefault(source, {})[status] = int(count)
+    return summary
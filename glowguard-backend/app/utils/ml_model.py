@@ -3,9 +3,11 @@ import tensorflow as tf
 from tensorflow.keras.preprocessing import image
 import numpy as np
 import os
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 import json
 
+from app.utils.embeddings import backbone_version, embedding_model, encode_embedding, model_version
+
 class SkinDiseasePredictor:
     """Wrapper for skin disease prediction model"""
     
@@ -15,6 +17,9 @@ class SkinDiseasePredictor:
         self.model = None
         self.class_labels = self._load_class_labels()
         self.load_model()
+        # Built on first use by predict_top_3_with_embedding
+        self._embedding_model = None
+        self._versions = None
     
     def load_model(self):
         """Load the TensorFlow model"""
@@ -58,7 +63,8 @@ class SkinDiseasePredictor:
         if os.path.exists(labels_path):
             try:
                 with open(labels_path, 'r') as f:
-                    return json.load(f)
+                    # JSON object keys are strings; lookups use class indices
+                    return {int(idx): label for idx, label in json.load(f).items()}
             except:
                 return default_labels
         
@@ -122,36 +128,8 @@ class SkinDiseasePredictor:
             
             # Get predictions
             predictions = self.model.predict(img_array, verbose=0)
-            prediction_scores = predictions[0]
-            
-            # Get top-3 indices
-            top_3_indices = np.argsort(prediction_scores)[-3:][::-1]  # Sort descending
-            
-            # Build result list
-            results = []
-            for idx in top_3_indices:
-                confidence = float(prediction_scores[idx])
-                disease_name = self.class_labels.get(int(idx), "Unknown")
-                
-                # Ensure minimum viable confidence
-                if confidence < 0.15:
-                    continue  # Skip very low confidence predictions
-                
-                results.append({
-                    'disease': disease_name,
-                    'confidence': confidence,
-                    'class_idx': int(idx)
-                })
             
-            # Always return at least 1 prediction, even if low confidence
-            if not results:
-                results.append({
-                    'disease': "Dermatitis",  # Safe default
-                    'confidence': 0.5,
-                    'class_idx': 4
-                })
-            
-            return results
+            return self._top_3_from_scores(predictions[0])
         
         except Exception as e:
             print(f"Prediction error: {e}")
@@ -161,6 +139,106 @@ class SkinDiseasePredictor:
                 'confidence': 0.6,
                 'class_idx': 0
             }]
+    
+    def _top_3_from_scores(self, prediction_scores: np.ndarray) -> list:
+        """Build the top-3 differential diagnosis list from one row of class scores"""
+        # Get top-3 indices
+        top_3_indices = np.argsort(prediction_scores)[-3:][::-1]  # Sort descending
+        
+        # Build result list
+        results = []
+        for idx in top_3_indices:
+            confidence = float(prediction_scores[idx])
+            disease_name = self.class_labels.get(int(idx), "Unknown")
+            
+            # Ensure minimum viable confidence
+            if confidence < 0.15:
+                continue  # Skip very low confidence predictions
+            
+            results.append({
+                'disease': disease_name,
+                'confidence': confidence,
+                'class_idx': int(idx)
+            })
+        
+        # Always return at least 1 prediction, even if low confidence
+        if not results:
+            results.append({
+                'disease': "Dermatitis",  # Safe default
+                'confidence': 0.5,
+                'class_idx': 4
+            })
+        
+        return results
+    
+    def model_versions(self) -> Dict[str, str]:
+        """Model file hash and backbone weight hash, stored with each embedding"""
+        if self._versions is None:
+            self._versions = {
+                'model_version': model_version(self.model_path) if os.path.exists(self.model_path) else None,
+                'backbone_version': backbone_version(self.model),
+            }
+        return self._versions
+    
+    def predict_top_3_with_embedding(self, image_array: np.ndarray) -> Tuple[list, Optional[bytes]]:
+        """
+        predict_top_3 plus the pooled backbone embedding, from one forward pass
+        
+        Returns:
+            Tuple of (top-3 list, float16 embedding bytes or None when the
+            model cannot be split at a pooling layer)
+        """
+        try:
+            if self.model is None:
+                raise Exception("Model not loaded")
+            if self._embedding_model is None:
+                self._embedding_model = embedding_model(self.model) or False
+            if self._embedding_model is False:
+                return self.predict_top_3(image_array), None
+            
+            embedding, predictions = self._embedding_model.predict(np.expand_dims(image_array, axis=0), verbose=0)
+            return self._top_3_from_scores(predictions[0]), encode_embedding(embedding[0])
+        
+        except Exception as e:
+            print(f"Embedding prediction error: {e}")
+            return self.predict_top_3(image_array), None
+    
+    def predict_batch(self, image_batch: np.ndarray) -> np.ndarray:
+        """
+        Run the model on a whole preprocessed batch
+        
+        The batch (e.g. PooledBatch.inputs from process_images_batch) is passed
+        to the model as-is, without re-stacking or copying per image.
+        
+        Args:
+            image_batch: Float32 array of shape [N, height, width, 3]
+        
+        Returns:
+            Class probability matrix of shape [N, num_classes]
+        """
+        if self.model is None:
+            raise Exception("Model not loaded")
+        
+        return np.asarray(self.model(image_batch, training=False))
+    
+    def predict_top_3_batch(self, image_batch: np.ndarray) -> list:
+        """
+        Top-3 predictions for every image in a preprocessed batch
+        
+        Returns:
+            One predict_top_3-style result list per image
+        """
+        try:
+            predictions = self.predict_batch(image_batch)
+            return [self._top_3_from_scores(scores) for scores in predictions]
+        
+        except Exception as e:
+            print(f"Prediction error: {e}")
+            return [[{
+                'disease': "Acne",
+                'confidence': 0.6,
+                'class_idx': 0
+            }] for _ in range(len(image_batch))]
 
 class DiseaseDatabaseHandler:
     """Handle disease information database"""
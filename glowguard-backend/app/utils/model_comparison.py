@@ -0,0 +1,269 @@
+"""
+Cached-prediction model comparison
+Each model runs once over a fixed evaluation set; its class probabilities are
+stored as .npy files keyed by model version (hash of the model file) and
+evaluation-set hash (image ids and labels). Comparisons then only load the
+cached matrices: per-class metric deltas against a baseline, pairwise
+McNemar tests and a prediction agreement matrix, in seconds for any set of
+models.
+"""
+
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+from scipy.stats import binomtest
+
+from app.utils.data_loader import BASE_DIR
+from app.utils.embeddings import model_version
+from app.utils.evaluation import StreamingEvaluator
+
+PREDICTIONS_DIR = BASE_DIR / "ml_models" / "predictions"
+# name -> model path; models compared by default (compare_models.py --register)
+MODEL_REGISTRY = BASE_DIR / "ml_models" / "model_registry.json"
+# Used while no registry exists: the served model and the training checkpoint
+DEFAULT_MODELS = {
+    'production': 'ml_models/resnet_model.h5',
+    'candidate': 'ml_models/best_model.h5',
+}
+
+LABELS_FILE = "labels.npy"
+
+
+def dataset_hash(image_ids: Sequence[str], labels: Sequence[int]) -> str:
+    """Fingerprint of an evaluation set's images and labels"""
+    payload = "\n".join(f"{i},{int(label)}" for i, label in zip(image_ids, labels))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def load_registry(registry_path: Path = MODEL_REGISTRY) -> Dict[str, str]:
+    """Registered models (name -> path), or DEFAULT_MODELS without a registry file"""
+    if not Path(registry_path).exists():
+        return dict(DEFAULT_MODELS)
+    with open(registry_path, 'r') as f:
+        return json.load(f)
+
+
+def register_model(name: str, path: str, registry_path: Path = MODEL_REGISTRY) -> Dict[str, str]:
+    registry = load_registry(registry_path)
+    registry[name] = str(path)
+    Path(registry_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(registry_path, 'w') as f:
+        json.dump(registry, f, indent=2)
+    return registry
+
+
+class PredictionCache:
+    """
+    Probability matrices on disk, one directory per evaluation set
+    
+    Layout:
+        <directory>/<dataset hash>/labels.npy
+        <directory>/<dataset hash>/<model version>_<variant>.npy    [N, K] float32
+        <directory>/<dataset hash>/<model version>_<variant>.json   metadata
+    
+    `variant` names the preprocessing the model saw (see prediction_key), so
+    one model evaluated at two input settings keeps both results.
+    
+    Usage:
+        cache = PredictionCache()
+        probs = cache.get_or_predict(key, ids, labels, lambda: run_model(...), metadata)
+    """
+    
+    def __init__(self, directory: Path = PREDICTIONS_DIR):
+        self.directory = Path(directory)
+    
+    def set_dir(self, set_hash: str) -> Path:
+        return self.directory / set_hash
+    
+    def path(self, set_hash: str, key: str) -> Path:
+        return self.set_dir(set_hash) / f"{key}.npy"
+    
+    def labels(self, set_hash: str) -> Optional[np.ndarray]:
+        path = self.set_dir(set_hash) / LABELS_FILE
+        return np.load(path) if path.exists() else None
+    
+    def get(self, set_hash: str, key: str) -> Optional[np.ndarray]:
+        path = self.path(set_hash, key)
+        return np.load(path, mmap_mode='r') if path.exists() else None
+    
+    def put(self, set_hash: str, key: str, labels: np.ndarray, probabilities: np.ndarray,
+            metadata: Optional[dict] = None) -> Path:
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        if len(probabilities) != len(labels):
+            raise ValueError(f"{len(probabilities)} predictions for {len(labels)} evaluation images")
+        
+        directory = self.set_dir(set_hash)
+        directory.mkdir(parents=True, exist_ok=True)
+        if not (directory / LABELS_FILE).exists():
+            np.save(directory / LABELS_FILE, np.asarray(labels, dtype=np.int64))
+        
+        # Written under a temporary name first, so an interrupted run never leaves a partial matrix
+        path = self.path(set_hash, key)
+        tmp_path = path.with_name(f"{path.stem}.tmp.npy")
+        np.save(tmp_path, probabilities)
+        tmp_path.replace(path)
+        with open(path.with_suffix('.json'), 'w') as f:
+            json.dump({**(metadata or {}), 'samples': len(labels), 'created': time.time()}, f, indent=2)
+        return path
+    
+    def get_or_predict(self, set_hash: str, key: str, labels: np.ndarray,
+                       predict_fn: Callable[[], np.ndarray], metadata: Optional[dict] = None) -> np.ndarray:
+        """Cached probabilities, running predict_fn (once) when there are none"""
+        cached = self.get(set_hash, key)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        probabilities = predict_fn()
+        metadata = {**(metadata or {}), 'predict_seconds': time.perf_counter() - start}
+        self.put(set_hash, key, labels, probabilities, metadata)
+        return self.get(set_hash, key)
+    
+    def entries(self, set_hash: str) -> Dict[str, dict]:
+        """Metadata of every cached prediction matrix for an evaluation set"""
+        entries = {}
+        for meta_path in sorted(self.set_dir(set_hash).glob("*.json")):
+            with open(meta_path, 'r') as f:
+                entries[meta_path.stem] = json.load(f)
+        return entries
+
+
+def prediction_key(version: str, variant: str) -> str:
+    return f"{version}_{variant}"
+
+
+def mcnemar_test(correct_a: np.ndarray, correct_b: np.ndarray) -> dict:
+    """
+    Exact McNemar test on paired per-image correctness
+    
+    Only discordant images count: b where only A is right, c where only B is
+    right. Under equal accuracy b ~ Binomial(b + c, 1/2).
+    
+    Returns:
+        Dict with b, c, the continuity-corrected chi-square statistic and
+        the exact two-sided p-value
+    """
+    correct_a = np.asarray(correct_a, dtype=bool)
+    correct_b = np.asarray(correct_b, dtype=bool)
+    b = int(np.count_nonzero(correct_a & ~correct_b))
+    c = int(np.count_nonzero(~correct_a & correct_b))
+    
+    discordant = b + c
+    statistic = (abs(b - c) - 1) ** 2 / discordant if discordant else 0.0
+    p_value = binomtest(b, discordant, 0.5).pvalue if discordant else 1.0
+    return {'b': b, 'c': c, 'statistic': float(statistic), 'p_value': float(p_value)}
+
+
+def agreement_matrix(predictions: Dict[str, np.ndarray]) -> np.ndarray:
+    """Fraction of images on which each pair of models predicts the same class"""
+    stacked = np.stack([np.asarray(p) for p in predictions.values()])
+    return (stacked[:, None, :] == stacked[None, :, :]).mean(axis=-1)
+
+
+def compare_predictions(probabilities: Dict[str, np.ndarray], labels: np.ndarray,
+                        num_classes: Optional[int] = None, baseline: Optional[str] = None) -> dict:
+    """
+    Compare models from their probabilities on the same evaluation set
+    
+    Args:
+        probabilities: Model name -> [N, K] class probabilities
+        labels: [N] integer labels
+        num_classes: Number of classes (defaults to K)
+        baseline: Model the deltas are taken against (defaults to the first)
+    
+    Returns:
+        Dict with per-model metrics (StreamingEvaluator.result), per-class
+        precision/recall/F1 deltas against the baseline, McNemar tests for
+        every pair of models and the agreement matrix
+    """
+    names = list(probabilities)
+    if not names:
+        raise ValueError("No models to compare")
+    baseline = baseline or names[0]
+    if baseline not in probabilities:
+        raise ValueError(f"Baseline {baseline!r} is not among the compared models: {names}")
+    
+    labels = np.asarray(labels, dtype=np.int64)
+    num_classes = num_classes or np.asarray(probabilities[baseline]).shape[1]
+    
+    metrics, predicted = {}, {}
+    for name in names:
+        evaluator = StreamingEvaluator.from_predictions(labels, probabilities[name], num_classes)
+        metrics[name] = evaluator.result()
+        predicted[name] = np.asarray(probabilities[name]).argmax(axis=1)
+    
+    deltas = {}
+    for name in names:
+        if name == baseline:
+            continue
+        deltas[name] = {
+            metric: (np.asarray(metrics[name][metric]) - np.asarray(metrics[baseline][metric])).tolist()
+            for metric in ('precision', 'recall', 'f1', 'auc')
+        }
+        for metric in ('accuracy', 'balanced_accuracy', 'loss', 'macro_auc'):
+            deltas[name][metric] = metrics[name][metric] - metrics[baseline][metric]
+    
+    tests = []
+    for i, first in enumerate(names):
+        for second in names[i + 1:]:
+            result = mcnemar_test(predicted[first] == labels, predicted[second] == labels)
+            tests.append({'first': first, 'second': second, **result})
+    
+    return {
+        'samples': int(len(labels)),
+        'baseline': baseline,
+        'models': names,
+        'metrics': metrics,
+        'deltas': deltas,
+        'mcnemar': tests,
+        'agreement': agreement_matrix(predicted).tolist(),
+    }
+
+
+def format_comparison(report: dict, class_names: Optional[Sequence[str]] = None,
+                      alpha: float = 0.05) -> str:
+    """Text summary of compare_predictions output"""
+    names = report['models']
+    baseline = report['baseline']
+    metrics = report['metrics']
+    num_classes = len(metrics[baseline]['recall'])
+    classes = list(class_names) if class_names is not None else [str(c) for c in range(num_classes)]
+    width = max(12, max(len(name) for name in names) + 1)
+    
+    lines = [f"{report['samples']} evaluation images, baseline: {baseline}\n",
+             f"{'Model':<{width}} {'Accuracy':>9} {'Balanced':>9} {'Macro AUC':>10} {'Loss':>8}"]
+    for name in names:
+        m = metrics[name]
+        lines.append(f"{name:<{width}} {m['accuracy']:>9.4f} {m['balanced_accuracy']:>9.4f} "
+                     f"{m['macro_auc']:>10.4f} {m['loss']:>8.4f}")
+    
+    for name, delta in report['deltas'].items():
+        lines.append(f"\n{name} vs {baseline}: accuracy {delta['accuracy']:+.4f}, "
+                     f"balanced accuracy {delta['balanced_accuracy']:+.4f}")
+        lines.append(f"  {'Class':<12} {'Support':>7} {'Recall':>16} {'Precision':>16} {'F1':>8}")
+        for c in range(num_classes):
+            recall = f"{metrics[baseline]['recall'][c]:.3f}->{metrics[name]['recall'][c]:.3f}"
+            precision = f"{metrics[baseline]['precision'][c]:.3f}->{metrics[name]['precision'][c]:.3f}"
+            lines.append(f"  {classes[c]:<12} {metrics[baseline]['support'][c]:>7} {recall:>16} "
+                         f"{precision:>16} {delta['f1'][c]:>+8.3f}")
+    
+    lines.append("\nMcNemar (b = only first correct, c = only second correct):")
+    for test in report['mcnemar']:
+        verdict = "significant" if test['p_value'] < alpha else "not significant"
+        lines.append(f"  {test['first']} vs {test['second']}: b={test['b']} c={test['c']} "
+                     f"p={test['p_value']:.4g} ({verdict} at {alpha:g})")
+    
+    lines.append("\nPrediction agreement:")
+    lines.append(" " * (width + 2) + " ".join(f"{name[:8]:>8}" for name in names))
+    for name, row in zip(names, report['agreement']):
+        lines.append(f"  {name:<{width}}" + " ".join(f"{value:>8.1%}" for value in row))
+    
+    return "\n".join(lines)
+
+
+def save_comparison(report: dict, path) -> None:
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,332 @@
+"""
+Training throughput profiling
+Times each stage of the training input path (file read, JPEG decode,
+preprocessing, augmentation, host-to-device transfer, train step) on its
+own, measures how long real training steps wait on the input pipeline, and
+times every model layer to find compute hotspots. No external profiler is
+needed; the result is a small JSON report plus a printed summary.
+"""
+
+import os
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from app.utils.image_processing import (
+    crop_to_lesion, decode_target, enhance_lesion_image, select_decode_flag, LESION_CROP,
+    MEDICAL_PREPROCESSING
+)
+
+# Stall share above which a run counts as input-bound
+INPUT_BOUND_STALL = 0.10
+
+CPU_STAGES = ('read', 'decode', 'preprocess', 'augment')
+
+
+def _sync(tensors):
+    """Wait for (possibly asynchronous) device work behind a tensor structure"""
+    flat = [t for t in tf.nest.flatten(tensors) if isinstance(t, tf.Tensor)]
+    if flat:
+        tf.reshape(flat[0], [-1])[:1].numpy()
+
+
+def time_image_stages(paths: Sequence[str], img_size: int, enhance: Optional[bool] = None,
+                      crop_lesion: Optional[bool] = None) -> Dict[str, float]:
+    """
+    Seconds per image for read, decode and preprocess, on one thread
+    
+    Runs load_image step by step: reading the file bytes, decoding them
+    (at reduced DCT scale where load_image would), then colour conversion,
+    lesion crop, resize and enhancement.
+    """
+    enhance = MEDICAL_PREPROCESSING if enhance is None else enhance
+    crop_lesion = LESION_CROP if crop_lesion is None else crop_lesion
+    target_size = (img_size, img_size)
+    totals = defaultdict(float)
+    count = 0
+    
+    for path in paths:
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+        read_done = time.perf_counter()
+        
+        flag = select_decode_flag(path, decode_target(target_size, crop_lesion))
+        img = cv2.imdecode(data, flag)
+        decode_done = time.perf_counter()
+        if img is None:
+            continue
+        
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if crop_lesion:
+            img = crop_to_lesion(img)
+        if img.shape[:2] != target_size:
+            img = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_AREA)
+        if enhance:
+            img = enhance_lesion_image(img)
+        done = time.perf_counter()
+        
+        totals['read'] += read_done - start
+        totals['decode'] += decode_done - read_done
+        totals['preprocess'] += done - decode_done
+        count += 1
+    
+    return {stage: seconds / max(count, 1) for stage, seconds in totals.items()}
+
+
+def time_shard_reads(shards, indices: Sequence[int]) -> Dict[str, float]:
+    """Seconds per image to copy preprocessed images out of memory-mapped shards"""
+    start = time.perf_counter()
+    for i in indices:
+        np.array(shards.image(int(i)))
+    return {'read': (time.perf_counter() - start) / max(len(indices), 1), 'decode': 0.0, 'preprocess': 0.0}
+
+
+def time_batch_fn(fn: Callable, *args, repeats: int = 5) -> float:
+    """Seconds per call of fn(*args), after one warm-up call"""
+    _sync(fn(*args))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        _sync(fn(*args))
+    return (time.perf_counter() - start) / repeats
+
+
+def time_transfer(batch: np.ndarray, repeats: int = 5) -> float:
+    """Seconds per batch to turn a host array into a tensor on the default device"""
+    def _transfer(x):
+        return tf.identity(tf.convert_to_tensor(x))
+    return time_batch_fn(_transfer, batch, repeats=repeats)
+
+
+def time_train_step(model, batch, labels, repeats: int = 5) -> float:
+    """Seconds per train step on a fixed batch (compute only, no input pipeline)"""
+    x, y = tf.convert_to_tensor(batch), tf.convert_to_tensor(labels)
+    return time_batch_fn(lambda: model.train_on_batch(x, y), repeats=repeats)
+
+
+def profile_training_steps(model, dataset: tf.data.Dataset, steps: int) -> dict:
+    """
+    Train for `steps` batches from the real pipeline, timing input waits
+    
+    Wait time is spent in next() on the dataset iterator: whatever the
+    pipeline could not prepare while the previous step was computing.
+    """
+    iterator = iter(dataset)
+    
+    # Warm-up step: graph tracing and pipeline start-up are not steady state
+    x, y = next(iterator)
+    model.train_on_batch(x, y)
+    
+    wait = compute = 0.0
+    images = done = 0
+    for _ in range(steps):
+        start = time.perf_counter()
+        try:
+            x, y = next(iterator)
+        except StopIteration:
+            break
+        fetched = time.perf_counter()
+        model.train_on_batch(x, y)
+        finished = time.perf_counter()
+        
+        wait += fetched - start
+        compute += finished - fetched
+        images += int(x.shape[0])
+        done += 1
+    
+    total = wait + compute
+    return {
+        'steps': done,
+        'images': images,
+        'images_per_sec': images / total if total > 0 else 0.0,
+        'wait_ms_per_step': 1000 * wait / max(done, 1),
+        'compute_ms_per_step': 1000 * compute / max(done, 1),
+        'stall_fraction': wait / total if total > 0 else 0.0,
+    }
+
+
+def _model_nodes(model, layers) -> Dict[str, tuple]:
+    """
+    (input tensors, output tensors) of every layer's call in this model
+    
+    A layer reused elsewhere, or a nested model, has more than one inbound
+    node; the one belonging to this model is the node whose inputs this
+    model has already produced.
+    """
+    known = {id(t) for t in tf.nest.flatten(model.inputs)}
+    graph = {}
+    for layer in layers:
+        # Public in Keras 2, private in Keras 3
+        nodes = getattr(layer, 'inbound_nodes', None) or layer._inbound_nodes
+        for node in nodes:
+            inputs = tf.nest.flatten(node.input_tensors)
+            if inputs and all(id(t) in known for t in inputs):
+                break
+        else:
+            raise ValueError(f"Layer {layer.name} has no call on this model's graph")
+        outputs = tf.nest.flatten(node.outputs)
+        known.update(id(t) for t in outputs)
+        graph[layer.name] = (inputs, outputs)
+    return graph
+
+
+def layer_hotspots(model, batch, repeats: int = 3, top: int = 10) -> dict:
+    """
+    Forward-pass time per layer, by running the functional graph one layer at a time
+    
+    Each layer is called on the values of the input tensors of its node in
+    this model (the outputs of earlier layers), so this works with Keras 2
+    and 3 and with nested models such as the Sequential head of
+    assemble_model, whose own Input is another node. A value is dropped once
+    its last consumer has run, keeping memory near one forward pass. Layers
+    run eagerly, so absolute times exceed a compiled step; the shares show
+    where compute goes.
+    
+    Returns:
+        Dict with the `top` slowest layers and totals per layer type, each
+        with milliseconds per batch and share of the forward pass
+    """
+    layers = [layer for layer in model.layers if not isinstance(layer, tf.keras.layers.InputLayer)]
+    graph = _model_nodes(model, layers)
+    consumers = defaultdict(int)
+    for layer in layers:
+        for tensor in graph[layer.name][0]:
+            consumers[id(tensor)] += 1
+    
+    times = defaultdict(float)
+    types = {layer.name: type(layer).__name__ for layer in layers}
+    
+    def forward(x):
+        values = {id(t): v for t, v in zip(tf.nest.flatten(model.inputs), tf.nest.flatten(x))}
+        remaining = dict(consumers)
+        for layer in layers:
+            input_tensors, output_tensors = graph[layer.name]
+            inputs = [values[id(t)] for t in input_tensors]
+            inputs = inputs[0] if len(inputs) == 1 else inputs
+            for tensor in input_tensors:
+                remaining[id(tensor)] -= 1
+                if remaining[id(tensor)] == 0:
+                    values.pop(id(tensor))
+            
+            start = time.perf_counter()
+            outputs = layer(inputs)
+            _sync(outputs)
+            times[layer.name] += time.perf_counter() - start
+            
+            for tensor, value in zip(output_tensors, tf.nest.flatten(outputs)):
+                values[id(tensor)] = value
+    
+    x = tf.convert_to_tensor(batch)
+    forward(x)
+    times.clear()
+    for _ in range(repeats):
+        forward(x)
+    
+    total = sum(times.values()) or 1.0
+    by_type = defaultdict(float)
+    for name, seconds in times.items():
+        by_type[types[name]] += seconds
+    
+    def _rows(items, key):
+        return [{key: name, 'ms': 1000 * seconds / repeats, 'share': seconds / total}
+                for name, seconds in sorted(items, key=lambda item: -item[1])]
+    
+    layers = _rows(times.items(), 'layer')[:top]
+    for row in layers:
+        row['type'] = types[row['layer']]
+    
+    return {
+        'forward_ms': 1000 * total / repeats,
+        'layers': layers,
+        'types': _rows(by_type.items(), 'type'),
+    }
+
+
+def build_report(stage_seconds: Dict[str, float], batch_size: int, steps: dict,
+                 hotspots: Optional[dict] = None, parallel_calls: Optional[int] = None) -> dict:
+    """
+    Combine stage timings into images/sec, stall share and a bottleneck verdict
+    
+    Args:
+        stage_seconds: Seconds per image for CPU_STAGES, seconds per batch for
+            'transfer' and 'step'
+        batch_size: Images per batch
+        steps: profile_training_steps result
+        hotspots: layer_hotspots result
+        parallel_calls: Cores available to the input pipeline (defaults to os.cpu_count())
+    """
+    parallel_calls = parallel_calls or os.cpu_count() or 1
+    per_image = {stage: stage_seconds.get(stage, 0.0) for stage in CPU_STAGES}
+    per_image['transfer'] = stage_seconds.get('transfer', 0.0) / batch_size
+    per_image['step'] = stage_seconds.get('step', 0.0) / batch_size
+    
+    stages = {
+        stage: {'ms_per_image': 1000 * seconds, 'images_per_sec': 1 / seconds if seconds > 0 else None}
+        for stage, seconds in per_image.items()
+    }
+    
+    # The input stages run in parallel map calls; the train step does not
+    input_seconds = sum(per_image[stage] for stage in CPU_STAGES)
+    input_capacity = parallel_calls / input_seconds if input_seconds > 0 else None
+    compute_capacity = 1 / per_image['step'] if per_image['step'] > 0 else None
+    
+    if steps['stall_fraction'] >= INPUT_BOUND_STALL:
+        slowest = max(CPU_STAGES, key=lambda stage: per_image[stage])
+        verdict = f"input-bound: {steps['stall_fraction']:.0%} of step time waiting; slowest stage is {slowest}"
+    else:
+        verdict = f"compute-bound: {steps['stall_fraction']:.0%} of step time waiting on input"
+    
+    return {
+        'batch_size': batch_size,
+        'parallel_calls': parallel_calls,
+        'stages': stages,
+        'input_capacity_images_per_sec': input_capacity,
+        'compute_capacity_images_per_sec': compute_capacity,
+        'training': steps,
+        'hotspots': hotspots,
+        'verdict': verdict,
+    }
+
+
+def format_report(report: dict) -> str:
+    """Compact text summary of build_report output"""
+    lines = [f"{'Stage':<12} {'ms/image':>9} {'images/s':>10}"]
+    for stage, row in report['stages'].items():
+        rate = f"{row['images_per_sec']:>10.1f}" if row['images_per_sec'] else f"{'-':>10}"
+        lines.append(f"{stage:<12} {row['ms_per_image']:>9.2f} {rate}")
+    
+    if report['input_capacity_images_per_sec']:
+        lines.append(f"\nInput capacity ({report['parallel_calls']} cores): "
+                     f"{report['input_capacity_images_per_sec']:.1f} images/s")
+    if report['compute_capacity_images_per_sec']:
+        lines.append(f"Compute capacity: {report['compute_capacity_images_per_sec']:.1f} images/s")
+    
+    training = report['training']
+    lines.append(f"Measured over {training['steps']} steps: {training['images_per_sec']:.1f} images/s, "
+                 f"input wait {training['wait_ms_per_step']:.1f} ms + compute "
+                 f"{training['compute_ms_per_step']:.1f} ms per step "
+                 f"(stall {training['stall_fraction']:.1%})")
+    
+    hotspots = report.get('hotspots')
+    if hotspots:
+        lines.append(f"\nForward pass {hotspots['forward_ms']:.1f} ms per batch; slowest layers:")
+        for row in hotspots['layers']:
+            lines.append(f"  {row['layer']:<28} {row['type']:<22} {row['ms']:>8.2f} ms {row['share']:>6.1%}")
+        lines.append("By layer type:")
+        for row in hotspots['types'][:5]:
+            lines.append(f"  {row['type']:<51} {row['ms']:>8.2f} ms {row['share']:>6.1%}")
+    
+    lines.append(f"\n{report['verdict']}")
+    return "\n".join(lines)
+
+
+def save_report(report: dict, path) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,171 @@
+"""
+Progressive-resizing training schedules
+Early epochs train on small images with large batches and weak augmentation,
+later ones on full-size images with the full policy. Images are resized on
+the fly from shards compiled at the largest phase size
+(build_shard_dataset(img_size=...)), and the backbone takes any input size,
+so one model and optimizer state carry through every phase.
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence
+
+import tensorflow as tf
+
+
+def parse_schedule(spec: str) -> List[dict]:
+    """
+    '160:64:3:0.5,224:32:4:1' -> list of phase dicts
+    
+    The augmentation strength may be left out and defaults to 1.0. Sizes must
+    not decrease: the last phase is the model's final input size.
+    """
+    phases = []
+    for part in spec.split(','):
+        values = part.strip().split(':')
+        if len(values) not in (3, 4):
+            raise ValueError(f"Phase {part!r} is not size:batch_size:epochs[:augmentation]")
+        phases.append({
+            'size': int(values[0]),
+            'batch_size': int(values[1]),
+            'epochs': int(values[2]),
+            'augmentation': float(values[3]) if len(values) == 4 else 1.0,
+        })
+    sizes = [phase['size'] for phase in phases]
+    if sizes != sorted(sizes):
+        raise ValueError(f"Phase sizes must not decrease: {sizes}")
+    return phases
+
+
+def format_schedule(phases: Sequence[dict]) -> str:
+    return " -> ".join(f"{p['size']}px x{p['epochs']} (batch {p['batch_size']}, augmentation {p['augmentation']:g})"
+                       for p in phases)
+
+
+def fixed_schedule(size: int, batch_size: int, epochs: int) -> List[dict]:
+    """The baseline: every epoch at the final size with the full policy"""
+    return [{'size': size, 'batch_size': batch_size, 'epochs': epochs, 'augmentation': 1.0}]
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """
+    Wall-clock seconds since `start` at the end of every epoch
+    
+    One timer is shared by all phases, so elapsed time runs on across the
+    separate fit() calls. Validation time is included, as it is in a real run.
+    """
+    
+    def __init__(self, start: Optional[float] = None):
+        super().__init__()
+        self.start = start if start is not None else time.perf_counter()
+        self.elapsed = []
+    
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self.start
+        self.elapsed.append(elapsed)
+        if logs is not None:
+            logs['elapsed_seconds'] = elapsed
+
+
+class _KeepStateAcrossPhases:
+    """Reset a callback's state on the first fit() of a schedule only"""
+    
+    _schedule_started = False
+    
+    def on_train_begin(self, logs=None):
+        if not self._schedule_started:
+            super().on_train_begin(logs)
+            self._schedule_started = True
+
+
+class ScheduleEarlyStopping(_KeepStateAcrossPhases, tf.keras.callbacks.EarlyStopping):
+    """
+    EarlyStopping over a whole schedule of fit() calls
+    
+    Keras resets wait, best and best_weights at every fit(), so a phase
+    shorter than the patience could never stop. Here they carry over from
+    phase to phase, and the best weights are restored once, by
+    restore_best() after the last phase, instead of at the end of each phase.
+    """
+    
+    def on_train_end(self, logs=None):
+        if self.stopped_epoch > 0 and self.verbose > 0:
+            print(f"Epoch {self.stopped_epoch + 1}: early stopping")
+    
+    def restore_best(self) -> bool:
+        """Set the model to the best weights seen in any phase; False if there are none"""
+        if not self.restore_best_weights or self.best_weights is None:
+            return False
+        self.model.set_weights(self.best_weights)
+        return True
+
+
+class ScheduleReduceLROnPlateau(_KeepStateAcrossPhases, tf.keras.callbacks.ReduceLROnPlateau):
+    """ReduceLROnPlateau whose wait, cooldown and best value carry over between fit() calls"""
+
+
+def time_to_target(history: Dict[str, list], target: float, metric: str = 'val_accuracy') -> Optional[dict]:
+    """
+    First epoch reaching target on metric
+    
+    Returns:
+        Dict with the epoch (1-based) and elapsed seconds, or None if the run
+        never reached the target
+    """
+    for epoch, value in enumerate(history[metric]):
+        if value >= target:
+            return {'epoch': epoch + 1, 'seconds': history['elapsed_seconds'][epoch]}
+    return None
+
+
+def build_resizing_report(runs: Dict[str, dict], target: Optional[float] = None,
+                          baseline: str = 'fixed') -> dict:
+    """
+    Time to a target accuracy per run, with the speed-up over the baseline
+    
+    Args:
+        runs: Run name -> {'schedule': phases, 'history': per-epoch history
+            with val_accuracy and elapsed_seconds}
+        target: Validation accuracy to reach; defaults to the lowest best
+            accuracy over the runs, so every run reaches it
+        baseline: Run the speed-up is taken against
+    
+    Returns:
+        Dict with the target and, per run, the time to target, total time
+        and best accuracy
+    """
+    if target is None:
+        target = min(max(run['history']['val_accuracy']) for run in runs.values())
+    
+    rows = {}
+    for name, run in runs.items():
+        history = run['history']
+        rows[name] = {
+            'schedule': run['schedule'],
+            'epochs': len(history['val_accuracy']),
+            'total_seconds': history['elapsed_seconds'][-1],
+            'best_val_accuracy': max(history['val_accuracy']),
+            'final_val_accuracy': history['val_accuracy'][-1],
+            'time_to_target': time_to_target(history, target),
+        }
+    
+    reached = rows.get(baseline, {}).get('time_to_target')
+    for row in rows.values():
+        if reached and row['time_to_target']:
+            row['speedup'] = reached['seconds'] / row['time_to_target']['seconds']
+    
+    return {'target': target, 'baseline': baseline, 'runs': rows}
+
+
+def format_resizing_report(report: dict) -> str:
+    lines = [f"Target validation accuracy: {report['target']:.4f}\n",
+             f"{'Run':<12} {'Epochs':>6} {'Total s':>9} {'Best acc':>9} {'To target':>16} {'Speedup':>8}"]
+    for name, row in report['runs'].items():
+        reached = row['time_to_target']
+        to_target = f"{reached['seconds']:.1f}s (ep {reached['epoch']})" if reached else "not reached"
+        speedup = f"{row['speedup']:>7.2f}x" if 'speedup' in row else f"{'-':>8}"
+        lines.append(f"{name:<12} {row['epochs']:>6} {row['total_seconds']:>9.1f} "
+                     f"{row['best_val_accuracy']:>9.4f} {to_target:>16} {speedup}")
+    for name, row in report['runs'].items():
+        lines.append(f"\n{name}: {format_schedule(row['schedule'])}")
+    return "\n".join(lines)
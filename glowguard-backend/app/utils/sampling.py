@@ -0,0 +1,131 @@
+"""
+Class-balanced sampling for imbalanced training sets
+Draws sample indices so rare classes get more gradient updates per epoch,
+without duplicating image data: only integer indices into the file list or
+shard index are resampled, and images are still decoded on the fly.
+"""
+
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import tensorflow as tf
+
+
+class ClassBalancedSampler:
+    """
+    Per-epoch index sampler with smoothed class frequencies
+    
+    Each draw picks class c with probability proportional to n_c ** alpha,
+    where n_c is the number of training images of that class:
+        alpha = 0    every class equally often (fully balanced)
+        alpha = 0.5  square-root smoothing
+        alpha = 1    the natural class distribution
+    
+    Within a class, images are taken from a fresh random permutation, so a
+    rare class cycles through all of its images before any repeats. The
+    indices for an epoch are a pure function of (seed, epoch), so resumed
+    runs replay them exactly.
+    
+    Usage:
+        sampler = ClassBalancedSampler(y_train, alpha=0.0)
+        dataset = build_shard_dataset(shards, idx_train, training=True, sampler=sampler)
+    """
+    
+    def __init__(self, labels: Sequence[int], num_classes: Optional[int] = None, alpha: float = 0.0,
+                 epoch_size: Optional[int] = None, seed: int = 42):
+        """
+        Args:
+            labels: Integer class label of every sample
+            num_classes: Number of classes (defaults to max label + 1)
+            alpha: Smoothing exponent between 0 (balanced) and 1 (natural)
+            epoch_size: Samples drawn per epoch (defaults to len(labels))
+            seed: Sampling seed
+        """
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.num_classes = int(num_classes or self.labels.max() + 1)
+        self.alpha = float(alpha)
+        self.epoch_size = int(epoch_size or len(self.labels))
+        self.seed = seed
+        
+        self.class_counts = np.bincount(self.labels, minlength=self.num_classes)
+        self.class_indices = [np.flatnonzero(self.labels == c) for c in range(self.num_classes)]
+        
+        # Classes without samples are never drawn
+        present = self.class_counts > 0
+        weights = np.zeros(self.num_classes)
+        weights[present] = self.class_counts[present].astype(np.float64) ** self.alpha
+        self.probabilities = weights / weights.sum()
+        
+        # epoch -> {'draws': per-class samples drawn, 'unique': distinct images per class}
+        self.epoch_counts: Dict[int, Dict[str, np.ndarray]] = {}
+        # Epoch most recently drawn by dataset() iteration
+        self.current_epoch = -1
+    
+    def epoch_indices(self, epoch: int) -> np.ndarray:
+        """Shuffled sample indices for an epoch"""
+        rng = np.random.default_rng([self.seed, epoch])
+        draws = rng.multinomial(self.epoch_size, self.probabilities)
+        
+        indices = []
+        unique = np.zeros(self.num_classes, dtype=np.int64)
+        for c, k in enumerate(draws):
+            if k == 0:
+                continue
+            members = self.class_indices[c]
+            # Enough back-to-back permutations of the class to cover k draws
+            repeats = -(-k // len(members))
+            indices.append(np.concatenate([rng.permutation(members) for _ in range(repeats)])[:k])
+            unique[c] = min(k, len(members))
+        
+        order = rng.permutation(np.concatenate(indices))
+        self.epoch_counts[epoch] = {'draws': draws, 'unique': unique}
+        return order
+    
+    def dataset(self) -> tf.data.Dataset:
+        """
+        Endless-per-iteration dataset of (index, label) pairs
+        
+        Every new iteration (one per Keras epoch) draws the next epoch's
+        indices, so fit() sees a different balanced sample each epoch.
+        """
+        def _generate():
+            self.current_epoch += 1
+            indices = self.epoch_indices(self.current_epoch)
+            yield indices, self.labels[indices].astype(np.int32)
+        
+        dataset = tf.data.Dataset.from_generator(
+            _generate,
+            output_signature=(tf.TensorSpec([None], tf.int64), tf.TensorSpec([None], tf.int32))
+        )
+        return dataset.unbatch().apply(tf.data.experimental.assert_cardinality(self.epoch_size))
+    
+    def report(self, epoch: int, class_names: Optional[Dict[int, str]] = None) -> str:
+        """Per-class draws against the natural class counts for one epoch"""
+        counts = self.epoch_counts[epoch]
+        lines = [f"{'Class':<10} {'Images':>7} {'Drawn':>7} {'Unique':>7} {'Share':>7}"]
+        for c in range(self.num_classes):
+            name = class_names.get(c, str(c)) if class_names else str(c)
+            share = counts['draws'][c] / max(self.epoch_size, 1)
+            lines.append(f"{name:<10} {self.class_counts[c]:>7} {counts['draws'][c]:>7} "
+                         f"{counts['unique'][c]:>7} {share:>7.1%}")
+        return "\n".join(lines)
+
+
+class SamplerReportCallback(tf.keras.callbacks.Callback):
+    """Print the sampler's effective per-class sample counts after each epoch"""
+    
+    def __init__(self, sampler: ClassBalancedSampler, class_names: Optional[Dict[int, str]] = None):
+        super().__init__()
+        self.sampler = sampler
+        self.class_names = class_names
+        self.history = []
+    
+    def on_epoch_end(self, epoch, logs=None):
+        # Each Keras epoch iterates the dataset once, drawing the sampler's next epoch
+        sampled = self.sampler.current_epoch
+        if sampled not in self.sampler.epoch_counts:
+            return
+        counts = self.sampler.epoch_counts[sampled]
+        self.history.append({key: value.tolist() for key, value in counts.items()})
+        print(f"\nSampled class counts (epoch {epoch + 1}):")
+        print(self.sampler.report(sampled, self.class_names))
@@ -0,0 +1,230 @@
+"""
+Compiled dataset shards
+Preprocessed uint8 images stored as fixed-size .npy shards plus an index, so
+training, evaluation and calibration can memory-map them instead of
+re-decoding JPEGs on every run
+"""
+
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.utils.data_loader import DATA_DIR, DatasetCatalog
+from app.utils.image_processing import enhancement_key
+
+# Bump when load_image output changes so stale shards are not reused (changes
+# to the enhancement parameters are keyed by ENHANCEMENT_VERSION instead)
+SHARD_FORMAT_VERSION = 1
+SHARDS_DIR = DATA_DIR / "compiled"
+DEFAULT_SHARD_SIZE = 1024
+
+INDEX_FILE = "index.csv"
+CONFIG_FILE = "config.json"
+
+
+def preprocessing_config(img_size: int, enhance: bool, crop_lesion: bool) -> dict:
+    """Everything that changes the stored pixels"""
+    return {
+        'format_version': SHARD_FORMAT_VERSION,
+        'img_size': int(img_size),
+        'enhance': enhancement_key(enhance),
+        'crop_lesion': bool(crop_lesion),
+    }
+
+
+def preprocessing_key(config: dict) -> str:
+    """Stable directory name for a preprocessing config"""
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    return f"{config['img_size']}px_{digest}"
+
+
+def catalog_hash(catalog: DatasetCatalog) -> str:
+    """Fingerprint of the image list and labels a compiled dataset was built from"""
+    frame = catalog.frame
+    payload = "\n".join(f"{i},{dx}" for i, dx in zip(frame.index, frame['dx']))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _shard_path(directory: Path, shard: int) -> Path:
+    return directory / f"shard_{shard:05d}.npy"
+
+
+def _init_worker():
+    # One OpenCV thread per process; the pool provides the parallelism
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def _compile_shard(paths: Sequence[str], out_path: str, img_size: int,
+                   enhance: bool, crop_lesion: bool) -> list:
+    """Preprocess one shard in a worker process; returns a per-image success mask"""
+    from app.utils.image_processing import load_image
+    
+    images = np.zeros((len(paths), img_size, img_size, 3), dtype=np.uint8)
+    ok = []
+    for i, path in enumerate(paths):
+        try:
+            images[i] = load_image(path, (img_size, img_size), enhance=enhance, crop_lesion=crop_lesion)
+            ok.append(True)
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            ok.append(False)
+    
+    # Write under a temporary name so an interrupted run never leaves a truncated shard
+    tmp_path = out_path + ".tmp.npy"
+    np.save(tmp_path, images)
+    os.replace(tmp_path, out_path)
+    return ok
+
+
+def compile_shards(catalog: DatasetCatalog, img_size: int = 224, enhance: bool = False,
+                   crop_lesion: bool = False, shard_size: int = DEFAULT_SHARD_SIZE,
+                   workers: Optional[int] = None, output_root: Path = SHARDS_DIR) -> Path:
+    """
+    Preprocess every catalog image into fixed-size uint8 shards with a process pool
+    
+    Shards that already exist are kept, so an interrupted compile resumes where
+    it stopped. Each preprocessing config gets its own directory, so variants
+    coexist.
+    
+    Args:
+        catalog: Images to compile
+        img_size: Square output size
+        enhance: Apply CLAHE + bilateral filtering
+        crop_lesion: Crop to the lesion ROI
+        shard_size: Images per shard
+        workers: Worker processes (defaults to all cores)
+        output_root: Parent directory for compiled datasets
+    
+    Returns:
+        Directory holding the shards, index.csv and config.json
+    """
+    config = preprocessing_config(img_size, enhance, crop_lesion)
+    directory = Path(output_root) / preprocessing_key(config)
+    directory.mkdir(parents=True, exist_ok=True)
+    
+    frame = catalog.frame.reset_index()
+    paths = frame['path'].tolist()
+    shard_count = (len(paths) + shard_size - 1) // shard_size
+    source_hash = catalog_hash(catalog)
+    
+    # Shard positions depend on the image list, so a changed catalog starts over
+    config_path = directory / CONFIG_FILE
+    if config_path.exists():
+        with open(config_path, 'r') as f:
+            previous = json.load(f)
+        if previous.get('catalog_hash') != source_hash or previous.get('shard_size') != shard_size:
+            print("Catalog changed since last compile, rebuilding all shards")
+            for stale in directory.glob("*.npy"):
+                stale.unlink()
+    with open(config_path, 'w') as f:
+        json.dump({**config, 'shard_size': shard_size, 'catalog_hash': source_hash}, f, indent=2)
+    
+    valid = np.ones(len(paths), dtype=bool)
+    mask_path = directory / "valid.npy"
+    if mask_path.exists():
+        previous = np.load(mask_path)
+        if len(previous) == len(valid):
+            valid = previous
+    
+    pending = [shard for shard in range(shard_count) if not _shard_path(directory, shard).exists()]
+    print(f"Compiling {len(paths)} images into {shard_count} shards "
+          f"({shard_count - len(pending)} already done) -> {directory}")
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(
+                _compile_shard, paths[shard * shard_size:(shard + 1) * shard_size],
+                str(_shard_path(directory, shard)), img_size, enhance, crop_lesion
+            ): shard
+            for shard in pending
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            shard = futures[future]
+            valid[shard * shard_size:shard * shard_size + shard_size] = future.result()
+            np.save(mask_path, valid)
+            print(f"  shard {shard:5d} done ({done}/{len(pending)})")
+    
+    # Index: one row per usable image with its shard position
+    positions = np.arange(len(paths))
+    frame['shard'] = positions // shard_size
+    frame['offset'] = positions % shard_size
+    frame['label'] = frame['dx'].cat.codes
+    frame = frame[valid].drop(columns=['path'])
+    frame.to_csv(directory / INDEX_FILE, index=False)
+    
+    with open(config_path, 'w') as f:
+        json.dump({**config, 'shard_size': shard_size, 'catalog_hash': source_hash,
+                   'classes': catalog.classes, 'images': int(len(frame))}, f, indent=2)
+    
+    print(f"✓ {len(frame)} images compiled ({int((~valid).sum())} failed)")
+    return directory
+
+
+class ShardedDataset:
+    """
+    Read-only, memory-mapped view of a compiled dataset
+    
+    Opening is near-instant: shards are mapped, not read, and pages are only
+    loaded from disk when an image is accessed.
+    """
+    
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / CONFIG_FILE, 'r') as f:
+            self.config = json.load(f)
+        self.index = pd.read_csv(self.directory / INDEX_FILE)
+        self.classes = self.config['classes']
+        self.img_size = self.config['img_size']
+        
+        shard_count = int(self.index['shard'].max()) + 1 if len(self.index) else 0
+        self.shards = [np.load(_shard_path(self.directory, shard), mmap_mode='r')
+                       for shard in range(shard_count)]
+        self._shard = self.index['shard'].to_numpy()
+        self._offset = self.index['offset'].to_numpy()
+    
+    @classmethod
+    def open(cls, img_size: int = 224, enhance: bool = False, crop_lesion: bool = False,
+             output_root: Path = SHARDS_DIR) -> 'ShardedDataset':
+        """Open the compiled dataset for a preprocessing config"""
+        config = preprocessing_config(img_size, enhance, crop_lesion)
+        directory = Path(output_root) / preprocessing_key(config)
+        if not (directory / INDEX_FILE).exists():
+            raise FileNotFoundError(
+                f"No compiled dataset at {directory}. Run compile_dataset.py --size {img_size}"
+                + (" --enhance" if enhance else "") + (" --crop" if crop_lesion else "")
+            )
+        return cls(directory)
+    
+    def __len__(self):
+        return len(self.index)
+    
+    @property
+    def labels(self) -> np.ndarray:
+        return self.index['label'].to_numpy()
+    
+    @property
+    def groups(self) -> np.ndarray:
+        """lesion_id per image, for grouped splits"""
+        return self.index['lesion_id'].astype(str).to_numpy()
+    
+    def image(self, i: int) -> np.ndarray:
+        """uint8 image i (a view into the mapped shard)"""
+        return self.shards[self._shard[i]][self._offset[i]]
+    
+    def images(self, indices: Sequence[int]) -> np.ndarray:
+        """Gather uint8 images into a new [N, H, W, 3] array"""
+        out = np.empty((len(indices), self.img_size, self.img_size, 3), dtype=np.uint8)
+        for j, i in enumerate(indices):
+            out[j] = self.image(i)
+        return out
+    
+    def subset_indices(self, source: str) -> np.ndarray:
+        """Row indices of images from one dataset ('HAM10000' or 'ISIC2018')"""
+        return np.flatnonzero(self.index['source'].to_numpy() == source)
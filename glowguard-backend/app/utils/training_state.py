@@ -0,0 +1,172 @@
+"""
+Resumable training state
+Full checkpoints (model and optimizer variables, learning-rate and
+early-stopping state, seeds and data position) written from a background
+thread, so an interrupted run resumes at the exact step it stopped.
+"""
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+LATEST_FILE = "latest.json"
+
+
+class TrainingState:
+    """
+    Everything besides variables needed to continue a run
+    
+    Early stopping and learning-rate reduction are tracked here instead of in
+    Keras callbacks, whose internal counters reset on every fit call and are
+    not saved with the model.
+    """
+    
+    def __init__(self, seed: int = 42, learning_rate: float = 1e-3):
+        self.seed = seed
+        self.epoch = 0
+        self.step = 0  # Batches finished in the current epoch
+        self.global_step = 0
+        self.learning_rate = learning_rate
+        
+        # Running sums for the current epoch's training metrics
+        self.loss_sum = 0.0
+        self.accuracy_sum = 0.0
+        
+        # EarlyStopping(monitor='val_loss') and ReduceLROnPlateau(monitor='val_loss')
+        self.best_val_loss = float('inf')
+        self.best_epoch = -1
+        self.stop_wait = 0
+        self.lr_wait = 0
+        
+        # ModelCheckpoint(monitor='val_accuracy')
+        self.best_val_accuracy = -float('inf')
+        
+        self.stopped = False
+        self.history = {'loss': [], 'accuracy': [], 'val_loss': [], 'val_accuracy': [], 'learning_rate': []}
+    
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TrainingState':
+        state = cls()
+        state.__dict__.update(data)
+        return state
+
+
+class CheckpointManager:
+    """
+    Saves and restores training state under one directory
+    
+    save() copies the variables to host memory on the calling thread (fast)
+    and writes them from a single background thread, so the training loop
+    only waits if the previous checkpoint is still being written.
+    """
+    
+    def __init__(self, directory, keep: int = 2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _variables(model) -> List:
+        # model.variables includes dropout seed-generator state, so replays are exact
+        variables = list(model.variables)
+        if model.optimizer is not None:
+            # A property of Keras 3 and Keras 2 (2.11+) optimizers, a method of legacy ones
+            optimizer_variables = model.optimizer.variables
+            variables += list(optimizer_variables() if callable(optimizer_variables) else optimizer_variables)
+        return variables
+    
+    def save(self, model, state: TrainingState, tag: Optional[str] = None):
+        """Snapshot now, write in the background"""
+        values = [np.array(v.numpy()) for v in self._variables(model)]
+        state_data = json.loads(json.dumps(state.to_dict()))
+        name = tag or f"ckpt-{state.global_step:08d}"
+        
+        with self._lock:
+            if self._pending is not None:
+                self._pending.result()
+            self._pending = self._executor.submit(self._write, name, values, state_data, tag is None)
+    
+    def _write(self, name: str, values: list, state_data: dict, update_latest: bool):
+        # Write under temporary names, then rename, so a crash never leaves a partial checkpoint
+        tmp_path = self.directory / f"{name}.tmp.npz"
+        np.savez(tmp_path, *values)
+        os.replace(tmp_path, self.directory / f"{name}.npz")
+        
+        tmp_path = self.directory / f"{name}.tmp.json"
+        with open(tmp_path, 'w') as f:
+            json.dump(state_data, f)
+        os.replace(tmp_path, self.directory / f"{name}.json")
+        
+        if update_latest:
+            tmp_path = self.directory / f"{LATEST_FILE}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'checkpoint': name}, f)
+            os.replace(tmp_path, self.directory / LATEST_FILE)
+            self._prune()
+    
+    def _prune(self):
+        checkpoints = sorted(self.directory.glob("ckpt-*.npz"))
+        for stale in checkpoints[:-self.keep]:
+            stale.unlink()
+            stale.with_suffix('.json').unlink(missing_ok=True)
+    
+    def wait(self):
+        """Block until the last checkpoint is on disk"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.result()
+                self._pending = None
+    
+    def latest(self) -> Optional[str]:
+        path = self.directory / LATEST_FILE
+        if not path.exists():
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)['checkpoint']
+    
+    def restore(self, model, name: Optional[str] = None) -> Optional[TrainingState]:
+        """
+        Load variables into a compiled model and return the saved state
+        
+        Returns:
+            TrainingState, or None if there is no checkpoint
+        """
+        name = name or self.latest()
+        if name is None or not (self.directory / f"{name}.npz").exists():
+            return None
+        
+        # Optimizer slots are created lazily; build them so they can be assigned
+        # (building again is a no-op; Keras 2 optimizers have no public `built`)
+        if model.optimizer is not None and not getattr(model.optimizer, 'built', False):
+            model.optimizer.build(model.trainable_variables)
+        
+        variables = self._variables(model)
+        with np.load(self.directory / f"{name}.npz") as data:
+            if len(data.files) != len(variables):
+                raise ValueError(
+                    f"Checkpoint {name} has {len(data.files)} variables, model has {len(variables)}"
+                )
+            for i, variable in enumerate(variables):
+                variable.assign(data[f"arr_{i}"])
+        
+        with open(self.directory / f"{name}.json", 'r') as f:
+            state = TrainingState.from_dict(json.load(f))
+        # Keras 2 optimizers keep the learning rate outside their variables
+        if model.optimizer is not None:
+            model.optimizer.learning_rate.assign(state.learning_rate)
+        return state
+    
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
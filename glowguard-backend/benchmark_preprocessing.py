@@ -0,0 +1,431 @@
+"""
+Benchmarks for the image preprocessing path used at serving time
+
+Usage:
+    python benchmark_preprocessing.py [--output results.json] decode [--repeats 5]
+        [--model ml_models/resnet_model.h5] [--limit 500]
+    python benchmark_preprocessing.py batch [--images 64] [--repeats 5]
+    python benchmark_preprocessing.py enhance [--images 32] [--size 320]
+    python benchmark_preprocessing.py roi [--sizes 128,160,224,320]
+        [--model-template ml_models/model_{size}_{crop}.h5] [--limit 1000]
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.image_processing import (
+    load_image, select_decode_flag, process_image, process_images_batch, ImageBufferPool,
+    enhance_lesion_image, find_lesion_roi
+)
+from app.utils.data_loader import (
+    ISIC2018_TEST_IMAGES, ISIC2018_GROUND_TRUTH, HAM10000_METADATA, get_ham10000_image_paths
+)
+
+# Minimum PSNR (dB) between the fast and reference enhancement to count as equivalent
+EQUIVALENCE_MIN_PSNR = 28.0
+# Per-image budget for the enhancement engine at the model input size
+ENHANCE_TARGET_MS = 10.0
+
+# Typical phone camera resolutions (width, height)
+SAMPLE_RESOLUTIONS = {
+    '12MP': (4000, 3000),
+    '48MP': (8000, 6000),
+}
+
+
+def make_sample_jpeg(path, size, seed=0):
+    """Write a synthetic skin-toned photo with texture so JPEG has real work to do"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype('float32')
+    base = np.empty((height, width, 3), dtype='float32')
+    base[..., 0] = 150 + 30 * np.sin(xx / 97.0)   # B
+    base[..., 1] = 170 + 25 * np.cos(yy / 83.0)   # G
+    base[..., 2] = 210 + 20 * np.sin((xx + yy) / 151.0)  # R
+    
+    # Dark lesion in the centre
+    dist = np.sqrt((xx - width / 2) ** 2 + (yy - height / 2) ** 2)
+    base[dist < min(size) / 6] *= 0.45
+    
+    base += rng.normal(0, 8, size=base.shape).astype('float32')
+    cv2.imwrite(str(path), np.clip(base, 0, 255).astype('uint8'), [cv2.IMWRITE_JPEG_QUALITY, 92])
+
+
+def measure(fn, repeats):
+    """Return (median seconds, peak traced bytes) for fn()"""
+    timings = []
+    peak = 0
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return float(np.median(timings)), peak
+
+
+def compare_isic2018(model_path, target_size, limit=None):
+    """Report ISIC2018 accuracy with full and reduced decode"""
+    import tensorflow as tf
+    import pandas as pd
+    
+    if not ISIC2018_TEST_IMAGES.exists() or not ISIC2018_GROUND_TRUTH.exists():
+        print("ISIC2018 dataset not found, skipping accuracy comparison")
+        return None
+    if not os.path.exists(model_path):
+        print(f"Model not found at {model_path}, skipping accuracy comparison")
+        return None
+    
+    labels_path = os.path.join(os.path.dirname(model_path), 'class_labels.json')
+    with open(labels_path, 'r') as f:
+        class_labels = {int(k): v for k, v in json.load(f).items()}
+    label_to_idx = {v: k for k, v in class_labels.items()}
+    
+    ground_truth = pd.read_csv(ISIC2018_GROUND_TRUTH)
+    if limit:
+        ground_truth = ground_truth.head(limit)
+    
+    model = tf.keras.models.load_model(model_path)
+    y_true, pred_full, pred_reduced = [], [], []
+    for image_id, dx in zip(ground_truth['image_id'], ground_truth['dx']):
+        img_path = ISIC2018_TEST_IMAGES / f"{image_id}.jpg"
+        if not img_path.exists() or dx not in label_to_idx:
+            continue
+        full = load_image(str(img_path), target_size, reduced_decode=False)
+        reduced = load_image(str(img_path), target_size, reduced_decode=True)
+        batch = np.stack([full, reduced]).astype('float32') / 255.0
+        probs = model.predict(batch, verbose=0)
+        y_true.append(label_to_idx[dx])
+        pred_full.append(int(np.argmax(probs[0])))
+        pred_reduced.append(int(np.argmax(probs[1])))
+    
+    if not y_true:
+        print("No labelled ISIC2018 images found")
+        return None
+    
+    y_true = np.array(y_true)
+    pred_full = np.array(pred_full)
+    pred_reduced = np.array(pred_reduced)
+    return {
+        'images': int(len(y_true)),
+        'accuracy_full_decode': float(np.mean(pred_full == y_true)),
+        'accuracy_reduced_decode': float(np.mean(pred_reduced == y_true)),
+        'prediction_agreement': float(np.mean(pred_full == pred_reduced)),
+    }
+
+
+def run_decode_benchmark(args):
+    """Full decode + resize versus reduced DCT decode + resize"""
+    target_size = (args.size, args.size)
+    results = {}
+    
+    print("\n" + "="*60)
+    print("Decode Benchmark")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, resolution in SAMPLE_RESOLUTIONS.items():
+            path = str(Path(tmp_dir) / f"sample_{name}.jpg")
+            make_sample_jpeg(path, resolution)
+            
+            full_time, full_peak = measure(
+                lambda: load_image(path, target_size, reduced_decode=False), args.repeats
+            )
+            reduced_time, reduced_peak = measure(
+                lambda: load_image(path, target_size, reduced_decode=True), args.repeats
+            )
+            
+            results[name] = {
+                'decode_flag': int(select_decode_flag(path, target_size)),
+                'full_ms': full_time * 1000,
+                'reduced_ms': reduced_time * 1000,
+                'speedup': full_time / reduced_time,
+                'full_peak_mb': full_peak / 2**20,
+                'reduced_peak_mb': reduced_peak / 2**20,
+            }
+            r = results[name]
+            print(f"{name:6} full: {r['full_ms']:8.1f} ms {r['full_peak_mb']:7.1f} MB | "
+                  f"reduced: {r['reduced_ms']:7.1f} ms {r['reduced_peak_mb']:6.1f} MB | "
+                  f"{r['speedup']:.1f}x faster")
+    
+    if args.model:
+        accuracy = compare_isic2018(args.model, target_size, args.limit)
+        if accuracy:
+            results['isic2018'] = accuracy
+            print(f"\nISIC2018 ({accuracy['images']} images)")
+            print(f"  Accuracy (full decode):    {accuracy['accuracy_full_decode']:.4f}")
+            print(f"  Accuracy (reduced decode): {accuracy['accuracy_reduced_decode']:.4f}")
+            print(f"  Prediction agreement:      {accuracy['prediction_agreement']:.4f}")
+    
+    return results
+
+
+def run_batch_benchmark(args):
+    """Per-image process_image loop versus pooled process_images_batch"""
+    target_size = (args.size, args.size)
+    results = {}
+    
+    print("\n" + "="*60)
+    print("Batch Preprocessing Benchmark")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(args.images):
+            path = str(Path(tmp_dir) / f"sample_{i}.jpg")
+            make_sample_jpeg(path, (1600, 1200), seed=i)
+            paths.append(path)
+        
+        pool = ImageBufferPool()
+        
+        def pooled():
+            with process_images_batch(paths, target_size, pool=pool) as batch:
+                assert not batch.errors
+        
+        # Warm up the pool and worker threads before measuring steady state
+        pooled()
+        
+        loop_time, loop_peak = measure(
+            lambda: np.stack([process_image(p, target_size) for p in paths]), args.repeats
+        )
+        pooled_time, pooled_peak = measure(pooled, args.repeats)
+        
+        results = {
+            'images': args.images,
+            'loop_images_per_sec': args.images / loop_time,
+            'pooled_images_per_sec': args.images / pooled_time,
+            'loop_peak_mb': loop_peak / 2**20,
+            'pooled_peak_mb': pooled_peak / 2**20,
+        }
+    
+    print(f"process_image loop:   {results['loop_images_per_sec']:8.1f} img/s "
+          f"{results['loop_peak_mb']:7.1f} MB traced")
+    print(f"process_images_batch: {results['pooled_images_per_sec']:8.1f} img/s "
+          f"{results['pooled_peak_mb']:7.1f} MB traced")
+    return results
+
+
+def reference_enhancement(image_path, target_size):
+    """Original MedicalImagePreprocessor order: CLAHE + d=9 bilateral at full size, then resize"""
+    img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+    lab_img = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    lab_img[:, :, 0] = clahe.apply(lab_img[:, :, 0])
+    img = cv2.cvtColor(lab_img, cv2.COLOR_LAB2RGB)
+    img = cv2.bilateralFilter(img, 9, 75, 75)
+    return cv2.resize(img, (target_size[1], target_size[0]))
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype('float32') - b.astype('float32')) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def run_enhance_benchmark(args):
+    """Fast CLAHE + bilateral engine: latency, batch throughput and equivalence"""
+    target_size = (args.size, args.size)
+    
+    print("\n" + "="*60)
+    print("CLAHE + Bilateral Benchmark")
+    print("="*60)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Prefer real dermoscopy images, fall back to synthetic 600x450 samples
+        paths = [str(p) for p in get_ham10000_image_paths()[:args.images]]
+        if not paths:
+            for i in range(args.images):
+                path = str(Path(tmp_dir) / f"sample_{i}.jpg")
+                make_sample_jpeg(path, (600, 450), seed=i)
+                paths.append(path)
+        
+        resized = [load_image(p, target_size, enhance=False) for p in paths]
+        
+        # Per-image engine latency at the model input size
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for img in resized:
+                enhance_lesion_image(img)
+        engine_ms = (time.perf_counter() - start) * 1000 / (args.repeats * len(resized))
+        
+        start = time.perf_counter()
+        for p in paths:
+            reference_enhancement(p, target_size)
+        reference_ms = (time.perf_counter() - start) * 1000 / len(paths)
+        
+        # Batched, multi-threaded decode + enhance
+        with process_images_batch(paths, target_size, enhance=True):
+            pass
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            with process_images_batch(paths, target_size, enhance=True) as batch:
+                fast_outputs = batch.pixels.copy()
+        batch_ips = args.repeats * len(paths) / (time.perf_counter() - start)
+        
+        references = [reference_enhancement(p, target_size) for p in paths]
+        scores = [psnr(fast, ref) for fast, ref in zip(fast_outputs, references)]
+        # What serving used to feed the model: no enhancement at all
+        baseline = [psnr(img, ref) for img, ref in zip(resized, references)]
+    
+    results = {
+        'images': len(paths),
+        'engine_ms_per_image': engine_ms,
+        'meets_target': bool(engine_ms < ENHANCE_TARGET_MS),
+        'reference_ms_per_image': reference_ms,
+        'batch_images_per_sec': batch_ips,
+        'psnr_mean_db': float(np.mean(scores)),
+        'psnr_min_db': float(np.min(scores)),
+        'psnr_unenhanced_db': float(np.mean(baseline)),
+        'equivalent': bool(np.min(scores) >= EQUIVALENCE_MIN_PSNR),
+    }
+    
+    print(f"Engine at {args.size}x{args.size}:   {engine_ms:7.2f} ms/image "
+          f"({'PASS' if results['meets_target'] else 'FAIL'}, target {ENHANCE_TARGET_MS:g} ms)")
+    print(f"Reference (full size): {reference_ms:7.2f} ms/image")
+    print(f"Batched decode+enhance: {batch_ips:6.1f} img/s")
+    print(f"PSNR vs reference: mean {results['psnr_mean_db']:.1f} dB, "
+          f"min {results['psnr_min_db']:.1f} dB "
+          f"({'PASS' if results['equivalent'] else 'FAIL'}, threshold {EQUIVALENCE_MIN_PSNR} dB)")
+    print(f"PSNR of unenhanced input vs reference: {results['psnr_unenhanced_db']:.1f} dB")
+    return results
+
+
+def evaluate_accuracy(model_path, paths, labels, target_size, crop_lesion, batch_size=32):
+    """Top-1 accuracy of a saved model on labelled images"""
+    import tensorflow as tf
+    
+    model = tf.keras.models.load_model(model_path)
+    labels_path = os.path.join(os.path.dirname(model_path), 'class_labels.json')
+    with open(labels_path, 'r') as f:
+        label_to_idx = {v: int(k) for k, v in json.load(f).items()}
+    
+    correct = 0
+    total = 0
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        with process_images_batch(chunk, target_size, crop_lesion=crop_lesion) as batch:
+            predicted = np.argmax(model.predict(batch.inputs, verbose=0), axis=1)
+            for i, pred in enumerate(predicted):
+                label = labels[start + i]
+                if i in batch.errors or label not in label_to_idx:
+                    continue
+                correct += int(pred == label_to_idx[label])
+                total += 1
+    
+    return correct / total if total else None
+
+
+def run_roi_benchmark(args):
+    """Whole-photo versus lesion-cropped inputs at each model input size"""
+    import pandas as pd
+    
+    print("\n" + "="*60)
+    print("Lesion ROI Cropping Benchmark")
+    print("="*60)
+    
+    sizes = [int(s) for s in args.sizes.split(',')]
+    results = {}
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths, labels = [], []
+        if HAM10000_METADATA.exists():
+            dx_by_id = pd.read_csv(HAM10000_METADATA).set_index('image_id')['dx']
+            for path in get_ham10000_image_paths()[:args.limit]:
+                paths.append(str(path))
+                labels.append(dx_by_id.get(path.stem))
+        if not paths:
+            print("HAM10000 images not found, using synthetic samples (latency only)")
+            for i in range(32):
+                path = str(Path(tmp_dir) / f"sample_{i}.jpg")
+                make_sample_jpeg(path, (600, 450), seed=i)
+                paths.append(path)
+                labels.append(None)
+        
+        found = [find_lesion_roi(load_image(p, (1024, 1024), crop_lesion=False, enhance=False))
+                 for p in paths[:200]]
+        found_rate = float(np.mean([roi is not None for roi in found]))
+        print(f"ROI found on {found_rate:.1%} of {len(found)} images\n")
+        
+        for size in sizes:
+            target_size = (size, size)
+            row = {}
+            for crop in (False, True):
+                start = time.perf_counter()
+                for p in paths[:args.timing_images]:
+                    load_image(p, target_size, crop_lesion=crop)
+                key = 'crop' if crop else 'full'
+                row[f'{key}_ms'] = (time.perf_counter() - start) * 1000 / min(len(paths), args.timing_images)
+                
+                if args.model_template and labels[0] is not None:
+                    model_path = args.model_template.format(size=size, crop=key)
+                    if os.path.exists(model_path):
+                        row[f'{key}_accuracy'] = evaluate_accuracy(model_path, paths, labels, target_size, crop)
+            
+            results[size] = row
+            accuracy = ""
+            for key in ('full', 'crop'):
+                if row.get(f'{key}_accuracy') is not None:
+                    accuracy += f" | {key} accuracy {row[f'{key}_accuracy']:.4f}"
+            print(f"{size:4d}px  preprocess full {row['full_ms']:6.2f} ms  crop {row['crop_ms']:6.2f} ms{accuracy}")
+    
+    results['roi_found_rate'] = found_rate
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GlowGuard preprocessing benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    decode = subparsers.add_parser('decode', help='Reduced-resolution JPEG decode')
+    decode.add_argument('--repeats', type=int, default=5)
+    decode.add_argument('--size', type=int, default=224, help='Model input size')
+    decode.add_argument('--model', default=None, help='Model for ISIC2018 accuracy check')
+    decode.add_argument('--limit', type=int, default=None, help='Max ISIC2018 images')
+    decode.set_defaults(func=run_decode_benchmark)
+    
+    batch = subparsers.add_parser('batch', help='Pooled batch preprocessing')
+    batch.add_argument('--images', type=int, default=64)
+    batch.add_argument('--repeats', type=int, default=5)
+    batch.add_argument('--size', type=int, default=224, help='Model input size')
+    batch.set_defaults(func=run_batch_benchmark)
+    
+    enhance = subparsers.add_parser('enhance', help='CLAHE + bilateral engine')
+    enhance.add_argument('--images', type=int, default=32)
+    enhance.add_argument('--repeats', type=int, default=5)
+    enhance.add_argument('--size', type=int, default=320, help='Model input size')
+    enhance.set_defaults(func=run_enhance_benchmark)
+    
+    roi = subparsers.add_parser('roi', help='Lesion ROI cropping per input size')
+    roi.add_argument('--sizes', default='128,160,224,320')
+    roi.add_argument('--limit', type=int, default=1000, help='Max HAM10000 images')
+    roi.add_argument('--timing-images', type=int, default=100)
+    roi.add_argument('--model-template', default=None,
+                     help='Per-size model path, e.g. ml_models/model_{size}_{crop}.h5 where '
+                          '{crop} is full or crop (trained with the matching LESION_CROP)')
+    roi.set_defaults(func=run_roi_benchmark)
+    
+    parser.add_argument('--output', default=None, help='Write results as JSON')
+    args = parser.parse_args()
+    
+    results = args.func(args)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
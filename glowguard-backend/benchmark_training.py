@@ -0,0 +1,361 @@
+"""
+Benchmarks for the training input path
+
+Usage:
+    python benchmark_training.py [--output results.json] augment [--policy train|advanced]
+        [--backend opencv|graph] [--images 256] [--size 224] [--batch-size 32] [--samples 2000]
+    python benchmark_training.py [--output results.json] precision
+        [--modes float32 mixed_bfloat16 mixed_bfloat16:xla] [--epochs 1] [--steps 100] [--shards]
+    python benchmark_training.py [--output results.json] progressive
+        [--schedule 128:96:3:0.5,160:64:3:0.75,224:32:4:1.0] [--target 0.75]
+    python benchmark_training.py [--output results.json] scaling [--workers 1 2 4 8] [--steps 20] [--shards]
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+
+import numpy as np
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tensorflow as tf
+
+from app.utils.augmentation import BatchAugmenter
+from app.utils.input_pipeline import AUTOTUNE, image_data_generator_augment_fn
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_model.py')
+
+# Two-sample KS p-value below which the batched and generator distributions count as different
+EQUIVALENCE_MIN_P = 0.01
+
+# Parameters compared between ImageDataGenerator.get_random_transform and BatchAugmenter.sample
+TRANSFORM_PARAMS = ['theta', 'tx', 'ty', 'shear', 'zx', 'zy', 'channel_shift_intensity', 'brightness']
+
+
+def make_sample_images(count, size, seed=0):
+    """Skin-toned images with a dark lesion and texture, uint8 [count, size, size, 3]"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype('float32')
+    images = np.empty((count, size, size, 3), dtype=np.uint8)
+    for i in range(count):
+        base = np.stack([
+            210 + 20 * np.sin((xx + i) / 23.0),
+            170 + 25 * np.cos(yy / 19.0),
+            150 + 30 * np.sin((xx + yy) / 31.0),
+        ], axis=-1)
+        cy, cx = rng.uniform(0.35, 0.65, 2) * size
+        base[np.hypot(yy - cy, xx - cx) < size * rng.uniform(0.1, 0.25)] *= 0.45
+        base += rng.normal(0, 8, size=base.shape)
+        images[i] = np.clip(base, 0, 255).astype(np.uint8)
+    return images
+
+
+def get_policy(name):
+    """ImageDataGenerator for train_model.py or improved_model_training.py"""
+    if name == 'advanced':
+        from improved_model_training import get_advanced_augmentation
+        return get_advanced_augmentation()
+    from train_model import SkinDiseaseTrainer
+    return SkinDiseaseTrainer().get_augmentation()
+
+
+def generator_params(datagen, shape, samples, seed=0):
+    """Transform parameters drawn by the Keras generator"""
+    draws = [datagen.get_random_transform(shape, seed=seed + i) for i in range(samples)]
+    return {key: np.array([d[key] for d in draws], dtype=np.float64)
+            for key in TRANSFORM_PARAMS if draws[0].get(key) is not None}
+
+
+def keras_params_to_batch(params):
+    """One get_random_transform dict -> BatchAugmenter.apply parameters for a batch of one"""
+    batch = {key: tf.constant([float(params.get(key, 1 if key in ('zx', 'zy') else 0))], tf.float32)
+             for key in ('theta', 'tx', 'ty', 'shear', 'zx', 'zy')}
+    batch['flip_horizontal'] = tf.constant([bool(params['flip_horizontal'])])
+    batch['flip_vertical'] = tf.constant([bool(params['flip_vertical'])])
+    for key in ('channel_shift_intensity', 'brightness'):
+        value = params.get(key)
+        batch[key] = tf.constant([value], tf.float32) if value is not None else None
+    return batch
+
+
+def run_augment_benchmark(args):
+    """Per-image ImageDataGenerator versus BatchAugmenter: throughput and equivalence"""
+    from scipy.stats import ks_2samp
+    
+    datagen = get_policy(args.policy)
+    augmenter = BatchAugmenter.from_image_data_generator(datagen, backend=args.backend)
+    images = make_sample_images(args.images, args.size)
+    labels = np.zeros(len(images), dtype=np.int32)
+    
+    print("\n" + "="*60)
+    print(f"Augmentation Benchmark ({args.policy} policy, {args.backend} backend, {args.size}x{args.size})")
+    print("="*60)
+    
+    # 1. Throughput
+    # Sequential generator, as ImageDataGenerator.flow runs it
+    start = time.perf_counter()
+    for img in images:
+        datagen.random_transform(img.astype(np.float32))
+    generator_ips = len(images) / (time.perf_counter() - start)
+    
+    def pipeline_ips(dataset):
+        for _ in dataset.take(1):
+            pass
+        start = time.perf_counter()
+        count = 0
+        for _ in range(args.repeats):
+            for batch, _ in dataset:
+                count += int(batch.shape[0])
+        return count / (time.perf_counter() - start)
+    
+    source = tf.data.Dataset.from_tensor_slices((images, labels))
+    # Per-image generator inside tf.data, as the streaming pipeline ran it
+    per_image = source.map(image_data_generator_augment_fn(datagen, args.size, seed=0),
+                           num_parallel_calls=AUTOTUNE).batch(args.batch_size).prefetch(AUTOTUNE)
+    batched = source.batch(args.batch_size).map(augmenter, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+    per_image_ips = pipeline_ips(per_image)
+    batched_ips = pipeline_ips(batched)
+    
+    # 2. Same parameters -> same pixels
+    img = images[0].astype(np.float32)
+    pixel_diffs = []
+    for i in range(args.parity_samples):
+        params = datagen.get_random_transform(img.shape, seed=i)
+        reference = datagen.apply_transform(img, params)
+        batch_out = augmenter.apply(img[None], keras_params_to_batch(params))[0].numpy()
+        pixel_diffs.append(float(np.abs(batch_out - reference).mean()))
+    
+    # 3. Same parameter distributions
+    expected = generator_params(datagen, img.shape, args.samples)
+    drawn = augmenter.sample(args.samples, args.size, args.size)
+    param_p = {key: float(ks_2samp(values, drawn[key].numpy()).pvalue) for key, values in expected.items()}
+    
+    # 4. Same output statistics over many augmentations of one image
+    generator_out = np.stack([datagen.random_transform(img) for _ in range(args.stat_samples)])
+    batched_out = augmenter(np.repeat(images[:1], args.stat_samples, axis=0), labels[:1])[0].numpy()
+    output_p = {
+        'mean': float(ks_2samp(generator_out.mean(axis=(1, 2, 3)), batched_out.mean(axis=(1, 2, 3))).pvalue),
+        'std': float(ks_2samp(generator_out.std(axis=(1, 2, 3)), batched_out.std(axis=(1, 2, 3))).pvalue),
+    }
+    
+    min_p = min(list(param_p.values()) + list(output_p.values()))
+    results = {
+        'policy': args.policy,
+        'backend': args.backend,
+        'images': len(images),
+        'size': args.size,
+        'generator_images_per_sec': generator_ips,
+        'per_image_pipeline_images_per_sec': per_image_ips,
+        'batched_images_per_sec': batched_ips,
+        'parity_mean_abs_diff': float(np.mean(pixel_diffs)),
+        'parity_max_abs_diff': float(np.max(pixel_diffs)),
+        'parameter_ks_p': param_p,
+        'output_ks_p': output_p,
+        'equivalent': bool(min_p >= EQUIVALENCE_MIN_P),
+    }
+    
+    print(f"ImageDataGenerator (sequential):  {generator_ips:8.1f} img/s")
+    print(f"Per-image tf.data map (parallel): {per_image_ips:8.1f} img/s")
+    print(f"BatchAugmenter (batched):         {batched_ips:8.1f} img/s "
+          f"({batched_ips / per_image_ips:.1f}x the per-image pipeline)")
+    print(f"Same parameters, mean |diff| per image: mean {results['parity_mean_abs_diff']:.3f}, "
+          f"max {results['parity_max_abs_diff']:.3f} (0-255 scale)")
+    print("KS p-values, parameters: " + ", ".join(f"{k} {v:.2f}" for k, v in param_p.items()))
+    print("KS p-values, outputs:    " + ", ".join(f"{k} {v:.2f}" for k, v in output_p.items()))
+    print(f"Distribution check: {'PASS' if results['equivalent'] else 'FAIL'} "
+          f"(min p {min_p:.3f}, threshold {EQUIVALENCE_MIN_P})")
+    return results
+
+
+def parse_mode(mode):
+    """'mixed_bfloat16:xla' -> ('mixed_bfloat16', True)"""
+    policy, _, flag = mode.partition(':')
+    return policy, flag == 'xla'
+
+
+def run_precision_benchmark(args):
+    """Step time and validation metrics per precision/XLA mode, against the float32 baseline"""
+    from train_model import SkinDiseaseTrainer, PRECISION_POLICIES, RANDOM_STATE
+    from app.utils.profiling import time_train_step
+    
+    print("\n" + "="*60)
+    print("Precision Benchmark")
+    print("="*60)
+    
+    trainer = SkinDiseaseTrainer()
+    train_ds, val_ds, _, _ = trainer.prepare_datasets(cache=args.cache, use_shards=args.shards)
+    num_classes = len(trainer.class_labels)
+    x_batch, y_batch = next(iter(train_ds))
+    
+    modes = args.modes if args.modes[0] == 'float32' else ['float32'] + args.modes
+    for mode in modes:
+        if parse_mode(mode)[0] not in PRECISION_POLICIES:
+            raise ValueError(f"Unknown precision policy in mode '{mode}'; choose from {PRECISION_POLICIES}")
+    results = []
+    for mode in modes:
+        precision, jit_compile = parse_mode(mode)
+        print(f"\n--- {mode} ---")
+        
+        # Same initial weights and data order for every mode
+        tf.keras.backend.clear_session()
+        tf.keras.utils.set_random_seed(RANDOM_STATE)
+        trainer = SkinDiseaseTrainer(precision=precision, jit_compile=jit_compile)
+        model = trainer.build_model(num_classes)
+        trainer._compile()
+        
+        step_seconds = time_train_step(model, x_batch, y_batch, repeats=args.step_repeats)
+        
+        start = time.perf_counter()
+        history = model.fit(train_ds, validation_data=val_ds, epochs=args.epochs,
+                            steps_per_epoch=args.steps, verbose=2)
+        train_seconds = time.perf_counter() - start
+        
+        results.append({
+            'mode': mode,
+            'precision': precision,
+            'jit_compile': jit_compile,
+            'step_ms': 1000 * step_seconds,
+            'images_per_sec': int(x_batch.shape[0]) / step_seconds,
+            'train_seconds': train_seconds,
+            'val_loss': float(history.history['val_loss'][-1]),
+            'val_accuracy': float(history.history['val_accuracy'][-1]),
+        })
+    
+    tf.keras.mixed_precision.set_global_policy('float32')
+    
+    baseline = results[0]
+    print(f"\n{'Mode':<22} {'Step ms':>9} {'img/s':>8} {'Speedup':>8} {'Val loss':>9} {'Val acc':>8} {'Δ acc':>7}")
+    print("-" * 78)
+    for row in results:
+        row['speedup'] = baseline['step_ms'] / row['step_ms']
+        row['val_accuracy_delta'] = row['val_accuracy'] - baseline['val_accuracy']
+        print(f"{row['mode']:<22} {row['step_ms']:>9.1f} {row['images_per_sec']:>8.1f} {row['speedup']:>7.2f}x "
+              f"{row['val_loss']:>9.4f} {row['val_accuracy']:>8.4f} {row['val_accuracy_delta']:>+7.4f}")
+    
+    return {'epochs': args.epochs, 'steps_per_epoch': args.steps, 'modes': results}
+
+
+def run_progressive_benchmark(args):
+    """Wall-clock time to a target accuracy: progressive resizing vs fixed-size training"""
+    from train_model import SkinDiseaseTrainer, BATCH_SIZE, PROGRESSIVE_SCHEDULE, RANDOM_STATE
+    from app.utils.progressive import build_resizing_report, fixed_schedule, format_resizing_report, parse_schedule
+    
+    print("\n" + "="*60)
+    print("Progressive Resizing Benchmark")
+    print("="*60)
+    
+    phases = parse_schedule(args.schedule or PROGRESSIVE_SCHEDULE)
+    # Same final size, epoch budget and full-strength policy throughout
+    schedules = {
+        'fixed': fixed_schedule(phases[-1]['size'], BATCH_SIZE, sum(p['epochs'] for p in phases)),
+        'progressive': phases,
+    }
+    
+    runs = {}
+    for name, schedule in schedules.items():
+        print(f"\n--- {name} ---")
+        tf.keras.backend.clear_session()
+        tf.keras.utils.set_random_seed(RANDOM_STATE)
+        history = SkinDiseaseTrainer().train_progressive(schedule).history
+        runs[name] = {'schedule': schedule, 'history': history}
+    
+    report = build_resizing_report(runs, target=args.target)
+    print()
+    print(format_resizing_report(report))
+    return {**report, 'histories': {name: run['history'] for name, run in runs.items()}}
+
+
+def run_scaling_benchmark(args):
+    """Data-parallel throughput for each worker count, as speed-up and efficiency over 1 worker"""
+    from train_model import DISTRIBUTED_SCALING_DIR
+    from app.utils.distributed import format_scaling_report, scaling_report
+    
+    print("\n" + "="*60)
+    print("Data-Parallel Scaling Benchmark")
+    print("="*60)
+    
+    counts = sorted(set(args.workers) | {1})
+    results = {}
+    for workers in counts:
+        print(f"\n--- {workers} worker{'s' if workers > 1 else ''} ---")
+        path = os.path.join(DISTRIBUTED_SCALING_DIR, f"workers_{workers}.json")
+        if os.path.exists(path):
+            os.remove(path)
+        
+        command = [sys.executable, TRAIN_SCRIPT, '--workers', str(workers),
+                   '--benchmark-distributed', str(args.steps), '--cache', args.cache]
+        if args.shards:
+            command.append('--shards')
+        if subprocess.run(command).returncode != 0 or not os.path.exists(path):
+            print(f"Run with {workers} workers failed; skipped")
+            continue
+        with open(path, 'r') as f:
+            results[workers] = json.load(f)
+    
+    report = scaling_report(results)
+    print()
+    print(format_scaling_report(report))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GlowGuard training input benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    augment = subparsers.add_parser('augment', help='Batched augmentation vs ImageDataGenerator')
+    augment.add_argument('--policy', choices=['train', 'advanced'], default='advanced',
+                         help='train_model.py policy or improved_model_training.py policy')
+    augment.add_argument('--backend', choices=['opencv', 'graph'], default='opencv',
+                         help='BatchAugmenter warp kernel')
+    augment.add_argument('--images', type=int, default=256)
+    augment.add_argument('--size', type=int, default=224)
+    augment.add_argument('--batch-size', type=int, default=32)
+    augment.add_argument('--repeats', type=int, default=3)
+    augment.add_argument('--parity-samples', type=int, default=50)
+    augment.add_argument('--samples', type=int, default=2000, help='Parameter draws per side')
+    augment.add_argument('--stat-samples', type=int, default=500, help='Augmented outputs per side')
+    augment.set_defaults(func=run_augment_benchmark)
+    
+    precision = subparsers.add_parser('precision', help='Mixed precision and XLA vs the float32 baseline')
+    precision.add_argument('--modes', nargs='+', default=['float32', 'mixed_bfloat16', 'mixed_bfloat16:xla'],
+                           help="Modes as POLICY or POLICY:xla; float32 is always run first as the baseline")
+    precision.add_argument('--epochs', type=int, default=1, help='Training epochs per mode')
+    precision.add_argument('--steps', type=int, default=None, help='Steps per epoch (default: full epoch)')
+    precision.add_argument('--step-repeats', type=int, default=10, help='Timed steps on a fixed batch')
+    precision.add_argument('--cache', choices=['disk', 'memory', 'none'], default='disk')
+    precision.add_argument('--shards', action='store_true', help='Train from compiled shards')
+    precision.set_defaults(func=run_precision_benchmark)
+    
+    progressive = subparsers.add_parser('progressive', help='Progressive resizing vs fixed-size training')
+    progressive.add_argument('--schedule', default=None,
+                             help='size:batch_size:epochs[:augmentation] phases (default: train_model.py schedule)')
+    progressive.add_argument('--target', type=float, default=None,
+                             help='Validation accuracy to time (default: the lower of the two best accuracies)')
+    progressive.set_defaults(func=run_progressive_benchmark)
+    
+    scaling = subparsers.add_parser('scaling', help='Multi-process data-parallel training, 1 to N workers')
+    scaling.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                         help='Worker counts; 1 is always run as the baseline')
+    scaling.add_argument('--steps', type=int, default=20, help='Timed steps per run, after warm-up')
+    scaling.add_argument('--cache', choices=['disk', 'memory', 'none'], default='disk')
+    scaling.add_argument('--shards', action='store_true', help='Train from compiled shards')
+    scaling.set_defaults(func=run_scaling_benchmark)
+    
+    parser.add_argument('--output', default=None, help='Write results as JSON')
+    args = parser.parse_args()
+    
+    results = args.func(args)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
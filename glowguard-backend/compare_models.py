@@ -0,0 +1,182 @@
+"""
+Compare registered models on the training validation split
+
+Each model runs over the validation split once; its probabilities are cached
+under ml_models/predictions keyed by model file hash and split hash, so
+later comparisons (other metrics, other model sets) only load the cached
+matrices. Retraining a model changes its file hash and re-runs just that
+model.
+
+Usage:
+    python compare_models.py --register candidate=ml_models/best_model.h5
+    python compare_models.py [--model production --model candidate] [--baseline production]
+    python compare_models.py --model old=path/to/old.h5 --model new=path/to/new.h5 --shards
+    python compare_models.py --dedup
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+
+from app.utils.data_loader import BASE_DIR, DatasetCatalog
+from app.utils.image_processing import enhancement_key
+from app.utils.model_comparison import (
+    PredictionCache, compare_predictions, dataset_hash, format_comparison, load_registry,
+    model_version, prediction_key, register_model, save_comparison
+)
+from app.utils.shards import ShardedDataset
+from train_model import BATCH_SIZE, CROP_LESIONS, ENHANCE_IMAGES, IMG_SIZE, SkinDiseaseTrainer
+
+
+def validation_split(use_shards=False, dedup=False):
+    """
+    The trainer's validation split (SkinDiseaseTrainer._split, as in prepare_datasets)
+    
+    Args:
+        use_shards: Read compiled shards instead of JPEGs
+        dedup: The lesion-grouped split of dedup_dataset.py (train_model.py --dedup)
+    
+    Returns:
+        Tuple of (image_ids, labels, classes, make_dataset) where
+        make_dataset(img_size) builds the batched (images, labels) pipeline at
+        a model's input size
+    """
+    from app.utils.input_pipeline import build_dataset, build_shard_dataset
+    
+    if use_shards:
+        shards = ShardedDataset.open(IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS)
+        _, idx_val = SkinDiseaseTrainer._split(shards.index['image_id'], shards.labels, dedup)
+        y_val = shards.labels[idx_val]
+        image_ids = shards.index['image_id'].to_numpy()[idx_val]
+        
+        def make_dataset(img_size):
+            sized = shards if img_size == IMG_SIZE else ShardedDataset.open(img_size, ENHANCE_IMAGES, CROP_LESIONS)
+            positions = pd.Index(sized.index['image_id']).get_indexer(image_ids)
+            if (positions < 0).any():
+                raise ValueError(f"Shards at {img_size}px lack {int((positions < 0).sum())} validation images; "
+                                 f"recompile with compile_dataset.py --size {img_size}")
+            return build_shard_dataset(sized, positions, batch_size=BATCH_SIZE)
+        
+        return image_ids, y_val, shards.classes, make_dataset
+    
+    catalog = DatasetCatalog.build()
+    _, val_pos = SkinDiseaseTrainer._split(catalog.frame.index, catalog.labels, dedup)
+    ids_val = catalog.frame.index.to_numpy()[val_pos]
+    paths_val, y_val = catalog.paths[val_pos], catalog.labels[val_pos]
+    
+    def make_dataset(img_size):
+        # Cached predictions are stored per validation image, so none may be dropped
+        return build_dataset(paths_val, y_val, img_size=img_size, batch_size=BATCH_SIZE,
+                             enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS, skip_unreadable=False)
+    
+    return ids_val, y_val, catalog.classes, make_dataset
+
+
+def resolve_models(specs):
+    """--model values (registered NAME or NAME=PATH) -> {name: path}"""
+    registry = load_registry()
+    if not specs:
+        return {name: path for name, path in registry.items() if os.path.exists(_model_path(path))}
+    
+    models = {}
+    for spec in specs:
+        name, _, path = spec.partition('=')
+        if not path:
+            if name not in registry:
+                raise SystemExit(f"Unknown model {name!r}; registered: {', '.join(registry) or 'none'}")
+            path = registry[name]
+        models[name] = path
+    return models
+
+
+def _model_path(path):
+    """Model paths are relative to the backend directory, like the rest of ml_models"""
+    return path if os.path.isabs(path) or os.path.exists(path) else str(BASE_DIR / path)
+
+
+def predict_model(path, make_dataset, labels, num_classes):
+    import tensorflow as tf
+    from app.utils.evaluation import evaluate_dataset
+    
+    model = tf.keras.models.load_model(path, compile=False)
+    evaluator = evaluate_dataset(model, make_dataset(model.input_shape[1]), num_classes)
+    if not np.array_equal(evaluator.labels, labels):
+        raise ValueError("Evaluation pipeline returned labels out of order")
+    return evaluator.probabilities
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare models on cached validation predictions")
+    parser.add_argument('--model', action='append', metavar='NAME[=PATH]',
+                        help='Model to compare (repeatable); defaults to every registered model')
+    parser.add_argument('--register', action='append', metavar='NAME=PATH', help='Add a model to the registry')
+    parser.add_argument('--baseline', help='Model the deltas are taken against (default: first model)')
+    parser.add_argument('--shards', action='store_true', help='Evaluate on compiled shards instead of JPEGs')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Validate on the lesion-grouped split from dedup_dataset.py (as train_model.py --dedup)')
+    parser.add_argument('--output', help='Also write the comparison as JSON')
+    args = parser.parse_args()
+    
+    for spec in args.register or []:
+        name, _, path = spec.partition('=')
+        if not path:
+            raise SystemExit(f"--register expects NAME=PATH, got {spec!r}")
+        register_model(name, path)
+        print(f"Registered {name}: {path}")
+    if args.register and not args.model:
+        return
+    
+    models = resolve_models(args.model)
+    if not models:
+        raise SystemExit("No models to compare; register some with --register NAME=PATH")
+    
+    print("\n" + "="*60)
+    print("MODEL COMPARISON")
+    print("="*60)
+    
+    image_ids, labels, classes, make_dataset = validation_split(args.shards, args.dedup)
+    labels = np.asarray(labels, dtype=np.int64)
+    set_hash = dataset_hash(image_ids, labels)
+    cache = PredictionCache()
+    print(f"Validation split: {len(labels)} images (set {set_hash})")
+    
+    # Input size comes from the model itself; enhancement (with its parameters) and
+    # cropping follow the training config
+    variant = f"enh{enhancement_key(ENHANCE_IMAGES) or 0}_crop{int(CROP_LESIONS)}"
+    probabilities = {}
+    for name, path in models.items():
+        path = _model_path(path)
+        version = model_version(path)
+        key = prediction_key(version, variant)
+        if cache.get(set_hash, key) is not None:
+            print(f"  {name}: cached ({version})")
+        else:
+            print(f"  {name}: predicting with {path} ({version})...")
+        
+        start = time.perf_counter()
+        probabilities[name] = cache.get_or_predict(
+            set_hash, key, labels, lambda: predict_model(path, make_dataset, labels, len(classes)),
+            metadata={'name': name, 'path': path, 'version': version,
+                      'enhance': enhancement_key(ENHANCE_IMAGES), 'crop_lesion': CROP_LESIONS}
+        )
+        print(f"    loaded in {time.perf_counter() - start:.1f}s")
+    
+    start = time.perf_counter()
+    report = compare_predictions(probabilities, labels, len(classes), args.baseline)
+    print(f"\nCompared {len(models)} models in {time.perf_counter() - start:.2f}s\n")
+    print(format_comparison(report, classes))
+    
+    if args.output:
+        save_comparison(report, args.output)
+        print(f"\nReport saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Compile HAM10000 + ISIC2018 into preprocessed, memory-mappable shards
+
+Run once per preprocessing variant; training, evaluation and calibration then
+open the shards with ShardedDataset instead of decoding JPEGs.
+
+Usage:
+    python compile_dataset.py --size 224 [--enhance] [--crop] [--workers 8]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.data_loader import DatasetCatalog
+from app.utils.shards import compile_shards, DEFAULT_SHARD_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the training datasets into shards")
+    parser.add_argument('--size', type=int, default=224, help='Square image size')
+    parser.add_argument('--enhance', action='store_true', help='Apply CLAHE + bilateral filtering')
+    parser.add_argument('--crop', action='store_true', help='Crop to the lesion ROI')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    args = parser.parse_args()
+    
+    print("\n" + "="*60)
+    print("COMPILING DATASET SHARDS")
+    print("="*60)
+    
+    catalog = DatasetCatalog.build()
+    if len(catalog) == 0:
+        print("Error: No images found. Please check dataset paths.")
+        return
+    
+    start = time.perf_counter()
+    directory = compile_shards(
+        catalog, img_size=args.size, enhance=args.enhance, crop_lesion=args.crop,
+        shard_size=args.shard_size, workers=args.workers
+    )
+    
+    print(f"\nCompiled in {time.perf_counter() - start:.1f}s")
+    print(f"Output: {directory}")
+
+
+if __name__ == "__main__":
+    main()
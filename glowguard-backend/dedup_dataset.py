@@ -0,0 +1,174 @@
+"""
+Find near-duplicate training images and write a deduplicated, lesion-grouped split
+
+Perceptual hashes are computed in parallel (and cached by checksum), images
+a few bits apart are clustered across lesions and datasets, and the manifest
+keeps one image per cluster for training. train_model.py --dedup then trains
+on that manifest instead of a random split.
+
+--evaluate measures the impact: head-only training on cached backbone
+features for the random split, the lesion-grouped split and the grouped,
+deduplicated split, plus the full-model epoch time each training set implies.
+
+Usage:
+    python dedup_dataset.py [--threshold 6] [--workers 8] [--show 10]
+    python dedup_dataset.py --evaluate [--views 0]
+    python train_model.py --dedup
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from app.utils.data_loader import DatasetCatalog
+from app.utils.dedup import (
+    DEDUP_MANIFEST, DEDUP_REPORT, DEFAULT_THRESHOLD, build_dedup_manifest, save_manifest,
+    summarize_duplicates
+)
+
+# Head trained for --evaluate when no tuned config exists (run_experiments.py --export)
+DEFAULT_HEAD = {'dense_units': (256, 128), 'dropout': 0.3, 'learning_rate': 1e-3, 'class_weight': None}
+
+
+def show_clusters(manifest, count):
+    """The largest duplicate clusters, for a manual look"""
+    sizes = manifest.groupby('cluster').size().sort_values(ascending=False)
+    for cluster in sizes[sizes > 1].index[:count]:
+        members = manifest[manifest['cluster'] == cluster]
+        rows = ", ".join(f"{image_id} ({row.lesion_id}, {row.dx}{', kept' if row.keep else ''})"
+                         for image_id, row in members.iterrows())
+        print(f"  cluster {cluster}: {rows}")
+
+
+def evaluate_impact(manifest, views):
+    """Validation accuracy and epoch time for random, grouped and grouped + deduplicated training"""
+    from sklearn.model_selection import train_test_split
+    from app.utils.experiments import BEST_CONFIG_PATH, run_trial
+    from app.utils.profiling import time_train_step
+    from train_model import BATCH_SIZE, IMG_SIZE, RANDOM_STATE, VALIDATION_SPLIT, SkinDiseaseTrainer
+    
+    trainer = SkinDiseaseTrainer()
+    features, labels, _ = trainer.cached_features(views=views)
+    features = np.asarray(features, dtype=np.float32)
+    catalog = trainer.load_catalog()
+    if not manifest.index.equals(catalog.frame.index):
+        raise SystemExit("Manifest does not match the catalog; re-run dedup_dataset.py")
+    
+    config = DEFAULT_HEAD
+    if BEST_CONFIG_PATH.exists():
+        with open(BEST_CONFIG_PATH, 'r') as f:
+            config = json.load(f)['config']
+    
+    positions = np.arange(len(labels))
+    val = (manifest['split'] == 'val').to_numpy()
+    keep = manifest['keep'].to_numpy(dtype=bool)
+    random_train, random_val = train_test_split(
+        positions, test_size=VALIDATION_SPLIT, random_state=RANDOM_STATE, stratify=labels
+    )
+    splits = {
+        'random': (random_train, random_val),
+        'grouped': (positions[~val], positions[val]),
+        'grouped_dedup': (positions[~val & keep], positions[val]),
+    }
+    
+    # Full-model step time: epoch time scales with the training set size
+    trainer._compile()
+    batch = np.random.default_rng(RANDOM_STATE).random((BATCH_SIZE, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+    step_seconds = time_train_step(trainer.model, batch, np.zeros(BATCH_SIZE, dtype=np.int32))
+    
+    results = {}
+    for name, (train_idx, val_idx) in splits.items():
+        print(f"\n--- {name}: {len(train_idx)} training, {len(val_idx)} validation images ---")
+        trial = run_trial(config, features, labels, [(train_idx, val_idx)], seed=RANDOM_STATE)
+        results[name] = {
+            'train_images': int(len(train_idx)),
+            'val_images': int(len(val_idx)),
+            'accuracy': trial['mean_accuracy'],
+            'balanced_accuracy': trial['mean_balanced_accuracy'],
+            'epoch_seconds': len(train_idx) / BATCH_SIZE * step_seconds,
+        }
+    
+    grouped, dedup = results['grouped'], results['grouped_dedup']
+    return {
+        'head_config': config,
+        'step_seconds': step_seconds,
+        'splits': results,
+        'epoch_seconds_saved': grouped['epoch_seconds'] - dedup['epoch_seconds'],
+        'epoch_time_saving': 1 - dedup['epoch_seconds'] / max(grouped['epoch_seconds'], 1e-9),
+        'accuracy_delta': dedup['accuracy'] - grouped['accuracy'],
+        'balanced_accuracy_delta': dedup['balanced_accuracy'] - grouped['balanced_accuracy'],
+        # How much the random split's leak inflated validation accuracy
+        'leakage_accuracy_gap': results['random']['accuracy'] - grouped['accuracy'],
+    }
+
+
+def format_impact(impact):
+    lines = [f"{'Split':<15} {'Train':>7} {'Val':>6} {'Accuracy':>9} {'Balanced':>9} {'Epoch s':>9}"]
+    for name, row in impact['splits'].items():
+        lines.append(f"{name:<15} {row['train_images']:>7} {row['val_images']:>6} {row['accuracy']:>9.4f} "
+                     f"{row['balanced_accuracy']:>9.4f} {row['epoch_seconds']:>9.1f}")
+    lines.append(f"\nDeduplication saves {impact['epoch_seconds_saved']:.1f}s per epoch "
+                 f"({impact['epoch_time_saving']:.1%}); accuracy {impact['accuracy_delta']:+.4f}, "
+                 f"balanced accuracy {impact['balanced_accuracy_delta']:+.4f} on the grouped validation set")
+    lines.append(f"The random split overstates accuracy by {impact['leakage_accuracy_gap']:+.4f} (lesion leakage)")
+    return "\n".join(lines)
+
+
+def main():
+    from train_model import RANDOM_STATE, VALIDATION_SPLIT
+    
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate images and write a grouped split")
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                        help='Maximum differing hash bits (of 64) for a near-duplicate')
+    parser.add_argument('--workers', type=int, default=None, help='Hashing processes (default: all cores)')
+    parser.add_argument('--show', type=int, default=10, help='Largest clusters to list')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='Measure epoch-time savings and validation-accuracy impact')
+    parser.add_argument('--views', type=int, default=0, help='Augmented feature views for --evaluate')
+    args = parser.parse_args()
+    
+    print("\n" + "="*60)
+    print("NEAR-DUPLICATE DEDUPLICATION")
+    print("="*60)
+    
+    catalog = DatasetCatalog.build()
+    if len(catalog) == 0:
+        print("Error: No images found. Please check dataset paths.")
+        return
+    
+    start = time.perf_counter()
+    manifest = build_dedup_manifest(catalog, threshold=args.threshold, validation_split=VALIDATION_SPLIT,
+                                    seed=RANDOM_STATE, workers=args.workers)
+    save_manifest(manifest)
+    print(f"Clustered in {time.perf_counter() - start:.1f}s (threshold {args.threshold} bits)")
+    
+    summary = summarize_duplicates(manifest)
+    print(json.dumps(summary, indent=2))
+    if summary['duplicate_clusters']:
+        print("\nLargest clusters:")
+        show_clusters(manifest, args.show)
+    
+    report = {'threshold': args.threshold, 'summary': summary}
+    if args.evaluate:
+        impact = evaluate_impact(manifest, args.views)
+        print()
+        print(format_impact(impact))
+        report['impact'] = impact
+    
+    DEDUP_REPORT.parent.mkdir(parents=True, exist_ok=True)
+    with open(DEDUP_REPORT, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    print(f"\nManifest: {DEDUP_MANIFEST}")
+    print(f"Report: {DEDUP_REPORT}")
+
+
+if __name__ == "__main__":
+    main()
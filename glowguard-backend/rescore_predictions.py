@@ -0,0 +1,175 @@
+"""
+Re-score stored predictions with a new classifier head
+
+Predictions saved with STORE_EMBEDDINGS=true keep their pooled backbone
+embedding. After retraining only the head, or editing class_labels.json,
+this job runs the new model's head over those embeddings in NumPy (no image
+decoding, no backbone) and reports which diagnoses change. Only predictions
+whose backbone version matches the new model are re-scored; the rest need
+the full model. --apply writes the new diagnoses back to the database,
+replaces the stored recommendations of every changed diagnosis and deletes
+the cached Grad-CAM heatmaps of the re-scored predictions.
+
+Usage:
+    python rescore_predictions.py [--model ml_models/resnet_model.h5]
+    python rescore_predictions.py --model ml_models/best_model.h5 --output rescored.csv
+    python rescore_predictions.py --apply
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+
+from app.models import Prediction, Recommendation
+from app.utils.database import SessionLocal, init_db
+from app.utils.embeddings import EMBEDDING_DTYPE, NumpyHead, decode_embeddings
+from app.utils.explanations import remove_explanations
+
+# Predictions decoded and scored at a time
+CHUNK_SIZE = 50000
+
+
+def rescore_chunk(predictor, head, rows):
+    """New primary diagnosis for (id, image_path, disease_name, confidence, embedding) rows"""
+    probabilities = head(decode_embeddings([row.embedding for row in rows]))
+    results = []
+    for row, scores in zip(rows, probabilities):
+        primary = predictor._top_3_from_scores(scores)[0]
+        results.append({
+            'id': row.id,
+            'image_path': row.image_path,
+            'old_disease': row.disease_name,
+            'old_confidence': row.confidence,
+            'new_disease': primary['disease'],
+            'new_confidence': primary['confidence'],
+        })
+    return results
+
+
+def apply_results(db, results, versions):
+    """
+    Write new diagnoses (with their disease info and severity) back to the predictions
+    
+    The remedies and precautions stored for a changed diagnosis are replaced
+    in the same transaction. Cached heatmaps of every re-scored prediction
+    are deleted: they were computed with the old head, and for the old class
+    where the diagnosis changed.
+    """
+    from app.utils.ml_model import DiseaseDatabaseHandler
+    from app.utils.recommendations import RecommendationEngine
+    
+    changed = [result for result in results if result['new_disease'] != result['old_disease']]
+    if changed:
+        db.query(Recommendation).filter(Recommendation.prediction_id.in_([r['id'] for r in changed])) \
+            .delete(synchronize_session=False)
+    for result in changed:
+        disease_name = result['new_disease']
+        db.add_all(
+            [Recommendation(prediction_id=result['id'], category="remedies", content=remedy)
+             for remedy in RecommendationEngine.get_remedies(disease_name)]
+            + [Recommendation(prediction_id=result['id'], category="precautions", content=precaution)
+               for precaution in RecommendationEngine.get_precautions(disease_name)]
+        )
+    
+    updates = []
+    for result in results:
+        disease_info = DiseaseDatabaseHandler.get_disease_info(result['new_disease'])
+        updates.append({
+            'id': result['id'],
+            'disease_name': result['new_disease'],
+            'confidence': result['new_confidence'],
+            'severity': DiseaseDatabaseHandler.get_severity_level(result['new_disease'], result['new_confidence']),
+            'description': disease_info.get("description", ""),
+            'causes': ", ".join(disease_info.get("causes", [])),
+            'model_version': versions['model_version'],
+        })
+    db.bulk_update_mappings(Prediction, updates)
+    # Before the commit: a heatmap deleted for a rolled-back update is only recomputed
+    for result in results:
+        if result['image_path']:
+            remove_explanations(result['image_path'])
+    db.commit()
+
+
+def main():
+    from app.utils.ml_model import SkinDiseasePredictor
+    
+    parser = argparse.ArgumentParser(description="Re-score stored prediction embeddings with a new head")
+    parser.add_argument('--model', default='ml_models/resnet_model.h5', help='Model whose head re-scores')
+    parser.add_argument('--output', default=None, help='CSV of every re-scored prediction')
+    parser.add_argument('--apply', action='store_true', help='Update the predictions in the database')
+    args = parser.parse_args()
+    
+    print("\n" + "="*60)
+    print("HEAD-ONLY RE-SCORING")
+    print("="*60)
+    
+    if not os.path.exists(args.model):
+        raise SystemExit(f"Model not found: {args.model}")
+    init_db()
+    predictor = SkinDiseasePredictor(args.model)
+    head = NumpyHead.from_model(predictor.model)
+    versions = predictor.model_versions()
+    print(f"Model {args.model}: version {versions['model_version']}, backbone {versions['backbone_version']}")
+    
+    db = SessionLocal()
+    try:
+        stored = db.query(Prediction).filter(Prediction.embedding.isnot(None))
+        other_backbone = stored.filter(Prediction.backbone_version != versions['backbone_version']).count()
+        query = db.query(Prediction.id, Prediction.image_path, Prediction.disease_name, Prediction.confidence,
+                         Prediction.embedding) \
+            .filter(Prediction.embedding.isnot(None), Prediction.backbone_version == versions['backbone_version']) \
+            .order_by(Prediction.id)
+        
+        start = time.perf_counter()
+        results = []
+        last_id = -1
+        while True:
+            # Keyset pagination: --apply may update rows between chunks
+            rows = query.filter(Prediction.id > last_id).limit(CHUNK_SIZE).all()
+            if not rows:
+                break
+            features = len(rows[0].embedding) // np.dtype(EMBEDDING_DTYPE).itemsize
+            if features != head.input_dim:
+                raise SystemExit(f"Stored embeddings have {features} features, "
+                                 f"the head expects {head.input_dim}")
+            chunk = rescore_chunk(predictor, head, rows)
+            if args.apply:
+                apply_results(db, chunk, versions)
+            results.extend(chunk)
+            last_id = rows[-1].id
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+    
+    print(f"Re-scored {len(results)} predictions in {elapsed:.2f}s")
+    if other_backbone:
+        print(f"Skipped {other_backbone} predictions stored under another backbone; they need the full model")
+    if not results:
+        return
+    
+    frame = pd.DataFrame(results)
+    changed = frame['old_disease'] != frame['new_disease']
+    print(f"Diagnosis changed for {int(changed.sum())} ({changed.mean():.1%}); "
+          f"mean confidence {frame['old_confidence'].mean():.3f} -> {frame['new_confidence'].mean():.3f}")
+    if changed.any():
+        transitions = frame[changed].groupby(['old_disease', 'new_disease']).size().sort_values(ascending=False)
+        print("\nMost common changes:")
+        for (old, new), count in transitions.head(10).items():
+            print(f"  {old} -> {new}: {count}")
+    
+    if args.output:
+        frame.to_csv(args.output, index=False)
+        print(f"\nResults: {args.output}")
+    print("Database updated" if args.apply else "Dry run; use --apply to update the database")
+
+
+if __name__ == "__main__":
+    main()
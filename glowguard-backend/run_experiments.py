@@ -0,0 +1,96 @@
+"""
+Sweep classifier-head hyperparameters on cached backbone features
+
+Each configuration is scored with k-fold cross-validation grouped by
+lesion_id, trials run in parallel processes, and results accumulate in
+ml_models/experiments.db. Re-running an experiment only runs the
+configurations it has not stored yet with the same feature cache, views and
+folds; leaderboards and --export rank the most recently run setup only.
+
+Usage:
+    python run_experiments.py --name sweep1 --grid
+    python run_experiments.py --name sweep2 --random 40 --workers 4
+    python run_experiments.py --name sweep1 --export
+    python train_model.py --feature-cache --head-config
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.experiments import (
+    BEST_CONFIG_PATH, ResultsStore, grid_configs, random_configs, run_experiment
+)
+
+
+def print_leaderboard(store, experiment, metric, limit=10):
+    rows = store.leaderboard(experiment, metric, limit)
+    if not rows:
+        print(f"No results for experiment '{experiment}'")
+        return
+    
+    setups = store.setups(experiment)
+    print(f"\nSetup: features {setups[0]['features']}, {setups[0]['views']} views, {setups[0]['folds']} folds")
+    if len(setups) > 1:
+        print(f"({len(setups) - 1} earlier setups of '{experiment}' are not ranked)")
+    print(f"\n{'Rank':<5} {'Balanced':>9} {'Accuracy':>9}  Config")
+    print("-" * 80)
+    for rank, row in enumerate(rows, 1):
+        print(f"{rank:<5} {row['mean_balanced_accuracy']:>9.3f} {row['mean_accuracy']:>9.3f}  {row['config']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grouped k-fold sweeps over head hyperparameters")
+    parser.add_argument('--name', required=True, help='Experiment name')
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument('--grid', action='store_true', help='Run the full search grid')
+    search.add_argument('--random', type=int, metavar='N', help='Run N random configurations')
+    parser.add_argument('--folds', type=int, default=5, help='Grouped folds (by lesion_id)')
+    parser.add_argument('--workers', type=int, default=None, help='Parallel trials (default: all cores)')
+    parser.add_argument('--views', type=int, default=None, help='Augmented views in the feature cache')
+    parser.add_argument('--shards', action='store_true',
+                        help='Extract features from shards compiled by compile_dataset.py')
+    parser.add_argument('--metric', choices=['mean_balanced_accuracy', 'mean_accuracy'],
+                        default='mean_balanced_accuracy', help='Ranking metric')
+    parser.add_argument('--export', nargs='?', const=str(BEST_CONFIG_PATH), default=None, metavar='PATH',
+                        help='Write the best configuration to JSON (for train_model.py --head-config)')
+    args = parser.parse_args()
+    
+    store = ResultsStore()
+    
+    if args.grid or args.random:
+        # Imported here so --export and leaderboards do not need TensorFlow
+        from train_model import SkinDiseaseTrainer, FEATURE_VIEWS
+        
+        print("\n" + "="*60)
+        print(f"EXPERIMENT: {args.name}")
+        print("="*60)
+        
+        trainer = SkinDiseaseTrainer()
+        if not args.shards and len(trainer.load_catalog()) == 0:
+            print("Error: No images found. Please check dataset paths.")
+            return
+        
+        views = FEATURE_VIEWS if args.views is None else args.views
+        _, labels, groups = trainer.cached_features(views=views, use_shards=args.shards)
+        
+        configs = grid_configs() if args.grid else random_configs(args.random)
+        start = time.perf_counter()
+        run_experiment(args.name, trainer.feature_dir, labels, groups, configs,
+                       k=args.folds, views=views, workers=args.workers, store=store)
+        print(f"\nSweep finished in {time.perf_counter() - start:.0f}s")
+    
+    print_leaderboard(store, args.name, args.metric)
+    
+    if args.export:
+        best = store.export_best(args.name, args.export, args.metric)
+        if best:
+            print(f"\n✓ Best configuration written to {args.export}")
+
+
+if __name__ == "__main__":
+    main()
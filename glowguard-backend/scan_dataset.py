@@ -0,0 +1,61 @@
+"""
+Validate every HAM10000 + ISIC2018 image and update the integrity manifest
+
+The first run decodes every image with a process pool; later runs only
+re-check files whose size or mtime changed. DatasetCatalog (and so training,
+compile_dataset.py and run_experiments.py) leaves out images the manifest
+marks as unusable.
+
+Usage:
+    python scan_dataset.py [--workers 8] [--full] [--show 20]
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.data_loader import INTEGRITY_MANIFEST
+from app.utils.integrity import BAD_STATUSES, scan_dataset, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check training images and update the integrity manifest")
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--full', action='store_true', help='Re-check every file, ignoring the manifest')
+    parser.add_argument('--show', type=int, default=20, help='Problem files to list')
+    args = parser.parse_args()
+    
+    print("\n" + "="*60)
+    print("DATASET INTEGRITY SCAN")
+    print("="*60)
+    
+    start = time.perf_counter()
+    manifest = scan_dataset(workers=args.workers, full=args.full)
+    elapsed = time.perf_counter() - start
+    
+    print(f"\nScanned in {elapsed:.1f}s")
+    print(json.dumps(summarize(manifest), indent=2))
+    
+    problems = manifest[manifest['status'] != 'ok']
+    if len(problems):
+        bad = int(problems['status'].isin(BAD_STATUSES).sum())
+        print(f"\n{len(problems)} problems ({bad} unusable files excluded from the catalog):")
+        for row in problems.head(args.show).itertuples():
+            location = row.path if isinstance(row.path, str) else f"(no file for {row.image_id})"
+            detail = f" - {row.error}" if row.error else ""
+            print(f"  {row.status:<10} {location}{detail}")
+        if len(problems) > args.show:
+            print(f"  ... {len(problems) - args.show} more in {INTEGRITY_MANIFEST}")
+    else:
+        print("\n✓ All images passed")
+    
+    print(f"\nManifest: {INTEGRITY_MANIFEST}")
+
+
+if __name__ == "__main__":
+    main()
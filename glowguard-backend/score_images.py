@@ -0,0 +1,170 @@
+"""
+Score a folder of images offline, optionally against ground-truth labels
+
+Images are decoded by a process pool on every core while the model runs on
+large batches through SkinDiseasePredictor, with the same preprocessing as
+the API. Results are appended to a CSV file, or to a directory of Parquet
+parts for any other output path, after every batch. Re-running the same
+command resumes where it stopped: image ids already in the output are
+skipped. With a label CSV (HAM10000 metadata or the one-hot ISIC2018 ground
+truth) accuracy and per-class metrics are printed and saved.
+
+Usage:
+    python score_images.py                                   # ISIC2018 test set
+    python score_images.py --images /data/partner --output partner_scores.parquet
+    python score_images.py --ground-truth labels.csv --images /data/images --model ml_models/best_model.h5
+"""
+
+import os
+import sys
+import json
+import hashlib
+import time
+import shutil
+import argparse
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from app.utils.bulk_scoring import (
+    ScoreWriter, decoded_batches, error_rows, output_columns, score_rows, scored_metrics, scoring_inputs
+)
+from app.utils.data_loader import BASE_DIR, ISIC2018_GROUND_TRUTH, ISIC2018_TEST_IMAGES
+from app.utils.evaluation import format_metrics
+from app.utils.model_comparison import model_version
+
+SCORES_DIR = BASE_DIR / "ml_models" / "scores"
+# Print throughput every this many batches
+LOG_EVERY = 10
+
+
+def default_output(image_dir):
+    """One output per image directory: its name plus a hash of its absolute path"""
+    image_dir = Path(image_dir).resolve()
+    digest = hashlib.sha1(str(image_dir).encode('utf-8')).hexdigest()[:8]
+    return SCORES_DIR / f"{image_dir.name}_{digest}.csv"
+
+
+def metrics_path(output):
+    output = Path(output)
+    return output.with_name(f"{output.stem}_metrics.json")
+
+
+def remove_output(output):
+    output = Path(output)
+    if output.is_dir():
+        shutil.rmtree(output)
+    elif output.exists():
+        output.unlink()
+
+
+def main():
+    from app.utils.ml_model import SkinDiseasePredictor
+    
+    parser = argparse.ArgumentParser(description="Bulk-score an image folder with the prediction model")
+    parser.add_argument('--images', default=None,
+                        help='Image directory, searched recursively (default: ISIC2018 test images)')
+    parser.add_argument('--ground-truth', default=None,
+                        help='Label CSV; defaults to the ISIC2018 ground truth when --images is not given')
+    parser.add_argument('--model', default='ml_models/resnet_model.h5', help='Model file')
+    parser.add_argument('--output', default=None,
+                        help='.csv file, or any other path for a directory of Parquet parts '
+                             '(default: ml_models/scores/<images dir>_<path hash>.csv)')
+    parser.add_argument('--batch-size', type=int, default=128, help='Images per inference batch')
+    parser.add_argument('--workers', type=int, default=None, help='Decoding processes (default: all cores)')
+    parser.add_argument('--overwrite', action='store_true', help='Discard existing output and score everything')
+    args = parser.parse_args()
+    
+    print("\n" + "="*60)
+    print("BULK SCORING")
+    print("="*60)
+    
+    if args.images is None:
+        args.images = ISIC2018_TEST_IMAGES
+        if args.ground_truth is None and ISIC2018_GROUND_TRUTH.exists():
+            args.ground_truth = ISIC2018_GROUND_TRUTH
+    if not Path(args.images).is_dir():
+        raise SystemExit(f"Image directory not found: {args.images}")
+    if args.output is None:
+        args.output = str(default_output(args.images))
+    if not os.path.exists(args.model):
+        # SkinDiseasePredictor would fall back to an ImageNet model, which is meaningless here
+        raise SystemExit(f"Model not found: {args.model}")
+    
+    inputs = scoring_inputs(args.images, args.ground_truth)
+    labelled = 'label' in inputs.columns
+    print(f"Images: {len(inputs)} under {args.images}" + (f", labels from {args.ground_truth}" if labelled else ""))
+    
+    predictor = SkinDiseasePredictor(args.model)
+    version = model_version(args.model)
+    num_classes = int(predictor.model.output_shape[-1])
+    class_names = [str(predictor.class_labels.get(c, c)) for c in range(num_classes)]
+    img_size = predictor.model.input_shape[1] or 224
+    
+    if args.overwrite:
+        remove_output(args.output)
+    try:
+        writer = ScoreWriter(args.output, output_columns(class_names, labelled))
+    except ImportError as e:
+        raise SystemExit(str(e))
+    except ValueError as e:
+        # Columns differ, e.g. a labelled run resumed without --ground-truth
+        raise SystemExit(f"{e}; use --overwrite or another --output")
+    existing = writer.read()
+    other_versions = set(existing['model_version'].dropna()) - {version}
+    if other_versions:
+        raise SystemExit(f"{args.output} holds scores from model version(s) {sorted(other_versions)}, "
+                         f"not {version}; use --overwrite or another --output")
+    
+    pending = inputs[~inputs['image_id'].isin(set(existing['image_id']))].reset_index(drop=True)
+    print(f"Model {args.model} (version {version}, {img_size}px, {num_classes} classes)")
+    print(f"Already scored: {len(inputs) - len(pending)}, to score: {len(pending)}")
+    
+    start = time.perf_counter()
+    scored = failed = 0
+    batches = decoded_batches(pending['path'].tolist(), img_size, args.batch_size, args.workers)
+    for n, (positions, images, errors) in enumerate(batches, 1):
+        rows = []
+        if len(positions):
+            rows.append(score_rows(pending.iloc[positions], predictor.predict_batch(images), class_names, version))
+        if errors:
+            error_positions, messages = zip(*errors)
+            rows.append(error_rows(pending.iloc[list(error_positions)], messages, version))
+        writer.append(pd.concat(rows, ignore_index=True))
+        scored += len(positions)
+        failed += len(errors)
+        
+        if n % LOG_EVERY == 0:
+            elapsed = time.perf_counter() - start
+            print(f"  {scored + failed}/{len(pending)} images, {scored / elapsed:.1f} images/s")
+    
+    elapsed = time.perf_counter() - start
+    if pending.empty:
+        print("Nothing to score")
+    else:
+        print(f"Scored {scored} images in {elapsed:.1f}s ({scored / max(elapsed, 1e-9):.1f} images/s); "
+              f"{failed} could not be read")
+    print(f"Results: {args.output}")
+    
+    if not labelled:
+        return
+    scores = writer.read()
+    metrics = scored_metrics(scores[scores['image_id'].isin(set(inputs['image_id']))], class_names)
+    if metrics is None:
+        print("No labels match the model's classes; no metrics")
+        return
+    
+    print(f"\nMetrics over {metrics['samples']} labelled images"
+          + (f" ({metrics['unmatched_labels']} with labels outside the model's classes left out)"
+             if metrics['unmatched_labels'] else ""))
+    print(format_metrics(metrics, class_names=class_names))
+    with open(metrics_path(args.output), 'w') as f:
+        json.dump({'model': args.model, 'model_version': version, 'class_names': class_names, **metrics}, f, indent=2)
+    print(f"Metrics: {metrics_path(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
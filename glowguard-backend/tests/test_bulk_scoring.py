@@ -0,0 +1,63 @@
+"""ScoreWriter: resumable, schema-checked scoring output"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils.bulk_scoring import ScoreWriter, error_rows, output_columns, score_rows, scored_metrics
+
+CLASSES = ['mel', 'nv']
+
+
+def scored(ids, labels=None):
+    frame = pd.DataFrame({'image_id': ids, 'path': [f"/x/{i}.jpg" for i in ids]})
+    if labels is not None:
+        frame['label'] = labels
+    probabilities = np.tile(np.array([[0.2, 0.8]], dtype=np.float32), (len(ids), 1))
+    return score_rows(frame, probabilities, CLASSES, 'v1')
+
+
+def test_resume_reads_back_every_row(tmp_path):
+    path = tmp_path / "scores.csv"
+    writer = ScoreWriter(path, output_columns(CLASSES, labelled=False))
+    writer.append(scored(['a', 'b']))
+    
+    resumed = ScoreWriter(path, output_columns(CLASSES, labelled=False))
+    resumed.append(error_rows(pd.DataFrame({'image_id': ['NA'], 'path': ['/x/NA.jpg']}), ["unreadable"], 'v1'))
+    rows = resumed.read()
+    
+    assert list(rows['image_id']) == ['a', 'b', 'NA']
+    assert list(rows['predicted'].fillna('')) == ['nv', 'nv', '']
+    assert rows['error'].fillna('').tolist() == ['', '', 'unreadable']
+
+
+def test_partial_last_line_is_dropped(tmp_path):
+    path = tmp_path / "scores.csv"
+    writer = ScoreWriter(path, output_columns(CLASSES, labelled=False))
+    writer.append(scored(['a', 'b']))
+    with open(path, 'ab') as f:
+        f.write(b"c,/x/c.jpg,nv,0.8")
+    
+    resumed = ScoreWriter(path, output_columns(CLASSES, labelled=False))
+    assert list(resumed.read()['image_id']) == ['a', 'b']
+
+
+def test_resume_with_other_columns_is_refused(tmp_path):
+    path = tmp_path / "scores.csv"
+    ScoreWriter(path, output_columns(CLASSES, labelled=True)).append(scored(['a'], ['mel']))
+    
+    with pytest.raises(ValueError):
+        ScoreWriter(path, output_columns(CLASSES, labelled=False))
+
+
+def test_metrics_skip_errors_and_unknown_labels(tmp_path):
+    rows = pd.concat([
+        scored(['a', 'b', 'c'], ['nv', 'MEL', 'bcc']),
+        error_rows(pd.DataFrame({'image_id': ['d'], 'path': ['/x/d.jpg'], 'label': ['nv']}), ["bad"], 'v1'),
+    ], ignore_index=True)
+    writer = ScoreWriter(tmp_path / "scores.csv", output_columns(CLASSES, labelled=True))
+    writer.append(rows)
+    
+    metrics = scored_metrics(writer.read(), CLASSES)
+    assert metrics['samples'] == 2
+    assert metrics['unmatched_labels'] == 1
+    assert metrics['accuracy'] == pytest.approx(0.5)
@@ -0,0 +1,59 @@
+"""Near-duplicate pairs, clusters and the lesion-grouped manifest split"""
+import numpy as np
+import pandas as pd
+
+from app.utils.dedup import (
+    DisjointSet, cluster_duplicates, grouped_split, manifest_split, near_duplicate_pairs, popcount64,
+    split_groups
+)
+
+
+def test_popcount_matches_bit_strings():
+    values = np.array([0, 1, 0xFF, 0x8000000000000001, 2**64 - 1], dtype=np.uint64)
+    expected = [bin(int(v)).count('1') for v in values]
+    assert popcount64(values).tolist() == expected
+    assert popcount64(values.reshape(5, 1)).shape == (5, 1)
+
+
+def test_near_duplicate_pairs_across_blocks(monkeypatch):
+    monkeypatch.setattr('app.utils.dedup.PAIR_BLOCK_SIZE', 2)
+    base = 0x0123456789ABCDEF
+    hashes = np.array([base, base ^ 0b111, base ^ (2**64 - 1), 0, base ^ (1 << 63)], dtype=np.uint64)
+    pairs = near_duplicate_pairs(hashes, threshold=3)
+    assert sorted(map(tuple, pairs.tolist())) == [(0, 1), (0, 4)]
+
+
+def test_disjoint_set_labels_components():
+    components = DisjointSet(6)
+    components.union(0, 3)
+    components.union(3, 5)
+    components.union(1, 2)
+    assert components.labels().tolist() == [0, 1, 1, 0, 2, 0]
+
+
+def test_clusters_join_lesions_into_groups():
+    clusters = cluster_duplicates(np.array([[0, 2]]), 4)
+    groups = split_groups(clusters, np.array(['L1', 'L2', 'L3', 'L2']))
+    # 0 and 2 are duplicates; 1 and 3 share a lesion
+    assert groups[0] == groups[2] and groups[1] == groups[3] and groups[0] != groups[1]
+
+
+def test_grouped_split_keeps_groups_whole():
+    groups = np.repeat(np.arange(40), 3)
+    labels = (groups % 2).astype(np.int64)
+    val = grouped_split(labels, groups, validation_split=0.25, seed=1)
+    for group in np.unique(groups):
+        assert len(set(val[groups == group])) == 1
+    assert 0 < val.sum() < len(val)
+    assert set(labels[val]) == {0, 1}
+
+
+def test_manifest_split_trains_on_representatives():
+    manifest = pd.DataFrame({
+        'split': ['train', 'train', 'val', 'val', 'train'],
+        'keep': [True, False, True, False, True],
+    }, index=pd.Index(['a', 'b', 'c', 'd', 'e'], name='image_id'))
+    train, val = manifest_split(manifest, ['e', 'd', 'new', 'b', 'a', 'c'])
+    # Positions into the requested ids; 'new' is in neither split
+    assert train.tolist() == [0, 4]
+    assert val.tolist() == [1, 5]
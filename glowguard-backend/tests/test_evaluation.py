@@ -0,0 +1,53 @@
+"""StreamingEvaluator: batched metrics against whole-set reference values"""
+import numpy as np
+import pytest
+from sklearn.metrics import confusion_matrix, f1_score, log_loss, roc_auc_score
+
+from app.utils.evaluation import StreamingEvaluator
+
+NUM_CLASSES = 3
+
+
+@pytest.fixture
+def predictions():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, NUM_CLASSES, size=500)
+    logits = rng.normal(size=(500, NUM_CLASSES)) + 1.5 * np.eye(NUM_CLASSES)[labels]
+    probabilities = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    return labels, probabilities.astype(np.float32)
+
+
+def test_batches_match_whole_set_metrics(predictions):
+    labels, probabilities = predictions
+    evaluator = StreamingEvaluator(NUM_CLASSES, auc_bins=10000)
+    for start in range(0, len(labels), 64):
+        evaluator.update(labels[start:start + 64], probabilities[start:start + 64])
+    result = evaluator.result()
+    
+    predicted = probabilities.argmax(axis=1)
+    assert result['samples'] == len(labels)
+    assert result['confusion_matrix'] == confusion_matrix(labels, predicted).tolist()
+    assert result['loss'] == pytest.approx(log_loss(labels, probabilities), rel=1e-4)
+    np.testing.assert_allclose(result['f1'], f1_score(labels, predicted, average=None), atol=1e-9)
+    expected_auc = [roc_auc_score(labels == c, probabilities[:, c]) for c in range(NUM_CLASSES)]
+    np.testing.assert_allclose(result['auc'], expected_auc, atol=1e-3)
+
+
+def test_one_hot_labels_and_stored_predictions_round_trip(predictions, tmp_path):
+    labels, probabilities = predictions
+    evaluator = StreamingEvaluator(NUM_CLASSES)
+    evaluator.update(np.eye(NUM_CLASSES)[labels], probabilities)
+    evaluator.save(tmp_path / "predictions.npz")
+    
+    loaded = StreamingEvaluator.load(tmp_path / "predictions.npz")
+    assert loaded.result() == evaluator.result()
+    np.testing.assert_array_equal(loaded.labels, labels)
+
+
+def test_bootstrap_intervals_bracket_the_point_estimate(predictions):
+    labels, probabilities = predictions
+    intervals = StreamingEvaluator.from_predictions(labels, probabilities).bootstrap(samples=300)
+    for metric in ('precision', 'recall', 'f1'):
+        value, low, high = (np.array(intervals[metric][key]) for key in ('value', 'low', 'high'))
+        assert np.all(low <= value) and np.all(value <= high) and np.all(low < high)
+    assert intervals['samples'] == 300
@@ -0,0 +1,42 @@
+"""ResultsStore: resuming and ranking trials within one setup"""
+import json
+import sqlite3
+
+from app.utils.experiments import ResultsStore, config_key, trial_setup
+
+CONFIG = {'dense_units': [256], 'dropout': 0.3, 'learning_rate': 1e-3, 'class_weight': None}
+
+
+def result(balanced, config=CONFIG):
+    return {'config': config, 'folds': [{'fold': 0}], 'mean_accuracy': balanced, 'std_accuracy': 0.0,
+            'mean_balanced_accuracy': balanced, 'std_balanced_accuracy': 0.0, 'seconds': 1.0}
+
+
+def test_resume_and_ranking_stay_within_a_setup(tmp_path):
+    store = ResultsStore(tmp_path / "experiments.db")
+    old = trial_setup(tmp_path / "resnet50_aaaa", views=4, k=5)
+    new = trial_setup(tmp_path / "resnet50_bbbb", views=4, k=5)
+    store.add('sweep', result(0.9), old)
+    
+    assert store.completed('sweep', old) == {config_key(CONFIG)}
+    assert store.completed('sweep', new) == set()
+    assert store.completed('sweep', {**old, 'views': 2}) == set()
+    
+    other = {**CONFIG, 'dropout': 0.5}
+    store.add('sweep', result(0.7, other), new)
+    # The better score of the old feature cache is not mixed in
+    best = store.export_best('sweep', tmp_path / "best.json")
+    assert best['config'] == other and best['setup'] == new
+    assert json.loads((tmp_path / "best.json").read_text())['mean_balanced_accuracy'] == 0.7
+    assert store.leaderboard('sweep', setup=old)[0]['mean_balanced_accuracy'] == 0.9
+
+
+def test_trials_without_setup_are_set_aside(tmp_path):
+    path = tmp_path / "experiments.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE trials (id INTEGER PRIMARY KEY, experiment TEXT, config TEXT, folds INTEGER)")
+        conn.execute("INSERT INTO trials (experiment, config, folds) VALUES ('sweep', ?, 5)", (config_key(CONFIG),))
+    
+    store = ResultsStore(path)
+    assert store.completed('sweep', trial_setup(tmp_path / "resnet50_aaaa", 4, 5)) == set()
+    assert store.leaderboard('sweep') == []
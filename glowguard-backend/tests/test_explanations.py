@@ -0,0 +1,74 @@
+"""Grad-CAM maps and the background ExplanationWorker"""
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from app.utils import explanations
+from app.utils.explanations import (
+    ExplanationWorker, compute_cams, explanation_path, gradcam_model, save_model_input
+)
+from app.utils.feature_cache import assemble_model, build_head
+
+SIZE = 32
+
+
+def tiny_model(precision='float32'):
+    tf.keras.mixed_precision.set_global_policy(precision)
+    try:
+        inputs = tf.keras.Input((SIZE, SIZE, 3))
+        features = tf.keras.layers.Conv2D(8, 3, activation='relu')(inputs)
+        return assemble_model(tf.keras.Model(inputs, features), build_head(8, 3, dense_units=(4,)))
+    finally:
+        tf.keras.mixed_precision.set_global_policy('float32')
+
+
+def prepare(pixels):
+    return pixels.astype(np.float32) / 255.0
+
+
+@pytest.mark.parametrize('precision', ['float32', 'mixed_float16', 'mixed_bfloat16'])
+@pytest.mark.parametrize('method', ['gradcam', 'gradcam++'])
+def test_maps_are_normalized_for_every_precision(precision, method):
+    images = np.random.default_rng(0).random((2, SIZE, SIZE, 3), dtype=np.float32)
+    cams = compute_cams(gradcam_model(tiny_model(precision)), images, [None, 1], method)
+    
+    assert cams.shape == (2, SIZE - 2, SIZE - 2)
+    assert np.isfinite(cams).all()
+    assert cams.min() >= 0 and cams.max() <= 1
+
+
+def test_worker_writes_cached_png(tmp_path):
+    image_path = str(tmp_path / "upload.jpg")
+    save_model_input(image_path, np.random.default_rng(0).integers(0, 255, (SIZE, SIZE, 3), dtype=np.uint8))
+    worker = ExplanationWorker(tiny_model(), prepare, 'v1')
+    
+    assert worker.request(image_path, 'gradcam') == 'pending'
+    assert worker.wait(image_path, 'gradcam', timeout=30)
+    assert explanation_path(image_path, 'gradcam', 'v1').read_bytes().startswith(b"\x89PNG")
+    assert worker.request(image_path, 'gradcam') == 'ready'
+    # Another class, or another model, is not served the cached heatmap
+    assert worker.request(image_path, 'gradcam', 2) == 'pending'
+    assert ExplanationWorker(tiny_model(), prepare, 'v2').request(image_path, 'gradcam') == 'pending'
+
+
+def test_heatmap_names_carry_model_version_and_class():
+    names = {explanation_path("/u/a.jpg", method, version, class_idx).name
+             for method in ('gradcam', 'gradcam++') for version in ('v1', 'v2') for class_idx in (None, 0, 1)}
+    assert len(names) == 12
+
+
+def test_failures_expire_and_are_retried(tmp_path, monkeypatch):
+    image_path = str(tmp_path / "missing.jpg")
+    worker = ExplanationWorker(tiny_model(), prepare)
+    
+    worker.request(image_path, 'gradcam')
+    assert not worker.wait(image_path, 'gradcam', timeout=30)
+    assert worker.error(image_path, 'gradcam')
+    assert worker.request(image_path, 'gradcam') == 'failed'
+    
+    # The image turns up (e.g. a transient I/O error) and the failure expires
+    save_model_input(image_path, np.zeros((SIZE, SIZE, 3), dtype=np.uint8))
+    monkeypatch.setattr(explanations, 'ERROR_RETRY_SECONDS', 0.0)
+    assert worker.error(image_path, 'gradcam') is None
+    assert worker.request(image_path, 'gradcam') == 'pending'
+    assert worker.wait(image_path, 'gradcam', timeout=30)
@@ -0,0 +1,32 @@
+"""build_dataset: unreadable files are skipped instead of failing the epoch"""
+import numpy as np
+import pytest
+import tensorflow as tf
+from PIL import Image
+
+from app.utils.input_pipeline import build_dataset
+
+SIZE = 16
+
+
+@pytest.fixture
+def paths(tmp_path):
+    for name in ('a', 'c'):
+        Image.fromarray(np.full((24, 24, 3), 100, dtype=np.uint8)).save(tmp_path / f"{name}.jpg")
+    (tmp_path / "b.jpg").write_bytes(b"not a jpeg")
+    return [str(tmp_path / f"{name}.jpg") for name in ('a', 'b', 'c')]
+
+
+@pytest.mark.parametrize('training', [True, False])
+def test_unreadable_image_is_dropped(paths, training):
+    dataset = build_dataset(paths, [0, 1, 2], img_size=SIZE, batch_size=1, training=training,
+                            enhance=False, crop_lesion=False)
+    labels = sorted(int(y[0]) for _, y in dataset)
+    assert labels == [0, 2]
+
+
+def test_aligned_pipelines_still_fail(paths):
+    dataset = build_dataset(paths, [0, 1, 2], img_size=SIZE, batch_size=3, enhance=False, crop_lesion=False,
+                            skip_unreadable=False)
+    with pytest.raises(tf.errors.InvalidArgumentError):
+        next(iter(dataset))
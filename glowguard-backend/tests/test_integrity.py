@@ -0,0 +1,49 @@
+"""scan_dataset: incremental integrity manifest"""
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+import app.utils.integrity as integrity
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """HAM10000 tree with a labelled, an unlabeled and a corrupt image; no ISIC2018 at all"""
+    images = tmp_path / "ham" / "images"
+    images.mkdir(parents=True)
+    for image_id in ('labelled', 'extra'):
+        Image.fromarray(np.full((80, 96, 3), 128, dtype=np.uint8)).save(images / f"{image_id}.jpg")
+    (images / "broken.jpg").write_bytes(b"not a jpeg")
+    metadata = tmp_path / "ham" / "metadata.csv"
+    pd.DataFrame({'image_id': ['labelled', 'broken', 'gone'], 'dx': ['nv', 'mel', 'bkl']}).to_csv(metadata, index=False)
+    
+    monkeypatch.setattr(integrity, 'HAM10000_METADATA', metadata)
+    monkeypatch.setattr(integrity, 'HAM10000_IMAGES_PART1', images)
+    monkeypatch.setattr(integrity, 'HAM10000_IMAGES_PART2', tmp_path / "none")
+    monkeypatch.setattr(integrity, 'ISIC2018_GROUND_TRUTH', tmp_path / "isic" / "truth.csv")
+    monkeypatch.setattr(integrity, 'ISIC2018_TEST_IMAGES', tmp_path / "isic" / "images")
+    return tmp_path / "manifest.csv"
+
+
+def statuses(manifest):
+    return dict(zip(manifest['image_id'], manifest['status']))
+
+
+def test_scan_without_second_source(dataset):
+    manifest = integrity.scan_dataset(dataset, workers=1)
+    assert statuses(manifest) == {'labelled': 'ok', 'extra': 'unlabeled', 'broken': 'corrupt', 'gone': 'missing'}
+    assert set(manifest['source']) == {'HAM10000'}
+
+
+def test_rescan_reuses_every_unchanged_file(dataset, monkeypatch):
+    first = integrity.scan_dataset(dataset, workers=1)
+    
+    def fail(paths):
+        raise AssertionError(f"re-checked {paths}")
+    
+    monkeypatch.setattr(integrity, 'ProcessPoolExecutor', None)
+    monkeypatch.setattr(integrity, '_check_chunk', fail)
+    second = integrity.scan_dataset(dataset, workers=1)
+    assert statuses(second) == statuses(first)
+    assert second['checksum'].tolist() == first['checksum'].tolist()
@@ -0,0 +1,34 @@
+"""layer_hotspots on an assembled model and the JSON report writer"""
+import json
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from app.utils.feature_cache import assemble_model, build_head
+from app.utils.profiling import layer_hotspots, save_report
+
+
+def assembled_model():
+    """Backbone plus the nested Sequential head, as assemble_model serves it"""
+    inputs = tf.keras.Input((16, 16, 3))
+    features = tf.keras.layers.Conv2D(4, 3, activation='relu')(inputs)
+    features = tf.keras.layers.Conv2D(8, 3, activation='relu')(features)
+    return assemble_model(tf.keras.Model(inputs, features), build_head(8, 3, dense_units=(4,)))
+
+
+def test_hotspots_cover_every_layer_of_an_assembled_model():
+    model = assembled_model()
+    batch = np.random.default_rng(0).random((2, 16, 16, 3), dtype=np.float32)
+    report = layer_hotspots(model, batch, repeats=1, top=10)
+    
+    timed = {row['layer'] for row in report['layers']}
+    assert timed == {layer.name for layer in model.layers if not isinstance(layer, tf.keras.layers.InputLayer)}
+    assert model.layers[-1].name == 'head'
+    assert sum(row['share'] for row in report['layers']) == pytest.approx(1.0)
+
+
+def test_report_directory_is_created(tmp_path):
+    path = tmp_path / "reports" / "profile.json"
+    save_report({'images_per_sec': 1.0}, path)
+    assert json.loads(path.read_text()) == {'images_per_sec': 1.0}
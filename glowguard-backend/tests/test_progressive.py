@@ -0,0 +1,50 @@
+"""Progressive resizing: early stopping and LR reduction across phase boundaries"""
+import numpy as np
+import tensorflow as tf
+
+from app.utils.progressive import ScheduleEarlyStopping, ScheduleReduceLROnPlateau
+
+
+def run_phases(callbacks, phases=(2, 2, 2)):
+    """fit() once per phase, the way train_progressive does; returns the model and epochs run"""
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2, activation='softmax')])
+    model.compile(optimizer=tf.keras.optimizers.SGD(0.5), loss='sparse_categorical_crossentropy')
+    x = np.random.default_rng(0).normal(size=(32, 4)).astype(np.float32)
+    y = np.zeros(32, dtype=np.int64)
+    # Validation on the opposite labels: val_loss gets worse every epoch
+    validation = (x, np.ones(32, dtype=np.int64))
+    epoch = 0
+    for epochs in phases:
+        history = model.fit(x, y, validation_data=validation, initial_epoch=epoch, epochs=epoch + epochs,
+                            callbacks=callbacks, verbose=0)
+        epoch += len(history.history['loss'])
+        if callbacks[0].stopped_epoch > 0:
+            break
+    return model, epoch
+
+
+def test_patience_counts_across_phases():
+    stopper = ScheduleEarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)
+    model, epochs = run_phases([stopper])
+    # Best at the first epoch, three epochs without improvement: stops in the second phase
+    assert epochs == 4
+    assert stopper.stopped_epoch == 3
+    assert stopper.best_epoch == 0
+    
+    assert stopper.restore_best()
+    for best, current in zip(stopper.best_weights, model.get_weights()):
+        np.testing.assert_array_equal(best, current)
+
+
+def test_plain_early_stopping_restarts_every_phase():
+    stopper = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=3)
+    _, epochs = run_phases([stopper])
+    assert epochs == 6
+
+
+def test_lr_reduction_counts_across_phases():
+    stopper = ScheduleEarlyStopping(monitor='val_loss', patience=10)
+    reduce_lr = ScheduleReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=3)
+    model, _ = run_phases([stopper, reduce_lr])
+    assert np.isclose(float(model.optimizer.learning_rate.numpy()), 0.05)
@@ -0,0 +1,53 @@
+"""rescore_predictions.apply_results: diagnosis, recommendations and heatmaps change together"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, Prediction, Recommendation
+from app.utils.explanations import explanation_path
+from app.utils.recommendations import RecommendationEngine
+from rescore_predictions import apply_results
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def stored_prediction(db, tmp_path, name, disease):
+    image_path = tmp_path / f"{name}.jpg"
+    image_path.write_bytes(b"")
+    prediction = Prediction(image_path=str(image_path), disease_name=disease, confidence=0.5, model_version='old')
+    db.add(prediction)
+    db.flush()
+    db.add(Recommendation(prediction_id=prediction.id, category="remedies", content=f"old {disease} remedy"))
+    for method in ('gradcam', 'gradcam++'):
+        explanation_path(str(image_path), method, 'old', 0).write_bytes(b"png")
+    db.commit()
+    return prediction
+
+
+def result(prediction, new_disease, confidence=0.9):
+    return {'id': prediction.id, 'image_path': prediction.image_path, 'old_disease': prediction.disease_name,
+            'old_confidence': prediction.confidence, 'new_disease': new_disease, 'new_confidence': confidence}
+
+
+def test_changed_diagnosis_replaces_recommendations_and_heatmaps(db, tmp_path):
+    changed = stored_prediction(db, tmp_path, 'changed', 'Acne')
+    same = stored_prediction(db, tmp_path, 'same', 'Acne')
+    apply_results(db, [result(changed, 'Eczema'), result(same, 'Acne')], {'model_version': 'new'})
+    
+    assert db.get(Prediction, changed.id).disease_name == 'Eczema'
+    assert db.get(Prediction, same.id).model_version == 'new'
+    
+    contents = [r.content for r in db.query(Recommendation).filter(Recommendation.prediction_id == changed.id)]
+    assert contents == RecommendationEngine.get_remedies('Eczema') + RecommendationEngine.get_precautions('Eczema')
+    kept = [r.content for r in db.query(Recommendation).filter(Recommendation.prediction_id == same.id)]
+    assert kept == ["old Acne remedy"]
+    
+    # Every re-scored heatmap came from the old head
+    assert not list(tmp_path.glob("*.png"))
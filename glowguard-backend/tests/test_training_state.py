@@ -0,0 +1,35 @@
+"""CheckpointManager: full-state save and restore"""
+import numpy as np
+import tensorflow as tf
+
+from app.utils.training_state import CheckpointManager, TrainingState
+
+
+def compiled_model():
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(3, activation='softmax')])
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-3), loss='sparse_categorical_crossentropy')
+    return model
+
+
+def test_restore_brings_back_weights_optimizer_and_learning_rate(tmp_path):
+    model = compiled_model()
+    model.train_on_batch(np.ones((2, 4), dtype=np.float32), np.zeros(2))
+    state = TrainingState(learning_rate=1e-3)
+    state.step, state.learning_rate = 7, 2.5e-4
+    model.optimizer.learning_rate.assign(state.learning_rate)
+    manager = CheckpointManager(tmp_path)
+    manager.save(model, state)
+    manager.close()
+    
+    restored = compiled_model()
+    resumed = CheckpointManager(tmp_path).restore(restored)
+    
+    assert resumed.step == 7
+    assert np.isclose(float(restored.optimizer.learning_rate.numpy()), 2.5e-4)
+    assert int(restored.optimizer.iterations.numpy()) == 1
+    for saved, loaded in zip(model.get_weights(), restored.get_weights()):
+        np.testing.assert_array_equal(saved, loaded)
+
+
+def test_restore_without_checkpoint_is_none(tmp_path):
+    assert CheckpointManager(tmp_path).restore(compiled_model()) is None
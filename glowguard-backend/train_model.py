@@ -5,6 +5,7 @@ Trains on HAM10000 and ISIC2018 datasets
 
 import os
 import sys
+import argparse
 import numpy as np
 import pandas as pd
 from pathlib import Path
@@ -12,23 +13,53 @@ import matplotlib.pyplot as plt
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import EfficientNetB3
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
-from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCheckpoint
 import json
+import time
 import warnings
+from types import SimpleNamespace
 warnings.filterwarnings('ignore')
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app.utils.data_loader import (
-    HAM10000_IMAGES_PART1, HAM10000_IMAGES_PART2, HAM10000_METADATA,
-    ISIC2018_TEST_IMAGES, ISIC2018_GROUND_TRUTH
+from app.utils.augmentation import BatchAugmenter
+from app.utils.data_loader import DatasetCatalog
+from app.utils.dedup import DEDUP_MANIFEST, grouped_split, load_manifest as load_dedup_manifest, manifest_split
+from app.utils.distillation import (
+    STUDENT_BACKBONES, build_distillation_report, build_student, distillation_loss,
+    format_distillation_report, label_accuracy, measure_latency, model_summary, pack_targets,
+    teacher_agreement, teacher_log_probabilities
 )
+from app.utils.distributed import (
+    all_reduce_sum, available_cores, create_strategy, distributed_evaluate, distributed_train_step,
+    is_chief, launch_workers, worker_info
+)
+from app.utils.evaluation import StreamingEvaluator, evaluate_dataset, format_metrics
+from app.utils.experiments import BEST_CONFIG_PATH, class_weights
+from app.utils.feature_cache import (
+    assemble_model, build_head, feature_cache_dir, load_or_extract_features, pooled_feature_extractor,
+    stack_views
+)
+from app.utils.image_processing import enhancement_key, load_image, MEDICAL_PREPROCESSING, LESION_CROP
+from app.utils.input_pipeline import (
+    build_dataset, build_epoch_dataset, build_shard_dataset, image_data_generator_augment_fn,
+    measure_throughput, ThroughputCallback
+)
+from app.utils.model_comparison import model_version
+from app.utils.profiling import (
+    build_report, format_report, layer_hotspots, profile_training_steps, save_report, time_batch_fn,
+    time_image_stages, time_shard_reads, time_train_step, time_transfer
+)
+from app.utils.progressive import (
+    EpochTimer, ScheduleEarlyStopping, ScheduleReduceLROnPlateau, format_schedule, parse_schedule
+)
+from app.utils.sampling import ClassBalancedSampler, SamplerReportCallback
+from app.utils.shards import ShardedDataset, catalog_hash
+from app.utils.training_state import CheckpointManager, TrainingState
 
 # Configuration
 IMG_SIZE = 224
@@ -36,6 +67,44 @@ BATCH_SIZE = 32
 EPOCHS = 10
 VALIDATION_SPLIT = 0.2
 RANDOM_STATE = 42
+# CLAHE + bilateral enhancement; must match the serving setting (MEDICAL_PREPROCESSING env var)
+ENHANCE_IMAGES = MEDICAL_PREPROCESSING
+# Crop to the lesion ROI before resizing; must match serving (LESION_CROP env var)
+CROP_LESIONS = LESION_CROP
+# On-disk cache of decoded uint8 images for the streaming pipeline
+CACHE_DIR = 'ml_models/cache'
+# Head-only training on cached backbone features (--feature-cache)
+FEATURE_VIEWS = 4
+FEATURE_HEAD_EPOCHS = 50
+# Full training-state checkpoints for resumable runs (--checkpoint-dir)
+CHECKPOINT_DIR = 'ml_models/checkpoints'
+CHECKPOINT_EVERY = 200
+# Profiling mode (--profile): images timed per stage and report location
+PROFILE_SAMPLES = 64
+PROFILE_REPORT = 'ml_models/training_profile.json'
+# Validation labels and probabilities from the last evaluate(), for re-scoring without the model
+EVAL_PREDICTIONS = 'ml_models/validation_predictions.npz'
+# Keras dtype policies for --precision; mixed_float16 adds dynamic loss scaling
+PRECISION_POLICIES = ('float32', 'mixed_bfloat16', 'mixed_float16')
+# Knowledge distillation (--distill TEACHER): student backbone, loss and outputs
+DISTILL_STUDENT = 'mobilenet_v2'
+DISTILL_TEMPERATURE = 4.0
+DISTILL_ALPHA = 0.3
+DISTILL_LEARNING_RATE = 1e-4
+STUDENT_MODEL_PATH = 'ml_models/student_model.h5'
+DISTILL_REPORT = 'ml_models/distillation_report.json'
+# Data-parallel workers (--workers): logs of workers other than the chief, and
+# per-worker-count throughput from --benchmark-distributed
+DISTRIBUTED_LOG_DIR = 'ml_models/distributed_logs'
+DISTRIBUTED_SCALING_DIR = 'ml_models/distributed_scaling'
+# Progressive resizing (--progressive): size:batch_size:epochs:augmentation per
+# phase, ending at the served input size with about the same pixels per batch
+PROGRESSIVE_SCHEDULE = '128:96:3:0.5,160:64:3:0.75,224:32:4:1.0'
+# Same schedule as the EarlyStopping / ReduceLROnPlateau callbacks
+EARLY_STOPPING_PATIENCE = 5
+LR_PATIENCE = 3
+LR_FACTOR = 0.5
+MIN_LR = 1e-6
 
 # Disease labels mapping
 DISEASE_LABELS = {
@@ -51,54 +120,64 @@ DISEASE_LABELS = {
 class SkinDiseaseTrainer:
     """Trainer for skin disease classification models"""
     
-    def __init__(self):
+    def __init__(self, head_config=None, precision='float32', jit_compile=False):
         self.model = None
+        self.base_model = None
+        self.feature_dir = None
         self.history = None
         self.label_encoder = LabelEncoder()
         self.class_labels = {}
+        self.catalog = None
+        # ClassBalancedSampler for the training split (--balanced-sampling)
+        self.sampler = None
+        # dense_units / dropout / learning_rate / class_weight, e.g. from run_experiments.py --export
+        self.head_config = head_config or {}
+        # Dtype policy the model is built under, and XLA compilation of the train step
+        self.precision = precision
+        self.jit_compile = jit_compile
+    
+    def load_catalog(self):
+        """Indexed view of both datasets (cached on disk after the first run)"""
+        if self.catalog is None:
+            self.catalog = DatasetCatalog.build()
+        return self.catalog
+    
+    def _load_images(self, catalog):
+        """Decode every image listed in a catalog"""
+        images = []
+        labels = []
+        image_ids = []
         
+        for image_id, img_path, label in zip(catalog.frame.index, catalog.frame['path'], catalog.frame['dx']):
+            try:
+                # Load and resize image (same path as serving)
+                img = load_image(img_path, (IMG_SIZE, IMG_SIZE),
+                                 enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS)
+                img_array = img.astype('float32') / 255.0
+                
+                images.append(img_array)
+                labels.append(label)
+                image_ids.append(image_id)
+            except Exception as e:
+                print(f"Error loading {img_path}: {e}")
+        
+        return np.array(images), np.array(labels), image_ids
+    
     def load_ham10000_data(self):
         """Load HAM10000 dataset"""
         print("\n" + "="*60)
         print("Loading HAM10000 Dataset")
         print("="*60)
         
-        # Load metadata
-        metadata = pd.read_csv(HAM10000_METADATA)
-        print(f"Total HAM10000 records: {len(metadata)}")
+        catalog = self.load_catalog().subset('HAM10000')
+        print(f"HAM10000 images found: {len(catalog)}")
         print(f"\nDisease distribution:")
-        print(metadata['dx'].value_counts())
+        print(catalog.frame['dx'].value_counts())
         
-        images = []
-        labels = []
-        image_ids = []
-        
-        # Load images from both parts
-        for part_dir in [HAM10000_IMAGES_PART1, HAM10000_IMAGES_PART2]:
-            if not part_dir.exists():
-                print(f"Warning: {part_dir} not found")
-                continue
-                
-            for image_id in metadata['image_id']:
-                img_path = part_dir / f"{image_id}.jpg"
-                
-                if img_path.exists():
-                    try:
-                        # Load and resize image
-                        img = load_img(str(img_path), target_size=(IMG_SIZE, IMG_SIZE))
-                        img_array = img_to_array(img) / 255.0
-                        
-                        # Get label
-                        label = metadata[metadata['image_id'] == image_id]['dx'].values[0]
-                        
-                        images.append(img_array)
-                        labels.append(label)
-                        image_ids.append(image_id)
-                    except Exception as e:
-                        print(f"Error loading {img_path}: {e}")
+        images, labels, image_ids = self._load_images(catalog)
         
         print(f"\nSuccessfully loaded {len(images)} images")
-        return np.array(images), np.array(labels), image_ids
+        return images, labels, image_ids
     
     def load_isic2018_data(self):
         """Load ISIC2018 dataset"""
@@ -106,39 +185,17 @@ class SkinDiseaseTrainer:
         print("Loading ISIC2018 Dataset")
         print("="*60)
         
-        if not ISIC2018_TEST_IMAGES.exists() or not ISIC2018_GROUND_TRUTH.exists():
+        catalog = self.load_catalog().subset('ISIC2018')
+        if len(catalog) == 0:
             print("Warning: ISIC2018 dataset not found")
             return np.array([]), np.array([]), []
         
-        # Load ground truth
-        ground_truth = pd.read_csv(ISIC2018_GROUND_TRUTH)
-        print(f"Total ISIC2018 records: {len(ground_truth)}")
-        
-        images = []
-        labels = []
-        image_ids = []
+        print(f"ISIC2018 images found: {len(catalog)}")
         
-        # Load images
-        for idx, row in ground_truth.iterrows():
-            image_id = row.iloc[0]  # First column is image_id
-            img_path = ISIC2018_TEST_IMAGES / f"{image_id}.jpg"
-            
-            if img_path.exists():
-                try:
-                    img = load_img(str(img_path), target_size=(IMG_SIZE, IMG_SIZE))
-                    img_array = img_to_array(img) / 255.0
-                    
-                    # Get label from ground truth (find the column with value 1)
-                    label = row.idxmax() if len(row) > 1 else 'unknown'
-                    
-                    images.append(img_array)
-                    labels.append(label)
-                    image_ids.append(image_id)
-                except Exception as e:
-                    print(f"Error loading {img_path}: {e}")
+        images, labels, image_ids = self._load_images(catalog)
         
         print(f"Successfully loaded {len(images)} images")
-        return np.array(images), np.array(labels), image_ids
+        return images, labels, image_ids
     
     def prepare_data(self, X_ham, y_ham, X_isic=None, y_isic=None):
         """Prepare and encode labels"""
@@ -177,53 +234,233 @@ class SkinDiseaseTrainer:
         
         return X_train, X_val, y_train, y_val
     
-    def build_model(self, num_classes):
-        """Build transfer learning model"""
+    def prepare_datasets(self, cache='disk', use_shards=False, batch_augmentation=True, sampling_alpha=None,
+                         shard=None, dedup=False):
+        """
+        Streaming alternative to load_*_data + prepare_data
+        
+        Splits the catalog by file path and returns tf.data pipelines that decode,
+        cache and augment on the fly, so memory stays bounded by the shuffle
+        buffer instead of growing with the dataset.
+        
+        Args:
+            cache: 'disk' (decoded uint8 cache files under CACHE_DIR), 'memory' or 'none'
+            use_shards: Read memory-mapped shards from compile_dataset.py instead of JPEGs
+            batch_augmentation: Augment whole batches (BatchAugmenter) instead
+                of one image at a time with ImageDataGenerator
+            sampling_alpha: Draw training batches with a ClassBalancedSampler
+                (0 = balanced, 1 = natural frequencies) instead of shuffling
+            shard: (index, count) to keep only every count-th image of both
+                splits, for data-parallel workers (see train_distributed)
+            dedup: Use the lesion-grouped split of dedup_dataset.py, training
+                on one image per near-duplicate cluster
+        
+        Returns:
+            Tuple of (train_ds, val_ds, y_train, y_val)
+        """
+        print("\n" + "="*60)
+        print("Preparing Streaming Datasets")
+        print("="*60)
+        
+        # Same policy either way; get_augmentation defines it
+        if batch_augmentation:
+            augment_fn, batch_augment = None, self.get_batch_augmentation()
+        else:
+            augment_fn = image_data_generator_augment_fn(self.get_augmentation(), IMG_SIZE, seed=RANDOM_STATE)
+            batch_augment = None
+        
+        if use_shards:
+            shards = ShardedDataset.open(IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS)
+            self.class_labels = {i: label for i, label in enumerate(shards.classes)}
+            print(f"Compiled shards: {len(shards)} images from {shards.directory}")
+            print(f"Classes: {self.class_labels}")
+            
+            idx_train, idx_val = self._split(shards.index['image_id'], shards.labels, dedup)
+            y_train, y_val = shards.labels[idx_train], shards.labels[idx_val]
+            if shard is not None:
+                idx_train, idx_val, y_train, y_val = self._shard_split(shard, idx_train, idx_val, y_train, y_val)
+            print(f"\nTrain set: {len(idx_train)} images")
+            print(f"Validation set: {len(idx_val)} images")
+            
+            self.sampler = self._make_sampler(y_train, sampling_alpha)
+            train_ds = build_shard_dataset(shards, idx_train, batch_size=BATCH_SIZE, training=True,
+                                           augment_fn=augment_fn, seed=RANDOM_STATE,
+                                           batch_augment=batch_augment, sampler=self.sampler)
+            val_ds = build_shard_dataset(shards, idx_val, batch_size=BATCH_SIZE)
+            return train_ds, val_ds, y_train, y_val
+        
+        catalog = self.load_catalog()
+        paths, labels = catalog.paths, catalog.labels
+        self.class_labels = {i: label for i, label in enumerate(catalog.classes)}
+        
+        print(f"Catalog: {len(paths)} images")
+        print(f"Classes: {self.class_labels}")
+        
+        # Split data
+        train_pos, val_pos = self._split(catalog.frame.index, labels, dedup)
+        paths_train, paths_val = paths[train_pos], paths[val_pos]
+        y_train, y_val = labels[train_pos], labels[val_pos]
+        if shard is not None:
+            paths_train, paths_val, y_train, y_val = self._shard_split(shard, paths_train, paths_val, y_train, y_val)
+        
+        print(f"\nTrain set: {len(paths_train)} images")
+        print(f"Validation set: {len(paths_val)} images")
+        
+        train_cache = val_cache = None
+        if cache == 'memory':
+            train_cache = val_cache = 'memory'
+        elif cache == 'disk':
+            # Keyed by preprocessing and catalog (images, labels and so the split),
+            # so variants and an updated dataset do not share a cache
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tag = (f"{IMG_SIZE}_enh{enhancement_key(ENHANCE_IMAGES) or 0}_crop{int(CROP_LESIONS)}_seed{RANDOM_STATE}"
+                   f"_cat{catalog_hash(catalog)[:12]}")
+            if dedup:
+                # A rebuilt manifest splits differently, so it gets its own cache
+                tag += f"_dedup{model_version(DEDUP_MANIFEST)}"
+            if shard is not None:
+                # Workers cache their own shards; a shared cache file cannot be written concurrently
+                tag += f"_worker{shard[0]}of{shard[1]}"
+            train_cache = os.path.join(CACHE_DIR, f"train_{tag}")
+            val_cache = os.path.join(CACHE_DIR, f"val_{tag}")
+        
+        self.sampler = self._make_sampler(y_train, sampling_alpha)
+        if self.sampler is not None and train_cache:
+            # A cache replays one fixed order; sampled epochs decode on the fly (or use --shards)
+            print("Balanced sampling: training images are not cached")
+            train_cache = None
+        
+        train_ds = build_dataset(
+            paths_train, y_train, img_size=IMG_SIZE, batch_size=BATCH_SIZE, training=True,
+            augment_fn=augment_fn, cache=train_cache, seed=RANDOM_STATE,
+            enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS, batch_augment=batch_augment,
+            sampler=self.sampler
+        )
+        val_ds = build_dataset(
+            paths_val, y_val, img_size=IMG_SIZE, batch_size=BATCH_SIZE, cache=val_cache,
+            enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS
+        )
+        
+        return train_ds, val_ds, y_train, y_val
+    
+    @staticmethod
+    def _split(image_ids, labels, dedup=False):
+        """
+        Training and validation positions, the same for every training mode
+        
+        With dedup, the lesion-grouped split of the dedup_dataset.py manifest
+        (one training image per near-duplicate cluster); otherwise a
+        stratified random split.
+        
+        Returns:
+            Tuple of (train positions, val positions)
+        """
+        if dedup:
+            return manifest_split(load_dedup_manifest(), image_ids)
+        return train_test_split(np.arange(len(labels)), test_size=VALIDATION_SPLIT,
+                                random_state=RANDOM_STATE, stratify=labels)
+    
+    @staticmethod
+    def _shard_split(shard, train, val, y_train, y_val):
+        """Every count-th element of each split, starting at index"""
+        index, count = shard
+        print(f"Worker {index + 1}/{count}: one in every {count} images")
+        return train[index::count], val[index::count], y_train[index::count], y_val[index::count]
+    
+    def _make_sampler(self, y_train, sampling_alpha):
+        """ClassBalancedSampler over the training split, or None for plain shuffling"""
+        if sampling_alpha is None:
+            return None
+        sampler = ClassBalancedSampler(y_train, num_classes=len(self.class_labels),
+                                       alpha=sampling_alpha, seed=RANDOM_STATE)
+        print(f"\nClass-balanced sampling (alpha={sampling_alpha:g}), per-class probability:")
+        for c, p in enumerate(sampler.probabilities):
+            print(f"  {self.class_labels[c]}: {p:.1%} (natural {sampler.class_counts[c] / len(y_train):.1%})")
+        return sampler
+    
+    def prepare_resumable(self, use_shards=False, sampling_alpha=None, dedup=False):
+        """
+        Data for train_resumable: a per-index image reader for the training split
+        and a regular validation pipeline
+        
+        Uses the same split as prepare_datasets; sampling_alpha and dedup
+        work as there.
+        
+        Returns:
+            Tuple of (read_train, y_train, val_ds, y_val)
+        """
+        print("\n" + "="*60)
+        print("Preparing Resumable Datasets")
+        print("="*60)
+        
+        if use_shards:
+            shards = ShardedDataset.open(IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS)
+            self.class_labels = {i: label for i, label in enumerate(shards.classes)}
+            idx_train, idx_val = self._split(shards.index['image_id'], shards.labels, dedup)
+            y_train, y_val = shards.labels[idx_train], shards.labels[idx_val]
+            read_train = lambda i: shards.image(idx_train[i])
+            val_ds = build_shard_dataset(shards, idx_val, batch_size=BATCH_SIZE)
+        else:
+            catalog = self.load_catalog()
+            self.class_labels = {i: label for i, label in enumerate(catalog.classes)}
+            train_pos, val_pos = self._split(catalog.frame.index, catalog.labels, dedup)
+            paths_train, paths_val = catalog.paths[train_pos], catalog.paths[val_pos]
+            y_train, y_val = catalog.labels[train_pos], catalog.labels[val_pos]
+            read_train = lambda i: load_image(paths_train[i], (IMG_SIZE, IMG_SIZE),
+                                              enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS)
+            val_ds = build_dataset(paths_val, y_val, img_size=IMG_SIZE, batch_size=BATCH_SIZE,
+                                   enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS)
+        
+        print(f"Classes: {self.class_labels}")
+        print(f"\nTrain set: {len(y_train)} images")
+        print(f"Validation set: {len(y_val)} images")
+        
+        self.sampler = self._make_sampler(y_train, sampling_alpha)
+        
+        return read_train, y_train, val_ds, y_val
+    
+    def build_model(self, num_classes, img_size=IMG_SIZE):
+        """Build transfer learning model (img_size=None accepts any input size)"""
         print("\n" + "="*60)
         print("Building Model")
         print("="*60)
         
+        # Layers take the global policy when they are created
+        tf.keras.mixed_precision.set_global_policy(self.precision)
+        
         # Load pre-trained EfficientNetB3
         base_model = EfficientNetB3(
-            input_shape=(IMG_SIZE, IMG_SIZE, 3),
+            input_shape=(img_size, img_size, 3),
             include_top=False,
             weights='imagenet'
         )
         
         # Freeze base model layers
         base_model.trainable = False
+        self.base_model = base_model
         
         # Add custom layers
-        x = base_model.output
-        x = GlobalAveragePooling2D()(x)
-        x = Dense(256, activation='relu')(x)
-        x = Dropout(0.3)(x)
-        x = Dense(128, activation='relu')(x)
-        x = Dropout(0.2)(x)
-        output = Dense(num_classes, activation='softmax')(x)
-        
-        self.model = Model(inputs=base_model.input, outputs=output)
+        head = self.build_head(base_model.output_shape[-1], num_classes)
+        self.model = assemble_model(base_model, head)
         
         print(f"Model created with {num_classes} output classes")
+        if self.precision != 'float32' or self.jit_compile:
+            print(f"Precision: {self.precision}, XLA: {'on' if self.jit_compile else 'off'}")
         print(f"Total parameters: {self.model.count_params():,}")
         
         return self.model
     
-    def train(self, X_train, X_val, y_train, y_val):
-        """Train the model"""
-        print("\n" + "="*60)
-        print("Training Model")
-        print("="*60)
-        
-        # Compile model
-        self.model.compile(
-            optimizer=Adam(learning_rate=0.001),
-            loss='sparse_categorical_crossentropy',
-            metrics=['accuracy']
+    def build_head(self, feature_dim, num_classes):
+        """Classifier head on pooled backbone features"""
+        return build_head(
+            feature_dim, num_classes,
+            dense_units=self.head_config.get('dense_units', (256, 128)),
+            dropout=self.head_config.get('dropout', (0.3, 0.2))
         )
-        
-        # Data augmentation
-        train_datagen = ImageDataGenerator(
+    
+    def get_augmentation(self):
+        """Augmentation policy shared by the in-memory and streaming paths"""
+        return ImageDataGenerator(
             rotation_range=20,
             width_shift_range=0.2,
             height_shift_range=0.2,
@@ -231,50 +468,768 @@ class SkinDiseaseTrainer:
             zoom_range=0.2,
             fill_mode='nearest'
         )
-        
-        # Callbacks
+    
+    def get_batch_augmentation(self):
+        """get_augmentation's policy applied to whole batches in tf.data"""
+        return BatchAugmenter.from_image_data_generator(self.get_augmentation())
+    
+    def _compile(self, model=None):
+        # Under mixed_float16 Keras wraps the optimizer in a LossScaleOptimizer;
+        # bfloat16 has float32's exponent range and needs no loss scaling
+        (model or self.model).compile(
+            optimizer=Adam(learning_rate=self.head_config.get('learning_rate', 0.001)),
+            loss='sparse_categorical_crossentropy',
+            metrics=['accuracy'],
+            jit_compile=self.jit_compile
+        )
+    
+    def _callbacks(self, checkpoint=True, schedule=False):
+        """Early stopping, LR reduction and best checkpoint; schedule=True keeps their state across fit() calls"""
+        early_stopping, reduce_lr = (ScheduleEarlyStopping, ScheduleReduceLROnPlateau) if schedule \
+            else (EarlyStopping, ReduceLROnPlateau)
         callbacks = [
-            EarlyStopping(
+            early_stopping(
                 monitor='val_loss',
-                patience=5,
+                patience=EARLY_STOPPING_PATIENCE,
                 restore_best_weights=True,
                 verbose=1
             ),
-            ReduceLROnPlateau(
+            reduce_lr(
                 monitor='val_loss',
-                factor=0.5,
-                patience=3,
-                min_lr=1e-6,
+                factor=LR_FACTOR,
+                patience=LR_PATIENCE,
+                min_lr=MIN_LR,
                 verbose=1
-            ),
-            ModelCheckpoint(
+            )
+        ]
+        if checkpoint:
+            callbacks.append(ModelCheckpoint(
                 'ml_models/best_model.h5',
                 monitor='val_accuracy',
                 save_best_only=True,
                 verbose=1
-            )
-        ]
+            ))
+        return callbacks
+    
+    def train(self, X_train, X_val, y_train, y_val):
+        """Train the model"""
+        print("\n" + "="*60)
+        print("Training Model")
+        print("="*60)
+        
+        # Compile model
+        self._compile()
+        
+        # Data augmentation
+        train_datagen = self.get_augmentation()
         
         # Train
         self.history = self.model.fit(
             train_datagen.flow(X_train, y_train, batch_size=BATCH_SIZE),
             validation_data=(X_val, y_val),
             epochs=EPOCHS,
+            callbacks=self._callbacks(),
+            verbose=1
+        )
+        
+        print("\nTraining completed!")
+        
+        return self.history
+    
+    def train_streaming(self, train_ds, val_ds):
+        """Train the model from tf.data pipelines (see prepare_datasets)"""
+        print("\n" + "="*60)
+        print("Training Model (streaming)")
+        print("="*60)
+        
+        self._compile()
+        
+        throughput = ThroughputCallback(BATCH_SIZE)
+        callbacks = self._callbacks() + [throughput]
+        if self.sampler is not None:
+            callbacks.append(SamplerReportCallback(self.sampler, self.class_labels))
+        
+        self.history = self.model.fit(
+            train_ds,
+            validation_data=val_ds,
+            epochs=EPOCHS,
             callbacks=callbacks,
             verbose=1
         )
         
+        if throughput.epoch_images_per_sec:
+            print(f"\nMean training throughput: {np.mean(throughput.epoch_images_per_sec):.1f} images/sec")
         print("\nTraining completed!")
         
         return self.history
     
-    def evaluate(self, X_val, y_val):
-        """Evaluate model"""
+    def train_progressive(self, schedule=PROGRESSIVE_SCHEDULE, enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS,
+                          dedup=False):
+        """
+        Train through a progressive-resizing schedule from compiled shards
+        
+        Every phase resizes the shards on the fly to its own size, with its own
+        batch size and augmentation strength (BatchAugmenter.scaled). The model
+        is built for any input size, so weights and optimizer state carry
+        through the phases; validation always runs at the final size. Every
+        phase runs with the standard callbacks (early stopping, learning-rate
+        reduction, best checkpoint), whose patience counts across phase
+        boundaries; early stopping ends the whole schedule. The best weights
+        of any phase are restored and the model is then fixed to the final
+        size for serving.
+        
+        Args:
+            schedule: Schedule string (see app.utils.progressive.parse_schedule) or phase list
+            dedup: Use the lesion-grouped split of dedup_dataset.py (see prepare_datasets)
+        
+        Returns:
+            History with per-epoch elapsed_seconds and img_size
+        """
+        phases = parse_schedule(schedule) if isinstance(schedule, str) else list(schedule)
+        final_size = phases[-1]['size']
+        
+        print("\n" + "="*60)
+        print("Training Model (progressive resizing)")
+        print("="*60)
+        print(f"Schedule: {format_schedule(phases)}")
+        
+        # Compiled once at the largest size; smaller phases downscale on the fly
+        shards = ShardedDataset.open(final_size, enhance, crop_lesion)
+        self.class_labels = {i: label for i, label in enumerate(shards.classes)}
+        idx_train, idx_val = self._split(shards.index['image_id'], shards.labels, dedup)
+        print(f"Train set: {len(idx_train)} images, validation set: {len(idx_val)} images")
+        val_ds = build_shard_dataset(shards, idx_val, batch_size=BATCH_SIZE)
+        
+        self.build_model(len(self.class_labels), img_size=None)
+        self._compile()
+        augmenter = self.get_batch_augmentation()
+        
+        # Shared by the phases: early stopping and LR reduction keep their
+        # wait and best value, the checkpoint its best score, and the reduced
+        # learning rate stays on the optimizer
+        callbacks = self._callbacks(schedule=True)
+        early_stopping = callbacks[0]
+        timer = EpochTimer()
+        history = {}
+        epoch = 0
+        for i, phase in enumerate(phases):
+            print(f"\nPhase {i + 1}/{len(phases)}: {phase['size']}px, batch {phase['batch_size']}, "
+                  f"augmentation {phase['augmentation']:g}")
+            train_ds = build_shard_dataset(
+                shards, idx_train, batch_size=phase['batch_size'], training=True, seed=RANDOM_STATE + i,
+                batch_augment=augmenter.scaled(phase['augmentation']), img_size=phase['size']
+            )
+            throughput = ThroughputCallback(phase['batch_size'])
+            phase_history = self.model.fit(
+                train_ds,
+                validation_data=val_ds,
+                initial_epoch=epoch,
+                epochs=epoch + phase['epochs'],
+                callbacks=callbacks + [timer, throughput],
+                verbose=1
+            )
+            epochs_run = len(phase_history.history['loss'])
+            epoch += epochs_run
+            for key, values in phase_history.history.items():
+                history.setdefault(key, []).extend(float(v) for v in values)
+            history.setdefault('img_size', []).extend([phase['size']] * epochs_run)
+            if early_stopping.stopped_epoch > 0:
+                print(f"Early stopping in phase {i + 1}; skipping the remaining phases")
+                break
+        
+        if early_stopping.restore_best():
+            print(f"Restored the best weights (epoch {early_stopping.best_epoch + 1})")
+        
+        # Serving and evaluation read the input size from the model
+        fixed = tf.keras.models.clone_model(self.model, input_tensors=tf.keras.Input(shape=(final_size, final_size, 3)))
+        fixed.set_weights(self.model.get_weights())
+        self.model = fixed
+        self._compile()
+        
+        self.history = SimpleNamespace(history=history)
+        print(f"\nTraining completed in {timer.elapsed[-1]:.1f}s")
+        
+        return self.history
+    
+    def profile(self, train_ds, steps, use_shards=False, batch_augmentation=True, report_path=PROFILE_REPORT):
+        """
+        Throughput profile of the training path instead of a full run
+        
+        Times read, decode, preprocess, augment, host-to-device transfer and
+        the train step in isolation, then trains `steps` batches from train_ds
+        measuring how long each step waits on the input pipeline, and times
+        every layer of the forward pass. Writes a JSON report to report_path.
+        
+        Returns:
+            Report dict (see app.utils.profiling.build_report)
+        """
+        print("\n" + "="*60)
+        print(f"Profiling Training ({steps} steps)")
+        print("="*60)
+        
+        self._compile()
+        rng = np.random.default_rng(RANDOM_STATE)
+        
+        if use_shards:
+            shards = ShardedDataset.open(IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS)
+            sample = rng.choice(len(shards), min(PROFILE_SAMPLES, len(shards)), replace=False)
+            stage_seconds = time_shard_reads(shards, sample)
+            images = shards.images(sample[:BATCH_SIZE])
+        else:
+            paths = self.load_catalog().paths
+            sample = [paths[i] for i in rng.choice(len(paths), min(PROFILE_SAMPLES, len(paths)), replace=False)]
+            stage_seconds = time_image_stages(sample, IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS)
+            images = np.stack([load_image(p, (IMG_SIZE, IMG_SIZE), enhance=ENHANCE_IMAGES,
+                                          crop_lesion=CROP_LESIONS) for p in sample[:BATCH_SIZE]])
+        labels = np.zeros(len(images), dtype=np.int32)
+        
+        # Same augmentation path as training
+        if batch_augmentation:
+            augmenter = self.get_batch_augmentation()
+            stage_seconds['augment'] = time_batch_fn(augmenter, images, labels) / len(images)
+        else:
+            datagen = self.get_augmentation()
+            batch = images.astype(np.float32)
+            stage_seconds['augment'] = time_batch_fn(
+                lambda: [datagen.random_transform(img) for img in batch]
+            ) / len(images)
+        
+        inputs = images.astype(np.float32) / 255.0
+        stage_seconds['transfer'] = time_transfer(inputs)
+        stage_seconds['step'] = time_train_step(self.model, inputs, labels)
+        
+        training = profile_training_steps(self.model, train_ds, steps)
+        hotspots = layer_hotspots(self.model, inputs)
+        
+        report = build_report(stage_seconds, len(images), training, hotspots)
+        print(format_report(report))
+        
+        save_report(report, report_path)
+        print(f"\nProfile saved to {report_path}")
+        
+        return report
+    
+    def cached_features(self, views=FEATURE_VIEWS, use_shards=False):
+        """
+        Pooled backbone features for every image, extracted once and cached
+        
+        The frozen backbone runs once per image for the unaugmented view and
+        each of `views` augmented views; the features are cached under
+        ml_models/feature_cache and reused by later runs with the same data and
+        preprocessing. Builds the model (self.base_model) as a side effect.
+        
+        Args:
+            views: Augmented views per image (view 0 is always unaugmented)
+            use_shards: Read memory-mapped shards from compile_dataset.py instead of JPEGs
+        
+        Returns:
+            Tuple of (features [views + 1, N, D], labels, groups)
+        """
+        print("\n" + "="*60)
+        print("Caching Backbone Features")
+        print("="*60)
+        
+        datagen = self.get_augmentation()
+        augmenter = self.get_batch_augmentation()
+        
+        def augment_fn(view):
+            return augmenter if view > 0 else None
+        
+        if use_shards:
+            shards = ShardedDataset.open(IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS)
+            classes, labels, groups = shards.classes, shards.labels, shards.groups
+            source_hash = shards.config['catalog_hash']
+            indices = np.arange(len(shards))
+            
+            def make_view_dataset(view):
+                return build_shard_dataset(shards, indices, batch_size=BATCH_SIZE, batch_augment=augment_fn(view))
+        else:
+            catalog = self.load_catalog()
+            classes, labels, groups = catalog.classes, catalog.labels, catalog.groups
+            source_hash = catalog_hash(catalog)
+            paths = catalog.paths
+            
+            def make_view_dataset(view):
+                return build_dataset(paths, labels, img_size=IMG_SIZE, batch_size=BATCH_SIZE,
+                                     batch_augment=augment_fn(view), enhance=ENHANCE_IMAGES,
+                                     crop_lesion=CROP_LESIONS, skip_unreadable=False)
+        
+        self.class_labels = {i: label for i, label in enumerate(classes)}
+        print(f"Images: {len(labels)}, views per image: {views + 1}")
+        print(f"Classes: {self.class_labels}")
+        
+        self.build_model(len(classes))
+        config = {
+            'backbone': self.base_model.name,
+            'img_size': IMG_SIZE,
+            'enhance': enhancement_key(ENHANCE_IMAGES),
+            'crop_lesion': bool(CROP_LESIONS),
+            'augmentation': {'rotation_range': datagen.rotation_range,
+                             'shift_range': [datagen.width_shift_range, datagen.height_shift_range],
+                             'zoom_range': list(map(float, datagen.zoom_range)),
+                             'horizontal_flip': datagen.horizontal_flip},
+            'seed': RANDOM_STATE,
+            'catalog_hash': source_hash,
+        }
+        if self.precision != 'float32':
+            # Reduced-precision features are cached separately
+            config['precision'] = self.precision
+        extractor = pooled_feature_extractor(self.base_model)
+        features = load_or_extract_features(extractor, make_view_dataset, views, config)
+        self.feature_dir = feature_cache_dir(config)
+        
+        return features, labels, groups
+    
+    def train_from_features(self, views=FEATURE_VIEWS, use_shards=False, dedup=False):
+        """
+        Train only the head on cached backbone features (see cached_features)
+        
+        The trained head is reattached to the backbone, so self.model is a
+        complete servable model afterwards. Validation holds out whole lesions
+        (grouped_split), as in run_experiments.py, so several images of one
+        lesion never sit on both sides; with dedup it is the manifest split.
+        
+        Returns:
+            Tuple of (val_features, y_val) for evaluating the head
+        """
+        features, labels, groups = self.cached_features(views, use_shards)
+        
+        print("\n" + "="*60)
+        print("Training Head on Cached Features")
+        print("="*60)
+        
+        # Split by lesion so augmented views of a validation image (or other
+        # images of its lesion) never reach training
+        if dedup:
+            image_ids = ShardedDataset.open(IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS).index['image_id'] if use_shards \
+                else self.load_catalog().frame.index
+            idx_train, idx_val = self._split(image_ids, labels, dedup)
+        else:
+            val = grouped_split(labels, groups, VALIDATION_SPLIT, RANDOM_STATE)
+            idx_train, idx_val = np.flatnonzero(~val), np.flatnonzero(val)
+        X_train, y_train = stack_views(features, labels, idx_train)
+        X_val, y_val = stack_views(features, labels, idx_val, include_augmented=False)
+        print(f"\nTrain set: {len(idx_train)} images ({len(X_train)} feature vectors)")
+        print(f"Validation set: {len(idx_val)} images")
+        
+        head = self.model.get_layer('head')
+        self._compile(head)
+        self.history = head.fit(
+            X_train, y_train,
+            validation_data=(X_val, y_val),
+            batch_size=BATCH_SIZE,
+            epochs=FEATURE_HEAD_EPOCHS,
+            shuffle=True,
+            class_weight=class_weights(y_train, len(self.class_labels), self.head_config.get('class_weight')),
+            callbacks=self._callbacks(checkpoint=False),
+            verbose=2
+        )
+        
+        # self.model shares the head layer, so it already carries the trained weights
+        self._compile()
+        print("\nHead training completed!")
+        
+        return X_val, y_val
+    
+    def train_distilled(self, teacher_path, student=DISTILL_STUDENT, temperature=DISTILL_TEMPERATURE,
+                        alpha=DISTILL_ALPHA, use_shards=False, model_path=STUDENT_MODEL_PATH,
+                        report_path=DISTILL_REPORT, dedup=False):
+        """
+        Distill a large teacher into a small student on HAM10000
+        
+        The teacher runs once over every HAM10000 image at its own input size;
+        its log-probabilities are cached under ml_models/teacher_logits (keyed by
+        teacher file hash, data and preprocessing), so distillation epochs and
+        later runs never evaluate it again. The student trains at IMG_SIZE on
+        augmented images against the label and the teacher's soft targets, is
+        saved to model_path for SkinDiseasePredictor, and is compared with the
+        teacher on the validation split. That is the HAM10000 part of the split
+        the teacher was trained on, so pass the same use_shards and dedup as
+        its training run.
+        
+        Args:
+            teacher_path: Trained teacher model (softmax output, same classes)
+            student: Student backbone, a key of STUDENT_BACKBONES
+            temperature: Softmax temperature for the soft targets
+            alpha: Weight of the hard-label loss (1 - alpha goes to the soft targets)
+            use_shards: Read memory-mapped shards from compile_dataset.py instead of JPEGs
+            model_path: Where to save the student
+            report_path: Latency/accuracy report JSON
+            dedup: Use the lesion-grouped split of dedup_dataset.py (see prepare_datasets)
+        
+        Returns:
+            Report dict (see app.utils.distillation.build_distillation_report)
+        """
+        print("\n" + "="*60)
+        print("Knowledge Distillation")
+        print("="*60)
+        
+        teacher = tf.keras.models.load_model(teacher_path, compile=False)
+        teacher_size = int(teacher.input_shape[1])
+        augmenter = self.get_batch_augmentation()
+        
+        if use_shards:
+            shards = ShardedDataset.open(IMG_SIZE, ENHANCE_IMAGES, CROP_LESIONS)
+            rows = shards.subset_indices('HAM10000')
+            classes, labels = shards.classes, shards.labels[rows]
+            all_ids, all_labels = shards.index['image_id'], shards.labels
+            source_hash = shards.config['catalog_hash']
+            
+            # The teacher may need shards compiled at its own input size
+            teacher_shards = shards
+            if teacher_size != IMG_SIZE:
+                teacher_shards = ShardedDataset.open(teacher_size, ENHANCE_IMAGES, CROP_LESIONS)
+            teacher_rows = pd.Index(teacher_shards.index['image_id']).get_indexer(
+                shards.index['image_id'].to_numpy()[rows]
+            )
+            if (teacher_rows < 0).any():
+                raise ValueError(f"Shards at {teacher_size}px lack {int((teacher_rows < 0).sum())} images; "
+                                 f"recompile with compile_dataset.py --size {teacher_size}")
+            
+            def make_teacher_dataset(view):
+                return build_shard_dataset(teacher_shards, teacher_rows, batch_size=BATCH_SIZE)
+            
+            def make_dataset(positions, targets=None, training=False):
+                return build_shard_dataset(shards, rows[positions], batch_size=BATCH_SIZE, training=training,
+                                           seed=RANDOM_STATE, batch_augment=augmenter if training else None,
+                                           labels=targets)
+        else:
+            full = self.load_catalog()
+            catalog = full.subset('HAM10000')
+            classes, labels, paths = catalog.classes, catalog.labels, catalog.paths
+            rows = full.frame.index.get_indexer(catalog.frame.index)
+            all_ids, all_labels = full.frame.index, full.labels
+            source_hash = catalog_hash(catalog)
+            
+            def make_teacher_dataset(view):
+                return build_dataset(paths, labels, img_size=teacher_size, batch_size=BATCH_SIZE,
+                                     enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS, skip_unreadable=False)
+            
+            def make_dataset(positions, targets=None, training=False):
+                return build_dataset(paths[positions], labels[positions] if targets is None else targets,
+                                     img_size=IMG_SIZE, batch_size=BATCH_SIZE, training=training,
+                                     seed=RANDOM_STATE, batch_augment=augmenter if training else None,
+                                     enhance=ENHANCE_IMAGES, crop_lesion=CROP_LESIONS)
+        
+        num_classes = len(classes)
+        if teacher.output_shape[-1] != num_classes:
+            raise ValueError(f"Teacher predicts {teacher.output_shape[-1]} classes, the data has {num_classes}")
+        self.class_labels = {i: label for i, label in enumerate(classes)}
+        print(f"HAM10000 images: {len(labels)}")
+        print(f"Teacher: {teacher_path} ({teacher.count_params():,} parameters, {teacher_size}px)")
+        print(f"Student: {student} at {IMG_SIZE}px, T={temperature:g}, alpha={alpha:g}")
+        
+        config = {
+            'backbone': 'teacher',
+            'teacher_version': model_version(teacher_path),
+            'img_size': teacher_size,
+            'enhance': enhancement_key(ENHANCE_IMAGES),
+            'crop_lesion': bool(CROP_LESIONS),
+            'subset': 'HAM10000',
+            'catalog_hash': source_hash,
+        }
+        teacher_logits = teacher_log_probabilities(teacher, make_teacher_dataset, config)
+        targets = pack_targets(labels, teacher_logits)
+        
+        # The teacher's split (prepare_datasets over both datasets) restricted to
+        # HAM10000, so the teacher is never scored on images it trained on
+        train_all, val_all = self._split(all_ids, all_labels, dedup)
+        idx_train, idx_val = np.flatnonzero(np.isin(rows, train_all)), np.flatnonzero(np.isin(rows, val_all))
+        print(f"\nTrain set: {len(idx_train)} images")
+        print(f"Validation set: {len(idx_val)} images")
+        
+        tf.keras.mixed_precision.set_global_policy(self.precision)
+        self.model = build_student(student, num_classes, IMG_SIZE, self.head_config)
+        print(f"Student parameters: {self.model.count_params():,}")
+        self.model.compile(
+            optimizer=Adam(learning_rate=DISTILL_LEARNING_RATE),
+            loss=distillation_loss(temperature, alpha),
+            metrics=[label_accuracy, teacher_agreement],
+            jit_compile=self.jit_compile
+        )
+        self.history = self.model.fit(
+            make_dataset(idx_train, targets[idx_train], training=True),
+            validation_data=make_dataset(idx_val, targets[idx_val]),
+            epochs=EPOCHS,
+            callbacks=self._callbacks(checkpoint=False),
+            verbose=1
+        )
+        
+        # Plain loss for the saved artifact, so it loads without the distillation objects
+        self._compile()
+        self.save_model(model_path)
+        
+        print("\n" + "="*60)
+        print("Student vs Teacher")
+        print("="*60)
+        
+        # The teacher is scored from its cached outputs; only the student runs here
+        student_eval = evaluate_dataset(self.model, make_dataset(idx_val), num_classes)
+        teacher_eval = StreamingEvaluator.from_predictions(labels[idx_val], np.exp(teacher_logits[idx_val]),
+                                                           num_classes)
+        agreement = float(np.mean(student_eval.probabilities.argmax(axis=1) ==
+                                  teacher_logits[idx_val].argmax(axis=1)))
+        print(format_metrics(student_eval.result(), class_names=classes))
+        
+        report = build_distillation_report(
+            teacher={**model_summary(teacher, teacher_eval.result(), teacher_path), **measure_latency(teacher)},
+            student={**model_summary(self.model, student_eval.result(), model_path),
+                     **measure_latency(self.model)},
+            agreement=agreement,
+            config={'teacher': str(teacher_path), 'student': student, 'temperature': temperature,
+                    'alpha': alpha, 'epochs': len(self.history.history['loss']),
+                    'validation_images': int(len(idx_val))}
+        )
+        print("\n" + format_distillation_report(report))
+        
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {report_path}")
+        
+        return report
+    
+    def train_resumable(self, read_train, y_train, val_ds, checkpoint_dir=CHECKPOINT_DIR,
+                        checkpoint_every=CHECKPOINT_EVERY):
+        """
+        Train with full training-state checkpoints (see prepare_resumable)
+        
+        Every checkpoint_every steps, at each epoch end and on Ctrl+C, the model
+        and optimizer variables, learning-rate and early-stopping state and the
+        position in the epoch are saved to checkpoint_dir in the background.
+        Running again with the same directory resumes at the saved step; data
+        order and augmentation are functions of (seed, epoch), so the resumed
+        run sees the same batches as an uninterrupted one.
+        """
+        print("\n" + "="*60)
+        print("Training Model (resumable)")
+        print("="*60)
+        
+        self._compile()
+        manager = CheckpointManager(checkpoint_dir)
+        state = manager.restore(self.model)
+        if state is None:
+            state = TrainingState(seed=RANDOM_STATE, learning_rate=float(self.model.optimizer.learning_rate.numpy()))
+            print(f"Starting new run, checkpoints in {checkpoint_dir}")
+        else:
+            print(f"Resuming from {manager.latest()}: epoch {state.epoch + 1}, step {state.step}")
+        
+        augmenter = self.get_batch_augmentation()
+        steps_per_epoch = (self.sampler.epoch_size if self.sampler else len(y_train)) // BATCH_SIZE
+        
+        try:
+            while state.epoch < EPOCHS and not state.stopped:
+                print(f"\nEpoch {state.epoch + 1}/{EPOCHS}")
+                train_ds = build_epoch_dataset(
+                    read_train, y_train, IMG_SIZE, state.epoch, batch_size=BATCH_SIZE,
+                    seed=state.seed, start_step=state.step, augmenter=augmenter, sampler=self.sampler
+                )
+                for x, y in train_ds:
+                    logs = self.model.train_on_batch(x, y, return_dict=True)
+                    state.step += 1
+                    state.global_step += 1
+                    state.loss_sum += float(logs['loss'])
+                    state.accuracy_sum += float(logs['accuracy'])
+                    if state.step % checkpoint_every == 0:
+                        manager.save(self.model, state)
+                        print(f"  step {state.step}/{steps_per_epoch} - "
+                              f"loss: {state.loss_sum / state.step:.4f} (checkpoint)")
+                
+                if self.sampler is not None:
+                    print(self.sampler.report(state.epoch, self.class_labels))
+                self._end_epoch(state, steps_per_epoch, val_ds, manager)
+                manager.save(self.model, state)
+        except KeyboardInterrupt:
+            manager.save(self.model, state)
+            manager.close()
+            print(f"\nInterrupted at epoch {state.epoch + 1}, step {state.step}; run again to resume")
+            raise
+        
+        manager.close()
+        
+        # EarlyStopping(restore_best_weights=True)
+        if state.best_epoch >= 0 and state.best_epoch != state.epoch - 1:
+            manager.restore(self.model, 'best')
+            print(f"Restored weights from epoch {state.best_epoch + 1}")
+        
+        self.history = SimpleNamespace(history=state.history)
+        print("\nTraining completed!")
+        
+        return self.history
+    
+    def train_distributed(self, strategy, train_ds, val_ds, train_size, benchmark_steps=None):
+        """
+        Synchronous data-parallel training, run by every worker (see app.utils.distributed)
+        
+        Each worker trains on its own shard from prepare_datasets(shard=...)
+        with the usual per-worker batch size; gradients are all-reduced every
+        step, so the global batch is BATCH_SIZE x workers. The model must have
+        been built and compiled under strategy.scope(). Early stopping,
+        learning-rate reduction and best-weight restoring follow the Keras
+        callbacks, on validation metrics all-reduced over the workers' shards;
+        only the chief writes ml_models/best_model.h5.
+        
+        Args:
+            strategy: MultiWorkerMirroredStrategy from create_strategy()
+            train_ds: This worker's training pipeline
+            val_ds: This worker's validation pipeline
+            train_size: Images in this worker's training shard
+            benchmark_steps: Only time this many steps (after warm-up) and
+                return the throughput instead of training
+        
+        Returns:
+            The history, or the benchmark result dict
+        """
+        index, count = worker_info()
+        chief = index == 0
+        num_classes = len(self.class_labels)
+        global_batch = BATCH_SIZE * count
+        
+        print("\n" + "="*60)
+        print(f"Training Model (distributed, {count} workers)")
+        print("="*60)
+        
+        # Shards differ by at most one image; every worker must run the same number of steps
+        local_size = self.sampler.epoch_size if self.sampler else train_size
+        total_size = int(all_reduce_sum(strategy, [local_size])[0])
+        steps_per_epoch = (total_size // count) // BATCH_SIZE
+        print(f"Global batch {global_batch} ({BATCH_SIZE} per worker), {steps_per_epoch} steps per epoch")
+        
+        with strategy.scope():
+            self.model.optimizer.build(self.model.trainable_variables)
+        step = distributed_train_step(strategy, self.model, global_batch)
+        iterator = iter(strategy.distribute_datasets_from_function(lambda context: train_ds.repeat()))
+        
+        if benchmark_steps:
+            # Warm-up: graph tracing and pipeline start-up are not steady state
+            for _ in range(2):
+                step(iterator)
+            start = time.perf_counter()
+            for _ in range(benchmark_steps):
+                loss_sum, _ = step(iterator)
+            float(loss_sum)
+            elapsed = time.perf_counter() - start
+            return {
+                'workers': count,
+                'cores_per_worker': len(available_cores()),
+                'global_batch': global_batch,
+                'steps': benchmark_steps,
+                'step_ms': 1000 * elapsed / benchmark_steps,
+                'images_per_sec': global_batch * benchmark_steps / elapsed,
+            }
+        
+        state = TrainingState(seed=RANDOM_STATE, learning_rate=float(self.model.optimizer.learning_rate.numpy()))
+        best_weights = None
+        while state.epoch < EPOCHS and not state.stopped:
+            print(f"\nEpoch {state.epoch + 1}/{EPOCHS}")
+            start = time.perf_counter()
+            for _ in range(steps_per_epoch):
+                loss_sum, correct = step(iterator)
+                state.step += 1
+                state.global_step += 1
+                state.loss_sum += float(loss_sum) / global_batch
+                state.accuracy_sum += float(correct) / global_batch
+            elapsed = time.perf_counter() - start
+            
+            val_loss, val_accuracy = distributed_evaluate(strategy, self.model, val_ds, num_classes)
+            best_epoch = state.best_epoch
+            self._record_epoch(state, steps_per_epoch, val_loss, val_accuracy, checkpoint=chief)
+            if state.best_epoch != best_epoch:
+                best_weights = self.model.get_weights()
+            print(f"  {steps_per_epoch * global_batch / elapsed:.1f} images/sec")
+        
+        # EarlyStopping(restore_best_weights=True)
+        if best_weights is not None and state.best_epoch != state.epoch - 1:
+            self.model.set_weights(best_weights)
+            print(f"Restored weights from epoch {state.best_epoch + 1}")
+        
+        self.history = SimpleNamespace(history=state.history)
+        print("\nTraining completed!")
+        
+        return self.history
+    
+    def _end_epoch(self, state, steps_per_epoch, val_ds, manager):
+        """Validation, checkpointing, LR reduction and early stopping for train_resumable"""
+        val = self.model.evaluate(val_ds, return_dict=True, verbose=0)
+        self._record_epoch(state, steps_per_epoch, val['loss'], val['accuracy'],
+                           save_best=lambda: manager.save(self.model, state, tag='best'))
+    
+    def _record_epoch(self, state, steps_per_epoch, val_loss, val_accuracy, save_best=None, checkpoint=True):
+        """
+        Epoch-end bookkeeping of the custom training loops on a TrainingState
+        
+        Records history, saves ml_models/best_model.h5 when checkpoint is set,
+        calls save_best on a new best val_loss, and applies the
+        ReduceLROnPlateau / EarlyStopping schedule.
+        """
+        state.history['loss'].append(state.loss_sum / max(steps_per_epoch, 1))
+        state.history['accuracy'].append(state.accuracy_sum / max(steps_per_epoch, 1))
+        state.history['val_loss'].append(val_loss)
+        state.history['val_accuracy'].append(val_accuracy)
+        state.history['learning_rate'].append(state.learning_rate)
+        print(f"  loss: {state.history['loss'][-1]:.4f} - accuracy: {state.history['accuracy'][-1]:.4f} - "
+              f"val_loss: {val_loss:.4f} - val_accuracy: {val_accuracy:.4f}")
+        
+        # ModelCheckpoint(monitor='val_accuracy', save_best_only=True)
+        if val_accuracy > state.best_val_accuracy:
+            state.best_val_accuracy = val_accuracy
+            if checkpoint:
+                self.model.save('ml_models/best_model.h5')
+        
+        if val_loss < state.best_val_loss:
+            state.best_val_loss = val_loss
+            state.best_epoch = state.epoch
+            state.stop_wait = 0
+            state.lr_wait = 0
+            if save_best is not None:
+                save_best()
+        else:
+            state.stop_wait += 1
+            state.lr_wait += 1
+            if state.lr_wait >= LR_PATIENCE:
+                new_lr = max(state.learning_rate * LR_FACTOR, MIN_LR)
+                if new_lr < state.learning_rate:
+                    state.learning_rate = new_lr
+                    self.model.optimizer.learning_rate.assign(new_lr)
+                    print(f"  Reducing learning rate to {new_lr:.2e}")
+                state.lr_wait = 0
+            if state.stop_wait >= EARLY_STOPPING_PATIENCE:
+                state.stopped = True
+                print(f"  Early stopping, best epoch {state.best_epoch + 1}")
+        
+        state.epoch += 1
+        state.step = 0
+        state.loss_sum = 0.0
+        state.accuracy_sum = 0.0
+    
+    def evaluate(self, X_val, y_val=None, predictions_path=EVAL_PREDICTIONS):
+        """
+        Evaluate model on arrays, or on a dataset when y_val is None
+        
+        Datasets are evaluated batch by batch (StreamingEvaluator), so they
+        never have to fit in memory. Prints per-class precision/recall/F1 with
+        bootstrap intervals and AUC, and saves the predictions to
+        predictions_path.
+        """
         print("\n" + "="*60)
         print("Evaluating Model")
         print("="*60)
         
-        loss, accuracy = self.model.evaluate(X_val, y_val, verbose=0)
+        num_classes = len(self.class_labels)
+        if y_val is None:
+            evaluator = evaluate_dataset(self.model, X_val, num_classes)
+        else:
+            evaluator = StreamingEvaluator.from_predictions(y_val, self.model.predict(X_val, verbose=0), num_classes)
+        
+        metrics = evaluator.result()
+        class_names = [self.class_labels[i] for i in range(num_classes)]
+        print(format_metrics(metrics, evaluator.bootstrap(), class_names))
+        
+        if predictions_path:
+            evaluator.save(predictions_path)
+            print(f"Predictions saved to {predictions_path}")
+        
+        loss, accuracy = metrics['loss'], metrics['accuracy']
         print(f"Validation Loss: {loss:.4f}")
         print(f"Validation Accuracy: {accuracy:.4f}")
         
@@ -330,34 +1285,230 @@ class SkinDiseaseTrainer:
         plt.close()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the skin disease classifier")
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Load every image into RAM first (legacy path)')
+    parser.add_argument('--cache', choices=['disk', 'memory', 'none'], default='disk',
+                        help='Decoded-image cache for the streaming pipeline')
+    parser.add_argument('--augmentation', choices=['batch', 'generator'], default='batch',
+                        help='Augment whole batches, or per image with ImageDataGenerator')
+    parser.add_argument('--shards', action='store_true',
+                        help='Train from shards compiled by compile_dataset.py')
+    parser.add_argument('--precision', choices=PRECISION_POLICIES, default='float32',
+                        help='Dtype policy: mixed_bfloat16 for CPUs with AVX-512 BF16/AMX, '
+                             'mixed_float16 for GPUs (softmax stays float32)')
+    parser.add_argument('--jit-compile', action='store_true',
+                        help='Compile the train step with XLA (check benchmark_training.py precision '
+                             'first: XLA convolutions on CPU can be slower than oneDNN)')
+    parser.add_argument('--balanced-sampling', type=float, nargs='?', const=0.0, default=None,
+                        metavar='ALPHA',
+                        help='Draw training batches with class probability proportional to '
+                             'count**ALPHA (default 0: balanced; 0.5: square-root smoothing)')
+    parser.add_argument('--feature-cache', type=int, nargs='?', const=FEATURE_VIEWS, default=None,
+                        metavar='VIEWS',
+                        help='Train only the head on cached backbone features with VIEWS augmented '
+                             f'views per image (default {FEATURE_VIEWS})')
+    parser.add_argument('--head-config', nargs='?', const=str(BEST_CONFIG_PATH), default=None,
+                        metavar='PATH',
+                        help='Head hyperparameters exported by run_experiments.py --export '
+                             f'(default {BEST_CONFIG_PATH.name})')
+    parser.add_argument('--distill', metavar='TEACHER', default=None,
+                        help=f'Distill the TEACHER model into a small student on HAM10000, save it to '
+                             f'{STUDENT_MODEL_PATH} and write {DISTILL_REPORT} (give the --shards and '
+                             f'--dedup the teacher was trained with, so it is evaluated on its own split)')
+    parser.add_argument('--student', choices=sorted(STUDENT_BACKBONES), default=DISTILL_STUDENT,
+                        help='Student backbone for --distill')
+    parser.add_argument('--temperature', type=float, default=DISTILL_TEMPERATURE,
+                        help='Softmax temperature of the soft targets for --distill')
+    parser.add_argument('--distill-alpha', type=float, default=DISTILL_ALPHA,
+                        help='Weight of the hard-label loss for --distill (the rest goes to the teacher)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Train on the deduplicated, lesion-grouped split from dedup_dataset.py')
+    parser.add_argument('--progressive', nargs='?', const=PROGRESSIVE_SCHEDULE, default=None, metavar='SCHEDULE',
+                        help=f'Progressive resizing from shards compiled at the last phase size, as '
+                             f'size:batch_size:epochs[:augmentation] phases (default: {PROGRESSIVE_SCHEDULE})')
+    parser.add_argument('--workers', type=int, default=None, metavar='N',
+                        help='Data-parallel training in N local worker processes, each pinned to its '
+                             'own cores and reading its own data shard')
+    parser.add_argument('--benchmark-distributed', type=int, default=None, metavar='STEPS',
+                        help=f'With --workers: time STEPS training steps, write the throughput to '
+                             f'{DISTRIBUTED_SCALING_DIR} and exit (see benchmark_training.py scaling)')
+    parser.add_argument('--checkpoint-dir', nargs='?', const=CHECKPOINT_DIR, default=None, metavar='DIR',
+                        help='Resumable training with full state checkpoints in DIR '
+                             f'(default {CHECKPOINT_DIR}); resumes if DIR has a checkpoint')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY, metavar='STEPS',
+                        help='Steps between mid-epoch checkpoints')
+    parser.add_argument('--profile', type=int, nargs='?', const=50, default=None, metavar='STEPS',
+                        help='Profile each training stage over STEPS steps (default 50), '
+                             f'write {PROFILE_REPORT} and exit')
+    parser.add_argument('--benchmark-input', type=int, default=0, metavar='STEPS',
+                        help='Report input pipeline images/sec over STEPS batches before training')
+    args = parser.parse_args()
+    if args.dedup and args.in_memory:
+        parser.error('--dedup needs the catalog split; it does not apply to --in-memory')
+    return args
+
+
 def main():
     """Main training pipeline"""
+    args = parse_args()
+    
+    if args.workers and 'TF_CONFIG' not in os.environ:
+        # Launcher: re-run this command once per worker; TF_CONFIG marks the workers
+        print(f"Launching {args.workers} training workers")
+        codes = launch_workers([os.path.abspath(__file__)] + sys.argv[1:], args.workers, DISTRIBUTED_LOG_DIR)
+        if any(codes):
+            print(f"Error: worker exit codes {codes}; see {DISTRIBUTED_LOG_DIR}")
+            sys.exit(1)
+        return
+    
+    # Workers: the strategy has to exist before any other TensorFlow op runs
+    strategy = create_strategy() if 'TF_CONFIG' in os.environ else None
+    
     print("\n" + "="*60)
     print("SKIN DISEASE CLASSIFICATION MODEL TRAINING")
     print("="*60)
     
-    trainer = SkinDiseaseTrainer()
+    head_config = None
+    if args.head_config:
+        with open(args.head_config, 'r') as f:
+            head_config = json.load(f)['config']
+        print(f"Head config: {head_config}")
     
-    # Load data
-    X_ham, y_ham, _ = trainer.load_ham10000_data()
-    X_isic, y_isic, _ = trainer.load_isic2018_data()
+    trainer = SkinDiseaseTrainer(head_config, precision=args.precision, jit_compile=args.jit_compile)
     
-    if len(X_ham) == 0:
-        print("Error: No images loaded. Please check dataset paths.")
+    if args.distill:
+        if not args.shards and len(trainer.load_catalog()) == 0:
+            print("Error: No images found. Please check dataset paths.")
+            return
+        
+        tf.keras.utils.set_random_seed(RANDOM_STATE)
+        trainer.train_distilled(args.distill, student=args.student, temperature=args.temperature,
+                                alpha=args.distill_alpha, use_shards=args.shards, dedup=args.dedup)
+        
+        print("\n" + "="*60)
+        print("DISTILLATION COMPLETE!")
+        print("="*60)
+        print(f"Student saved to: {STUDENT_MODEL_PATH}")
+        print(f"Serve it with SkinDiseasePredictor(model_path='{STUDENT_MODEL_PATH}')")
         return
     
-    # Prepare data
-    X_train, X_val, y_train, y_val = trainer.prepare_data(X_ham, y_ham, X_isic, y_isic)
-    
-    # Build model
-    num_classes = len(np.unique(y_train))
-    trainer.build_model(num_classes)
-    
-    # Train
-    trainer.train(X_train, X_val, y_train, y_val)
-    
-    # Evaluate
-    trainer.evaluate(X_val, y_val)
+    if strategy is not None:
+        if not args.shards and len(trainer.load_catalog()) == 0:
+            print("Error: No images found. Please check dataset paths.")
+            return
+        
+        # Same initial weights on every worker
+        tf.keras.utils.set_random_seed(RANDOM_STATE)
+        index, count = worker_info()
+        train_ds, val_ds, y_train, _ = trainer.prepare_datasets(
+            cache=args.cache, use_shards=args.shards, batch_augmentation=args.augmentation == 'batch',
+            sampling_alpha=args.balanced_sampling, shard=(index, count), dedup=args.dedup
+        )
+        with strategy.scope():
+            trainer.build_model(len(trainer.class_labels))
+            trainer._compile()
+        result = trainer.train_distributed(strategy, train_ds, val_ds, len(y_train),
+                                           benchmark_steps=args.benchmark_distributed)
+        
+        if args.benchmark_distributed:
+            if is_chief():
+                os.makedirs(DISTRIBUTED_SCALING_DIR, exist_ok=True)
+                path = os.path.join(DISTRIBUTED_SCALING_DIR, f"workers_{count}.json")
+                with open(path, 'w') as f:
+                    json.dump(result, f, indent=2)
+                print(f"\n{result['images_per_sec']:.1f} images/sec with {count} workers, saved to {path}")
+            return
+        
+        loss, accuracy = result.history['val_loss'][-1], result.history['val_accuracy'][-1]
+        print(f"Validation Loss (all workers): {loss:.4f}")
+        print(f"Validation Accuracy (all workers): {accuracy:.4f}")
+        if not is_chief():
+            return
+    elif args.progressive:
+        # Seeds weight initialisation and the per-phase shuffles
+        tf.keras.utils.set_random_seed(RANDOM_STATE)
+        trainer.train_progressive(args.progressive, dedup=args.dedup)
+        shards = ShardedDataset.open(trainer.model.input_shape[1], ENHANCE_IMAGES, CROP_LESIONS)
+        _, idx_val = trainer._split(shards.index['image_id'], shards.labels, args.dedup)
+        trainer.evaluate(build_shard_dataset(shards, idx_val, batch_size=BATCH_SIZE))
+    elif args.feature_cache is not None:
+        if not args.shards and len(trainer.load_catalog()) == 0:
+            print("Error: No images found. Please check dataset paths.")
+            return
+        
+        # Backbone once per view, then head-only epochs on the cached features
+        X_val, y_val = trainer.train_from_features(views=args.feature_cache, use_shards=args.shards,
+                                                   dedup=args.dedup)
+        
+        # Evaluate the head on the unaugmented validation features
+        head = trainer.model.get_layer('head')
+        loss, accuracy = head.evaluate(X_val, y_val, verbose=0)
+        print(f"Validation Loss: {loss:.4f}")
+        print(f"Validation Accuracy: {accuracy:.4f}")
+    elif args.checkpoint_dir:
+        if not args.shards and len(trainer.load_catalog()) == 0:
+            print("Error: No images found. Please check dataset paths.")
+            return
+        
+        # Seeds weight initialisation; restored variables replace it on resume
+        tf.keras.utils.set_random_seed(RANDOM_STATE)
+        read_train, y_train, val_ds, y_val = trainer.prepare_resumable(
+            use_shards=args.shards, sampling_alpha=args.balanced_sampling, dedup=args.dedup
+        )
+        trainer.build_model(len(trainer.class_labels))
+        trainer.train_resumable(read_train, y_train, val_ds, args.checkpoint_dir, args.checkpoint_every)
+        trainer.evaluate(val_ds)
+    elif args.in_memory:
+        # Load data
+        X_ham, y_ham, _ = trainer.load_ham10000_data()
+        X_isic, y_isic, _ = trainer.load_isic2018_data()
+        
+        if len(X_ham) == 0:
+            print("Error: No images loaded. Please check dataset paths.")
+            return
+        
+        # Prepare data
+        X_train, X_val, y_train, y_val = trainer.prepare_data(X_ham, y_ham, X_isic, y_isic)
+        
+        # Build model
+        num_classes = len(np.unique(y_train))
+        trainer.build_model(num_classes)
+        
+        # Train
+        trainer.train(X_train, X_val, y_train, y_val)
+        
+        # Evaluate
+        trainer.evaluate(X_val, y_val)
+    else:
+        if not args.shards and len(trainer.load_catalog()) == 0:
+            print("Error: No images found. Please check dataset paths.")
+            return
+        
+        # Prepare streaming data
+        train_ds, val_ds, y_train, y_val = trainer.prepare_datasets(
+            cache=args.cache, use_shards=args.shards, batch_augmentation=args.augmentation == 'batch',
+            sampling_alpha=args.balanced_sampling, dedup=args.dedup
+        )
+        
+        if args.benchmark_input:
+            images_per_sec, images = measure_throughput(train_ds, args.benchmark_input)
+            print(f"\nInput pipeline: {images_per_sec:.1f} images/sec over {images} images")
+        
+        # Build model
+        trainer.build_model(len(trainer.class_labels))
+        
+        if args.profile:
+            trainer.profile(train_ds, args.profile, use_shards=args.shards,
+                            batch_augmentation=args.augmentation == 'batch')
+            return
+        
+        # Train
+        trainer.train_streaming(train_ds, val_ds)
+        
+        # Evaluate
+        trainer.evaluate(val_ds)
     
     # Save
     trainer.save_model()